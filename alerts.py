@@ -0,0 +1,91 @@
+"""Unusual trade movement alerts: period changes classified as whole-array operations"""
+import json
+import os
+
+import numpy as np
+
+from pages.periods import compare_periods
+
+ALERT_INCREASE = '🔴 Extreme Increase'
+ALERT_DECREASE = '🟠 Extreme Decrease'
+ALERT_MIXED = '🟡 Mixed Signal'
+ALERT_NORMAL = '🟢 Normal Movement'
+
+# Severity order, most severe first
+ALERT_ORDER = [ALERT_INCREASE, ALERT_DECREASE, ALERT_MIXED, ALERT_NORMAL]
+
+# % change beyond which a movement is extreme
+DEFAULT_THRESHOLDS = {'increase': 40.0, 'decrease': -40.0}
+
+# JSON file overriding the thresholds per flow ('E', 'I', 'R') and per analysis level
+# ('sitc', 'country'); the level wins over the flow, e.g.
+#   {"default": {"increase": 40, "decrease": -40},
+#    "flows": {"R": {"increase": 60, "decrease": -60}},
+#    "levels": {"country": {"decrease": -50}}}
+THRESHOLDS_ENV = 'ALERT_THRESHOLDS_FILE'
+
+
+def load_thresholds(path=None):
+    """Threshold config: the defaults, overridden by the JSON file at `path` or $ALERT_THRESHOLDS_FILE"""
+    config = {'default': dict(DEFAULT_THRESHOLDS), 'flows': {}, 'levels': {}}
+
+    path = path or os.environ.get(THRESHOLDS_ENV)
+    if path:
+        with open(path) as f:
+            overrides = json.load(f)
+        config['default'].update(overrides.get('default', {}))
+        config['flows'].update(overrides.get('flows', {}))
+        config['levels'].update(overrides.get('levels', {}))
+
+    return config
+
+
+THRESHOLDS = load_thresholds()
+
+
+def thresholds_for(flow, level, config=THRESHOLDS):
+    """{'increase': ..., 'decrease': ...} for a flow and analysis level"""
+    thresholds = dict(config['default'])
+    thresholds.update(config['flows'].get(flow, {}))
+    thresholds.update(config['levels'].get(level, {}))
+    return thresholds
+
+
+def pct_change(current, previous):
+    """% change from `previous` to `current`, 0 where there is nothing to compare against (0 or missing)"""
+    current = np.asarray(current, dtype='float64')
+    previous = np.asarray(previous, dtype='float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change = (current - previous) / previous * 100
+    return np.where((previous == 0) | np.isnan(previous), 0.0, change)
+
+
+def classify_alerts(qoq, yoy, increase=DEFAULT_THRESHOLDS['increase'], decrease=DEFAULT_THRESHOLDS['decrease']):
+    """Alert label for each (QoQ, YoY) pair; both changes must be extreme to raise an alert"""
+    qoq = np.asarray(qoq)
+    yoy = np.asarray(yoy)
+    qoq_up, qoq_down = qoq > increase, qoq < decrease
+    yoy_up, yoy_down = yoy > increase, yoy < decrease
+
+    return np.select(
+        [qoq_up & yoy_up, qoq_down & yoy_down, (qoq_up | qoq_down) & (yoy_up | yoy_down)],
+        [ALERT_INCREASE, ALERT_DECREASE, ALERT_MIXED],
+        default=ALERT_NORMAL,
+    )
+
+
+def movement_alerts(frame, by, current, prev_quarter, prev_year, thresholds=DEFAULT_THRESHOLDS,
+                    period_cols=('Year', 'Quarter'), value='CValue'):
+    """Current, previous-quarter and previous-year totals per key, their changes and alert.
+
+    Periods are tuples of `period_cols` values. Every key with trade in the current period
+    gets a row (Current_Value, PrevQ_Value, PrevY_Value, QoQ_Change, YoY_Change, Alert),
+    all computed in one grouped pass over `frame`.
+    """
+    periods = {'Current_Value': current, 'PrevQ_Value': prev_quarter, 'PrevY_Value': prev_year}
+    alerts = compare_periods(frame, by, periods, period_cols, value, require='Current_Value')
+
+    alerts['QoQ_Change'] = pct_change(alerts['Current_Value'], alerts['PrevQ_Value'])
+    alerts['YoY_Change'] = pct_change(alerts['Current_Value'], alerts['PrevY_Value'])
+    alerts['Alert'] = classify_alerts(alerts['QoQ_Change'], alerts['YoY_Change'], **thresholds)
+    return alerts
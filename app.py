@@ -2,41 +2,36 @@
 import dash
 from dash import html, dcc, callback, Input, Output, State, dash_table
 import dash_bootstrap_components as dbc
-import pandas as pd
 
 # Import page modules
 from pages import page1_executive,page2_countries,page3_products, page4_monthly, page5_transport, page6_alerts
+from pages import export, instrumentation
+from pages.callback_cache import cache
+from pages.cube import CUBE_DIMS, CUBE_ATTRS, CUBE_VALUES
+from pages.dataset import TradeData
 
 # Initialize the Dash app
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP], suppress_callback_exceptions=True)
 app.title = "MTID - Merchandise Trade Intelligence Dashboard"
 
-# Load the real data
-try:
-    df = pd.read_csv('data/trade_data.csv')
-    print("✅ Data loaded successfully!")
-    print(f"📊 Shape: {df.shape}")
-    print(f"📋 Columns: {list(df.columns)}")
-    print(f"📅 Years: {sorted(df['Year'].unique())}")
-    print(f"🔄 Trade Types: {df['TradeType'].unique()}")
-    print(f"➡️ Flows: {df['Flow'].unique()}")
-except Exception as e:
-    print(f"❌ Error loading data: {e}")
-    df = pd.DataFrame()
+# WSGI entry point for gunicorn (Procfile: app:server)
+server = app.server
 
-# Data validation and cleaning
-if not df.empty:
-    # Ensure proper data types
-    df['Year'] = df['Year'].astype(int)
-    df['Quarter'] = df['Quarter'].astype(str)
-    df['Period'] = df['Period'].astype(str).str.zfill(2)  # Ensure 2 digits: 01, 02, etc.
-    
-    # Map Flow codes to readable names
-    flow_mapping = {'E': 'Export', 'I': 'Import', 'R': 'Re-export'}
-    df['Flow_Name'] = df['Flow'].map(flow_mapping)
-    
-    # Clean Via column - map transport modes
-    df['Transport_Mode'] = df['Via'].apply(lambda x: 'Air' if x == 'Air' else 'Land')
+# Columns needed at startup: cleaning step, cube, and each page's own reads
+DATA_COLUMNS = list(dict.fromkeys(
+    ['TradeType', 'Year', 'Quarter', 'Period', 'Flow', 'Via'] + CUBE_DIMS + CUBE_ATTRS + CUBE_VALUES +
+    page1_executive.COLUMNS + page2_countries.COLUMNS + page3_products.COLUMNS +
+    page4_monthly.COLUMNS + page5_transport.COLUMNS + page6_alerts.COLUMNS
+))
+
+# The real data (converted once to a Parquet store, then read column-wise), cleaned,
+# indexed and pre-aggregated in a background thread started below
+trade_data = TradeData('data/trade_data.csv', columns=DATA_COLUMNS)
+trade_data.on_ready(lambda data: cache.set_version(data.version))
+server.extensions['trade_data'] = trade_data
+
+# Seconds a page render waits for the data before showing a loading message
+PAGE_LOAD_WAIT = 30
 
 # Sidebar Navigation
 sidebar = html.Div([
@@ -173,6 +168,17 @@ def display_page(page, trade_type):
         ], width=4)
     ], className="mb-4")
     
+    # The data loads in the background after startup; don't hold the request indefinitely
+    if page != 'page7' and not trade_data.wait(PAGE_LOAD_WAIT):
+        return html.Div([
+            header,
+            html.Hr(),
+            dbc.Alert("⏳ Trade data is still loading. Please refresh in a moment.", color="info")
+        ])
+    # The layouts only list dimension values (years, transport modes), which the cube has too
+    # and which stays in memory in disk mode
+    df = trade_data.cube.data
+    
     if page == 'page1':
         return html.Div([
             header,
@@ -337,22 +343,42 @@ def display_page(page, trade_type):
             ]),
         ])
 
-# Register Page 1 callbacks
-page1_executive.register_callbacks(app, df)
-# Register Page 2 callbacks
-page2_countries.register_callbacks(app, df)
-# Register Page 3 callbacks
-page3_products.register_callbacks(app, df)
-# Register Page 4 callbacks
-page4_monthly.register_callbacks(app, df)
-# Register Page 5 callbacks
-page5_transport.register_callbacks(app, df)
-# Register Page 6 callbacks
-page6_alerts.register_callbacks(app, df)
+# Register page callbacks (they read trade_data once it has loaded)
+page1_executive.register_callbacks(app, trade_data)
+page2_countries.register_callbacks(app, trade_data)
+page3_products.register_callbacks(app, trade_data)
+page4_monthly.register_callbacks(app, trade_data)
+page5_transport.register_callbacks(app, trade_data)
+page6_alerts.register_callbacks(app, trade_data)
 
 # Register AI Chat callbacks
 #ai_chat.register_callbacks(app, df)
 
+# Opt-in stage timings and payload sizes per callback on /metrics (CALLBACK_METRICS=1)
+if instrumentation.ENABLED:
+    instrumentation.instrument(app)
+
+# Full query results as streamed CSV/xlsx downloads (/export/rows.csv, /export/summary.xlsx)
+export.register_routes(server, trade_data)
+
+# Liveness answers as soon as the server is up; readiness once the data has loaded
+@server.route('/healthz')
+def healthz():
+    return {'status': 'ok', 'data': 'ready' if trade_data.ready else 'loading'}
+
+@server.route('/readyz')
+def readyz():
+    if not trade_data.ready:
+        return {'status': 'loading'}, 503
+    if trade_data.load_error:
+        # Serving an empty dataset: keep traffic on workers that have the data
+        return {'status': 'failed', 'error': trade_data.load_error}, 503
+    return {'status': 'ready', 'version': trade_data.version, 'load_seconds': round(trade_data.load_seconds, 1)}
+
+# Start loading the data now, in the background, then pick up newly ingested months as they land
+trade_data.start()
+trade_data.watch()
+
 # Run the app
 if __name__ == '__main__':
     app.run(debug=True, port=8050)
\ No newline at end of file
@@ -0,0 +1,88 @@
+"""Optional background execution for the heavy page callbacks (pages 3, 4 and 6).
+
+Set BACKGROUND_CALLBACKS_DIR to a directory and these callbacks run as Dash background
+callbacks: the request is queued in a diskcache store in that directory and computed in a
+separate job process, so the gunicorn worker answers at once and keeps serving other requests
+while the browser polls for the result. The page shows the callback's progress (one step per
+lap()) with a Cancel button. Results are also cached there, keyed by the dataset version.
+Needs the diskcache extra: pip install "dash[diskcache]". Unset, callbacks run inline.
+"""
+import functools
+import os
+
+import dash_bootstrap_components as dbc
+from dash import Input, Output, html
+
+from pages.instrumentation import on_lap
+
+BACKGROUND_ENV = 'BACKGROUND_CALLBACKS_DIR'
+DIRECTORY = os.environ.get(BACKGROUND_ENV, '')
+ENABLED = bool(DIRECTORY)
+
+# Seconds a cached background result is kept
+RESULT_EXPIRE = int(os.environ.get('BACKGROUND_RESULT_EXPIRE', 3600))
+
+_manager = None
+
+
+def manager():
+    """The DiskcacheManager shared by every background callback (created on first use)"""
+    global _manager
+    if _manager is None:
+        import diskcache
+        from dash import DiskcacheManager
+        from pages.callback_cache import cache
+
+        _manager = DiskcacheManager(diskcache.Cache(DIRECTORY), cache_by=[lambda: cache.version],
+                                    expire=RESULT_EXPIRE)
+        print(f"⚙️ Background callbacks enabled (queue in {DIRECTORY})")
+    return _manager
+
+
+def controls(prefix):
+    """Progress bar and Cancel button shown while the page's callback runs (None when disabled)"""
+    if not ENABLED:
+        return None
+    return html.Div(id=f'{prefix}-background', style={'display': 'none'}, className="mb-3", children=[
+        dbc.Row([
+            dbc.Col(dbc.Progress(id=f'{prefix}-progress', value=0, striped=True, animated=True,
+                                 style={'height': '22px'}), width=10),
+            dbc.Col(dbc.Button("Cancel", id=f'{prefix}-cancel', color="secondary", outline=True, size="sm"),
+                    width=2),
+        ], align="center")
+    ])
+
+
+def options(prefix):
+    """Keyword arguments for @callback that run it in the background ({} when disabled)"""
+    if not ENABLED:
+        return {}
+    return dict(
+        background=True,
+        manager=manager(),
+        running=[(Output(f'{prefix}-background', 'style'), {'display': 'block'}, {'display': 'none'})],
+        cancel=[Input(f'{prefix}-cancel', 'n_clicks')],
+        progress=[Output(f'{prefix}-progress', 'value'), Output(f'{prefix}-progress', 'label')],
+    )
+
+
+def with_progress(stages):
+    """Report each lap() of the callback as a progress step, out of `stages` (place it below @callback)"""
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(set_progress, *args):
+            done = 0
+
+            def report(stage):
+                nonlocal done
+                done += 1
+                set_progress((min(100, round(100 * done / stages)), stage))
+
+            set_progress((0, "Starting"))
+            with on_lap(report):
+                return func(*args)
+        return wrapper
+    return decorator
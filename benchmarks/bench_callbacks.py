@@ -0,0 +1,183 @@
+"""Latency and peak memory of every page callback on synthetic data of several sizes.
+
+    python benchmarks/bench_callbacks.py                       # 10k, 100k and 1M rows
+    python benchmarks/bench_callbacks.py --sizes 10M --repeat 1 --json bench_10M.json
+    python benchmarks/bench_callbacks.py --sizes 1M --modes memory disk
+
+For each size a CSV is generated into a scratch directory and a fresh interpreter starts
+the real app there (so startup, Parquet conversion and the cube build are measured too).
+Each callback is then called directly, bypassing Dash and the callback cache, with
+representative filter combinations. Reported per page: p50/p95/max latency, mean payload
+size and peak memory allocated during one pass over the combinations. With --modes each size
+is run once per DATA_MODE (the rows in memory, or left in the Parquet store on disk), so the
+max RSS of the two can be compared.
+"""
+import argparse
+import inspect
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from synthetic import parse_size, use_repo_as_pages, write_csv
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SIZES = ['10k', '100k', '1M']
+DEFAULT_MODES = ['memory']
+TRADE_TYPES = ['GeneralTrade', 'SpecialTrade']
+COMPARED_BLOCKS = ['COMESA', 'SADC', 'EAC', 'EU']
+
+
+def filter_combos(years):
+    """callback -> (first output id, argument tuples) covering the dropdowns' common selections"""
+    latest = years[-1]
+    previous = years[-2] if len(years) > 1 else latest
+    return {
+        'page1': ('p1-kpi-total-trade', [
+            (t, y, q, f) for t in TRADE_TYPES for y in [latest, previous]
+            for q in ['All', '2'] for f in ['All', 'E', 'I']]),
+        'page1-quarterly': ('p1-quarterly-performance', [
+            (t, q, f) for t in TRADE_TYPES for q in ['All', '2'] for f in ['All', 'E', 'I']]),
+        'page1-partners': ('p1-top-partners-section', [
+            (t, y, q, f) for t in TRADE_TYPES for y in [latest, previous]
+            for q in ['All', '2'] for f in ['All', 'E', 'I']]),
+        'page2': ('p2-map-title', [
+            ('GeneralTrade', p, y, q, f, 'All', r, COMPARED_BLOCKS) for p in ['continent', 'regional', 'compare']
+            for y in ['All', latest] for q in ['All', '1'] for f in ['All', 'I'] for r in ['EAC', 'COMESA', 'EU']]),
+        'page3': ('p3-table1', [
+            ('GeneralTrade', y, q, f, c) for y in ['All', latest] for q in ['All', '3']
+            for f in ['E', 'I'] for c in ['HS2', 'HS4', 'HS8', 'SITC']]),
+        'page4': ('p4-summary-table', [
+            (t, y, p, f) for t in TRADE_TYPES for y in [latest, previous] for p in ['01', '06'] for f in ['E', 'I']]),
+        'page5': ('p5-kpi-total', [
+            ('GeneralTrade', y, q, f, m) for y in ['All', latest] for q in ['All', '4']
+            for f in ['All', 'E'] for m in ['All', 'Air']]),
+        'page5-trend': ('p5-trend-chart', [
+            ('GeneralTrade', f, m) for f in ['All', 'E'] for m in ['All', 'Air']]),
+        'page6': ('p6-kpi-total', [
+            (t, latest, q, f, a) for t in TRADE_TYPES for q in ['1', '4'] for f in ['E', 'I']
+            for a in ['sitc', 'country']]),
+    }
+
+
+def find_callback(output_id):
+    """The undecorated function of the callback whose outputs include `output_id`"""
+    from dash._callback import GLOBAL_CALLBACK_MAP
+    for outputs, entry in GLOBAL_CALLBACK_MAP.items():
+        if f'{output_id}.' in outputs:
+            return inspect.unwrap(entry['callback'])
+    raise KeyError(f"No callback outputs {output_id}")
+
+
+def run_worker(repeat):
+    """Inside the scratch directory: start the app, time every page, print one JSON line"""
+    from plotly.io.json import to_json_plotly
+
+    use_repo_as_pages()
+    start = time.perf_counter()
+    import pages.app as app
+    from pages.data_store import read_manifest
+    # In disk mode only the cube is in memory; it has every year of the rows
+    years = sorted(int(y) for y in app.trade_data.cube.data['Year'].unique())
+    startup = time.perf_counter() - start
+
+    results = {'rows': read_manifest()['rows'], 'mode': app.trade_data.mode, 'startup_s': startup, 'pages': {}}
+    for page, (output_id, combos) in filter_combos(years).items():
+        func = find_callback(output_id)
+
+        timings, payload = [], []
+        for _ in range(repeat):
+            for args in combos:
+                t0 = time.perf_counter()
+                output = func(*args)
+                timings.append(time.perf_counter() - t0)
+                payload.append(len(to_json_plotly(output)))
+
+        tracemalloc.start()
+        for args in combos:
+            func(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        ms = np.array(timings) * 1000
+        results['pages'][page] = {
+            'calls': len(timings),
+            'p50_ms': float(np.percentile(ms, 50)),
+            'p95_ms': float(np.percentile(ms, 95)),
+            'max_ms': float(ms.max()),
+            'payload_kb': float(np.mean(payload)) / 1024,
+            'peak_mb': peak / 1e6,
+        }
+
+    results['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps(results))
+
+
+def bench_size(size, modes, repeat, keep):
+    """Generate data for one size and benchmark it in a fresh interpreter per data mode"""
+    workdir = tempfile.mkdtemp(prefix=f'mtid-bench-{size}-')
+    try:
+        t0 = time.perf_counter()
+        write_csv(os.path.join(workdir, 'data', 'trade_data.csv'), parse_size(size))
+        generated = time.perf_counter() - t0
+
+        results = []
+        for mode in modes:
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', '--repeat', str(repeat)],
+                                  cwd=workdir, capture_output=True, text=True, env={**os.environ, 'DATA_MODE': mode})
+            if proc.returncode != 0:
+                raise RuntimeError(f"Benchmark at {size} rows ({mode}) failed:\n{proc.stderr}")
+
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+            result.update(size=size, generate_s=generated)
+            results.append(result)
+        return results
+    finally:
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def report(result):
+    print(f"\n=== {result['size']} rows ({result['rows']:,} loaded, {result['mode']}) — startup {result['startup_s']:.1f}s, "
+          f"max RSS {result['max_rss_mb']:,.0f} MB ===")
+    print(f"{'callback':<16}{'calls':>6}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'payload KB':>12}{'peak MB':>10}")
+    for page, r in result['pages'].items():
+        print(f"{page:<16}{r['calls']:>6}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['max_ms']:>10.1f}"
+              f"{r['payload_kb']:>12.1f}{r['peak_mb']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', default=DEFAULT_SIZES, help="row counts, e.g. 10k 100k 1M 10M")
+    parser.add_argument('--modes', nargs='+', default=DEFAULT_MODES, choices=['memory', 'disk'],
+                        help="DATA_MODE of each run: rows in memory or left on disk")
+    parser.add_argument('--repeat', type=int, default=3, help="timed passes over the filter combinations")
+    parser.add_argument('--json', help="also write the results to this file")
+    parser.add_argument('--keep', action='store_true', help="keep the generated scratch directories")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.repeat)
+        return
+
+    results = []
+    for size in args.sizes:
+        for result in bench_size(size, args.modes, args.repeat, args.keep):
+            results.append(result)
+            report(result)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""pandas vs DuckDB query backends on the page aggregations, with a check that they agree.
+
+    python benchmarks/bench_query.py                                  # 100k and 1M rows
+    python benchmarks/bench_query.py --sizes 10M --threads 1 8 --json query_10M.json
+
+For each size a CSV is generated into a scratch directory and loaded the way the app loads
+it (Parquet store, cleaning, cube). The aggregations routed through pages.query (page 1
+quarterly totals by flow and top partners, page 5's transport mode by quarter pivot, page
+4's three-period comparisons) are then run with representative filters on both backends.
+Every answer is compared first (same keys, values equal to 1e-9 relative), then each query
+is timed; reported per query: p50/p95 per backend and the speed-up. Finally each thread
+count runs all queries from that many threads at once, as a gthread worker would, and
+reports queries per second per backend.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from synthetic import YEARS, parse_size, use_repo_as_pages, write_csv
+
+DEFAULT_SIZES = ['100k', '1M']
+DEFAULT_THREADS = [1, 4]
+TRADE_TYPES = ['GeneralTrade', 'SpecialTrade']
+
+# The cube's columns: all the app reads for these pages
+COLUMNS = ['TradeType', 'Year', 'Quarter', 'Period', 'Flow', 'Partner_Country', 'Via', 'Borders',
+           'HS2', 'HS2_Description', 'SITC', 'SITC_Description', 'CValue', 'CDuty', 'NetWeight']
+
+
+def page_queries():
+    """query name -> (backend method, argument tuples, keyword dicts) as the pages call them"""
+    latest, previous = YEARS[-1], YEARS[-2]
+    periods = {f'{latest - 1}-06': (latest - 1, '06'), f'{latest}-05': (latest, '05'), f'{latest}-06': (latest, '06')}
+    return {
+        'quarterly by flow': ('totals', [
+            ((t, ['Year', 'Quarter', 'Flow']), dict(Year=YEARS[-3:], Quarter=q, Flow=f))
+            for t in TRADE_TYPES for q in ['All', '2'] for f in ['All', 'E', 'I']]),
+        'top partners': ('totals', [
+            ((t, 'Partner_Country'), dict(Year=y, Quarter=q, Flow=f))
+            for t in TRADE_TYPES for y in [latest, previous] for q in ['All', '2'] for f in ['E', 'I']]),
+        'via x quarter': ('totals', [
+            (('GeneralTrade', ['Via', 'Year', 'Quarter']), dict(Year=y, Quarter=q, Flow=f, Via=m))
+            for y in ['All', latest] for q in ['All', '4'] for f in ['All', 'E'] for m in ['All', 'Air']]),
+        'three periods': ('compare_periods', [
+            ((t, by, periods), dict(Flow=f))
+            for t in TRADE_TYPES for by in ['Flow', 'SITC', 'Partner_Country'] for f in ['All', 'E']]),
+    }
+
+
+def load_cube(workdir):
+    """The trade cube built from the generated CSV, exactly as the app builds it"""
+    use_repo_as_pages()
+    from pages.dataset import TradeData
+
+    os.chdir(workdir)
+    data = TradeData('data/trade_data.csv', columns=COLUMNS)
+    data.load()
+    return data.cube
+
+
+def mismatch(expected, actual):
+    """Why two answers differ (None when they agree)"""
+    if list(expected.columns) != list(actual.columns):
+        return f"columns {list(expected.columns)} != {list(actual.columns)}"
+    if len(expected) != len(actual):
+        return f"{len(expected)} rows != {len(actual)} rows"
+    for col in expected.columns:
+        a, b = expected[col].to_numpy(), actual[col].to_numpy()
+        if np.issubdtype(a.dtype, np.floating):
+            if not np.allclose(a, b, rtol=1e-9, atol=1e-6):
+                return f"{col} values differ"
+        elif [str(v) for v in a] != [str(v) for v in b]:
+            return f"{col} keys differ"
+    return None
+
+
+def check(backends, cube, queries):
+    for name, (method, calls) in queries.items():
+        for args, kwargs in calls:
+            pandas, duckdb = (getattr(b, method)(cube, *args, **kwargs) for b in backends)
+            problem = mismatch(pandas, duckdb)
+            if problem:
+                raise AssertionError(f"{name} {args} {kwargs}: {problem}")
+
+
+def time_queries(backend, cube, queries, repeat):
+    results = {}
+    for name, (method, calls) in queries.items():
+        func = getattr(backend, method)
+        timings = []
+        for _ in range(repeat):
+            for args, kwargs in calls:
+                t0 = time.perf_counter()
+                func(cube, *args, **kwargs)
+                timings.append(time.perf_counter() - t0)
+        ms = np.array(timings) * 1000
+        results[name] = {'p50_ms': float(np.percentile(ms, 50)), 'p95_ms': float(np.percentile(ms, 95))}
+    return results
+
+
+def throughput(backend, cube, queries, threads, repeat):
+    """Queries per second with every query run from `threads` threads at once"""
+    calls = [(getattr(backend, method), args, kwargs)
+             for method, combos in queries.values() for args, kwargs in combos] * repeat
+
+    def run():
+        for func, args, kwargs in calls:
+            func(cube, *args, **kwargs)
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    t0 = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return len(calls) * threads / (time.perf_counter() - t0)
+
+
+def bench_size(size, threads_list, repeat, keep):
+    from pages.query import DuckDBBackend, PandasBackend
+
+    workdir = tempfile.mkdtemp(prefix=f'mtid-query-{size}-')
+    cwd = os.getcwd()
+    try:
+        write_csv(os.path.join(workdir, 'data', 'trade_data.csv'), parse_size(size))
+        cube = load_cube(workdir)
+        backends = [PandasBackend(), DuckDBBackend()]
+        queries = page_queries()
+
+        check(backends, cube, queries)
+        result = {'size': size, 'cells': len(cube.data), 'queries': {}, 'throughput': []}
+        timed = [time_queries(b, cube, queries, repeat) for b in backends]
+        for name in queries:
+            result['queries'][name] = {b.name: t[name] for b, t in zip(backends, timed)}
+        for threads in threads_list:
+            result['throughput'].append({'threads': threads, **{
+                b.name: throughput(b, cube, queries, threads, repeat) for b in backends}})
+        return result
+    finally:
+        os.chdir(cwd)
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def report(result):
+    print(f"\n=== {result['size']} rows ({result['cells']:,} cube cells) — answers match ===")
+    print(f"{'query':<20}{'pandas p50':>12}{'p95':>8}{'duckdb p50':>12}{'p95':>8}{'speed-up':>10}")
+    for name, r in result['queries'].items():
+        pandas, duckdb = r['pandas'], r['duckdb']
+        print(f"{name:<20}{pandas['p50_ms']:>12.1f}{pandas['p95_ms']:>8.1f}{duckdb['p50_ms']:>12.1f}"
+              f"{duckdb['p95_ms']:>8.1f}{pandas['p50_ms'] / duckdb['p50_ms']:>9.1f}x")
+    print(f"{'threads':>8}{'pandas q/s':>12}{'duckdb q/s':>12}")
+    for r in result['throughput']:
+        print(f"{r['threads']:>8}{r['pandas']:>12.1f}{r['duckdb']:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', default=DEFAULT_SIZES, help="row counts, e.g. 100k 1M 10M")
+    parser.add_argument('--threads', nargs='+', type=int, default=DEFAULT_THREADS,
+                        help="concurrent callback threads for the throughput runs")
+    parser.add_argument('--repeat', type=int, default=3, help="timed passes over the filter combinations")
+    parser.add_argument('--json', help="also write the results to this file")
+    parser.add_argument('--keep', action='store_true', help="keep the generated scratch directories")
+    args = parser.parse_args()
+
+    use_repo_as_pages()
+    from pages.query import HAS_DUCKDB
+    if not HAS_DUCKDB:
+        sys.exit("The DuckDB backend needs duckdb: pip install duckdb")
+
+    results = []
+    for size in args.sizes:
+        results.append(bench_size(size, args.threads, args.repeat, args.keep))
+        report(results[-1])
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
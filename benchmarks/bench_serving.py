@@ -0,0 +1,226 @@
+"""Throughput of the gunicorn serving profiles under concurrent simulated users.
+
+    python benchmarks/bench_serving.py                                # gthread vs sync, 100k rows
+    python benchmarks/bench_serving.py --size 1M --users 1 8 32 --duration 60 --json serving.json
+
+Synthetic data is generated into a scratch directory, then for each profile in
+gunicorn.conf.py a real gunicorn server is started there (with its preload, timeouts and
+worker recycling). Each simulated user keeps one connection open and sends page callbacks
+back to back, in random order, with the same filter combinations as bench_callbacks.py.
+The callback cache is off unless --cache is given, so every request does the full work.
+Reported per profile and user count: requests per second, p50/p95/max latency and errors.
+
+The load generator runs on the same machine; for numbers that match production, run it
+on another host with --url against a server started by hand.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+from bench_callbacks import filter_combos
+from synthetic import REPO_DIR, YEARS, parse_size, write_csv
+
+DEFAULT_PROFILES = ['gthread', 'sync']
+DEFAULT_USERS = [1, 4, 16]
+
+# Seconds to wait for a server to load the data and answer /readyz
+READY_TIMEOUT = 600
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workdir, profile, port, workers, cache):
+    """gunicorn with the repo's config, serving the repo as the `pages` package from `workdir`"""
+    env = dict(os.environ, GUNICORN_PROFILE=profile)
+    env.pop('BACKGROUND_CALLBACKS_DIR', None)
+    if workers:
+        env['WEB_CONCURRENCY'] = str(workers)
+    if not cache:
+        env['CALLBACK_CACHE_SIZE'] = '0'
+        env.pop('CALLBACK_CACHE_DB', None)
+
+    log = open(os.path.join(workdir, f'gunicorn-{profile}.log'), 'w')
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'pages.app:server',
+         '--config', os.path.join(REPO_DIR, 'gunicorn.conf.py'), '--bind', f'127.0.0.1:{port}'],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return proc, log
+
+
+def wait_ready(url, proc):
+    deadline = time.time() + READY_TIMEOUT
+    while time.time() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"Server exited with code {proc.returncode} before it was ready")
+        try:
+            status, _ = get(url, '/readyz')
+            if status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"{url} not ready after {READY_TIMEOUT}s")
+
+
+def get(url, path):
+    parts = urllib.parse.urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=10)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+def callback_requests(url):
+    """JSON bodies for /_dash-update-component, one per page callback and filter combination"""
+    status, body = get(url, '/_dash-dependencies')
+    if status != 200:
+        raise RuntimeError(f"/_dash-dependencies answered {status}")
+    dependencies = json.loads(body)
+
+    bodies = []
+    for output_id, combos in filter_combos(YEARS).values():
+        dependency = next(d for d in dependencies if f'{output_id}.' in d['output'])
+        outputs = [dict(zip(('id', 'property'), output.rsplit('.', 1)))
+                   for output in dependency['output'].strip('.').split('...')]
+        for args in combos:
+            inputs = [dict(spec, value=value) for spec, value in zip(dependency['inputs'], args)]
+            bodies.append(json.dumps({
+                'output': dependency['output'],
+                'outputs': outputs if dependency['output'].startswith('..') else outputs[0],
+                'inputs': inputs,
+                'changedPropIds': [f"{inputs[0]['id']}.{inputs[0]['property']}"],
+                'state': [],
+            }))
+    return bodies
+
+
+def simulate_user(url, bodies, deadline, seed, results):
+    """Send callbacks over one keep-alive connection until `deadline`; append (seconds, ok)"""
+    parts = urllib.parse.urlsplit(url)
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=300)
+    headers = {'Content-Type': 'application/json'}
+    while time.time() < deadline:
+        t0 = time.perf_counter()
+        try:
+            conn.request('POST', '/_dash-update-component', rng.choice(bodies), headers)
+            response = conn.getresponse()
+            response.read()
+            ok = response.status == 200
+        except (OSError, http.client.HTTPException):
+            # Recycled worker or dropped connection: count it and reconnect
+            conn.close()
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=300)
+            ok = False
+        results.append((time.perf_counter() - t0, ok))
+    conn.close()
+
+
+def run_load(url, bodies, users, duration):
+    results = []
+    deadline = time.time() + duration
+    threads = [threading.Thread(target=simulate_user, args=(url, bodies, deadline, seed, results))
+               for seed in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    ms = np.array([seconds for seconds, ok in results if ok]) * 1000
+    return {
+        'users': users,
+        'requests': len(results),
+        'errors': sum(1 for _, ok in results if not ok),
+        'req_per_s': len(ms) / duration,
+        'p50_ms': float(np.percentile(ms, 50)) if len(ms) else None,
+        'p95_ms': float(np.percentile(ms, 95)) if len(ms) else None,
+        'max_ms': float(ms.max()) if len(ms) else None,
+    }
+
+
+def bench_profile(url, users_list, duration, warmup):
+    bodies = callback_requests(url)
+    # Warm each worker's lazily built page state (and the OS page cache) before timing
+    run_load(url, bodies, max(users_list), warmup)
+    return [run_load(url, bodies, users, duration) for users in users_list]
+
+
+def report(profile, runs):
+    print(f"\n=== {profile} ===")
+    print(f"{'users':>6}{'requests':>10}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'errors':>8}")
+    for r in runs:
+        if r['p50_ms'] is None:
+            print(f"{r['users']:>6}{r['requests']:>10}{0:>9.1f}{'-':>10}{'-':>10}{'-':>10}{r['errors']:>8}")
+            continue
+        print(f"{r['users']:>6}{r['requests']:>10}{r['req_per_s']:>9.1f}{r['p50_ms']:>10.1f}"
+              f"{r['p95_ms']:>10.1f}{r['max_ms']:>10.1f}{r['errors']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', default='100k', help="rows of synthetic data, e.g. 100k or 1M")
+    parser.add_argument('--profiles', nargs='+', default=DEFAULT_PROFILES, help="GUNICORN_PROFILE values")
+    parser.add_argument('--users', nargs='+', type=int, default=DEFAULT_USERS, help="concurrent users to simulate")
+    parser.add_argument('--duration', type=float, default=20, help="seconds of load per user count")
+    parser.add_argument('--warmup', type=float, default=5, help="seconds of untimed load first")
+    parser.add_argument('--workers', type=int, help="WEB_CONCURRENCY for every profile")
+    parser.add_argument('--cache', action='store_true', help="leave the callback cache on")
+    parser.add_argument('--url', help="benchmark a running server instead of starting one")
+    parser.add_argument('--json', help="also write the results to this file")
+    parser.add_argument('--keep', action='store_true', help="keep the scratch directory (and gunicorn logs)")
+    args = parser.parse_args()
+
+    results = {}
+    if args.url:
+        wait_ready(args.url, None)
+        results['url'] = bench_profile(args.url, args.users, args.duration, args.warmup)
+        report(args.url, results['url'])
+    else:
+        workdir = tempfile.mkdtemp(prefix=f'mtid-serving-{args.size}-')
+        try:
+            write_csv(os.path.join(workdir, 'data', 'trade_data.csv'), parse_size(args.size))
+            os.symlink(REPO_DIR, os.path.join(workdir, 'pages'))
+            for profile in args.profiles:
+                port = free_port()
+                proc, log = start_server(workdir, profile, port, args.workers, args.cache)
+                try:
+                    url = f'http://127.0.0.1:{port}'
+                    wait_ready(url, proc)
+                    results[profile] = bench_profile(url, args.users, args.duration, args.warmup)
+                finally:
+                    proc.terminate()
+                    proc.wait()
+                    log.close()
+                report(profile, results[profile])
+        finally:
+            if args.keep:
+                print(f"\nScratch directory kept: {workdir}")
+            else:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Synthetic trade data with the trade_data.csv schema, for benchmarks.
+
+    python benchmarks/synthetic.py 1M /tmp/bench/data/trade_data.csv
+
+Cardinalities follow a national customs extract: ~8,000 HS8 lines across the 97 HS
+chapters, ~260 SITC groups, every partner in the continent map with a few partners
+carrying most of the value, and two dozen border posts.
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+N_HS8 = 8_000
+N_SITC = 260
+N_BORDERS = 24
+YEARS = [2020, 2021, 2022, 2023, 2024]
+VIAS = ['Air', 'Dar', 'Mom', 'DRC', 'Bur']
+FLOWS, FLOW_SHARES = ['E', 'I', 'R'], [0.25, 0.6, 0.15]
+TRADE_TYPES, TRADE_TYPE_SHARES = ['GeneralTrade', 'SpecialTrade'], [0.55, 0.45]
+REGIONS = ['Eastern', 'Western', 'Northern', 'Southern', 'Kigali']
+
+
+def use_repo_as_pages():
+    """app.py imports its modules as `pages.<module>`; make this checkout importable under that name"""
+    if 'pages' not in sys.modules:
+        import types
+        package = types.ModuleType('pages')
+        package.__path__ = [REPO_DIR]
+        sys.modules['pages'] = package
+
+
+def parse_size(text):
+    """'10k' -> 10_000, '1M' -> 1_000_000, '2500' -> 2500"""
+    text = str(text).strip()
+    scale = {'k': 1_000, 'K': 1_000, 'm': 1_000_000, 'M': 1_000_000}.get(text[-1], 1)
+    return int(float(text[:-1] if scale > 1 else text) * scale)
+
+
+def _zipf_weights(n, exponent=1.1, rng=None):
+    """Heavy-tailed shares: a few keys take most rows, as partners and products do"""
+    weights = 1 / np.arange(1, n + 1) ** exponent
+    if rng is not None:
+        rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+def generate(n_rows, seed=0, part=0):
+    """DataFrame of `n_rows` synthetic declarations with every trade_data.csv column.
+
+    The catalogue (products, partners, borders and their shares) depends on `seed` only;
+    `part` varies the rows, so chunks of one file share a catalogue.
+    """
+    use_repo_as_pages()
+    from pages.country_mapping import CONTINENT_MAP
+
+    rng = np.random.default_rng(seed)
+
+    # Product catalogue: HS8 lines nested in HS6/HS4/HS2, each mapped to one SITC group
+    chapters = rng.choice(np.arange(1, 98), N_HS8)
+    hs8 = np.unique(chapters * 1_000_000 + rng.integers(10_000, 1_000_000, N_HS8))
+    hs8_text = np.char.zfill(hs8.astype(str), 8)
+    sitc_codes = np.sort(rng.choice(np.arange(1, 1000), N_SITC, replace=False)).astype(str)
+    hs8_sitc = sitc_codes[(hs8 // 10_000) % N_SITC]
+
+    countries = np.array(sorted(CONTINENT_MAP))
+    borders = np.array([f'Border Post {i:02d}' for i in range(1, N_BORDERS)] + ['Kigali International Airport'])
+
+    product_shares = _zipf_weights(len(hs8), 0.9, rng)
+    border_shares = _zipf_weights(len(borders), 1.0, rng)
+    country_shares = _zipf_weights(len(countries), 1.2, rng)
+
+    rng = np.random.default_rng([seed, part])
+    product = rng.choice(len(hs8), n_rows, p=product_shares)
+    codes = hs8_text[product]
+    period = rng.integers(1, 13, n_rows)
+    value = rng.lognormal(mean=9, sigma=2.2, size=n_rows)
+
+    df = pd.DataFrame({
+        'TradeType': rng.choice(TRADE_TYPES, n_rows, p=TRADE_TYPE_SHARES),
+        'Year': rng.choice(YEARS, n_rows),
+        'Quarter': (period - 1) // 3 + 1,
+        'Period': period,
+        'Flow': rng.choice(FLOWS, n_rows, p=FLOW_SHARES),
+        # Codes as the extracts carry them: numeric, so leading zeros are lost
+        'HS8': hs8[product],
+        'HS8_Description': np.char.add('Product ', codes),
+        'HS6': hs8[product] // 100,
+        'HS6_Description': np.char.add('Subheading ', codes.astype('<U6')),
+        'HS4': hs8[product] // 10_000,
+        'HS4_Description': np.char.add('Heading ', codes.astype('<U4')),
+        'HS2': hs8[product] // 1_000_000,
+        'HS2_Description': np.char.add('Chapter ', codes.astype('<U2')),
+        'SITC': hs8_sitc[product],
+        'SITC_Description': np.char.add('SITC group ', hs8_sitc[product]),
+        'Borders': rng.choice(borders, n_rows, p=border_shares),
+        'Partner_Country': rng.choice(countries, n_rows, p=country_shares),
+        'Region': rng.choice(REGIONS, n_rows),
+        'Via': rng.choice(VIAS, n_rows, p=[0.2, 0.35, 0.3, 0.1, 0.05]),
+        'CValue': value,
+        'CDuty': value * rng.uniform(0, 0.25, n_rows),
+        'NetWeight': value / rng.uniform(1, 50, n_rows),
+    })
+
+    # A sliver of declarations without a partner, as in the real extracts
+    df.loc[rng.random(n_rows) < 0.002, 'Partner_Country'] = np.nan
+    return df
+
+
+def write_csv(path, n_rows, seed=0, chunk_rows=1_000_000):
+    """Write synthetic data to `path` in chunks, so 10M-row files fit in memory"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    for i, start in enumerate(range(0, n_rows, chunk_rows)):
+        chunk = generate(min(chunk_rows, n_rows - start), seed=seed, part=i)
+        chunk.to_csv(path, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit(__doc__)
+    write_csv(sys.argv[2], parse_size(sys.argv[1]))
@@ -0,0 +1,165 @@
+"""Memoizing cache for callbacks whose outputs depend only on their inputs and the dataset.
+
+Every process keeps a bounded LRU in memory. Setting CALLBACK_CACHE_DB to a SQLite file
+path adds a second level shared by all gunicorn workers on the host. Keys include the
+dataset version, so a new dataset never serves results computed from the old one.
+"""
+import functools
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from pages.instrumentation import lap
+
+CACHE_SIZE = int(os.environ.get('CALLBACK_CACHE_SIZE', 256))
+CACHE_DB_ENV = 'CALLBACK_CACHE_DB'
+SHARED_CACHE_SIZE = int(os.environ.get('CALLBACK_CACHE_DB_SIZE', 2000))
+
+
+class SQLiteStore:
+    """Pickled callback outputs in a SQLite table, trimmed to the most recently used `max_entries`"""
+
+    def __init__(self, path, max_entries=SHARED_CACHE_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache '
+                         '(key TEXT PRIMARY KEY, value BLOB, used REAL)')
+
+    def _connect(self):
+        # sqlite3 connections cannot be shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=10)
+        return conn
+
+    def get(self, key):
+        with self._connect() as conn:
+            row = conn.execute('SELECT value FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE cache SET used = ? WHERE key = ?', (time.time(), key))
+        return pickle.loads(row[0])
+
+    def set(self, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?)', (key, blob, time.time()))
+            conn.execute('DELETE FROM cache WHERE key NOT IN '
+                         '(SELECT key FROM cache ORDER BY used DESC LIMIT ?)', (self.max_entries,))
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM cache')
+
+
+class CallbackCache:
+    """Per-process LRU of callback outputs, optionally backed by a shared store"""
+
+    def __init__(self, max_entries=CACHE_SIZE, shared=None):
+        self.max_entries = max_entries
+        self.shared = shared
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _after_fork(self):
+        # The master's refresh calls set_version; a worker forked meanwhile gets an unheld lock
+        self._lock = threading.Lock()
+
+    def set_version(self, version):
+        """Dataset version mixed into every key; changing it makes all earlier entries unreachable"""
+        with self._lock:
+            self.version = version
+            self._entries.clear()
+
+    def key(self, namespace, args):
+        raw = json.dumps([namespace, self.version, args], sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _count(self, namespace, outcome):
+        stats = self._stats.setdefault(namespace, {'hits': 0, 'shared_hits': 0, 'misses': 0})
+        stats[outcome] += 1
+
+    def get(self, namespace, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._count(namespace, 'hits')
+                return True, self._entries[key]
+
+        if self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self._remember(key, value)
+                with self._lock:
+                    self._count(namespace, 'shared_hits')
+                return True, value
+
+        with self._lock:
+            self._count(namespace, 'misses')
+        return False, None
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def set(self, key, value):
+        self._remember(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value)
+
+    def stats(self):
+        """Hit/miss counters per callback namespace, plus the current entry count"""
+        with self._lock:
+            return {'entries': len(self._entries), 'version': self.version,
+                    'callbacks': {name: dict(counts) for name, counts in self._stats.items()}}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+
+def _shared_store():
+    path = os.environ.get(CACHE_DB_ENV)
+    return SQLiteStore(path) if path else None
+
+
+cache = CallbackCache(shared=_shared_store())
+os.register_at_fork(after_in_child=cache._after_fork)
+
+
+def memoize(namespace):
+    """Cache a callback's return value by its arguments (place it below @callback).
+
+    Only for callbacks whose output is fully determined by their inputs and the dataset.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            if cache.version is None:
+                # Dataset still loading: nothing to key the entry on yet
+                return func(*args)
+            key = cache.key(namespace, args)
+            found, value = cache.get(namespace, key)
+            if found:
+                lap('cache hit')
+                return value
+            value = func(*args)
+            cache.set(key, value)
+            return value
+        return wrapper
+    return decorator
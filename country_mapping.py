@@ -1,4 +1,10 @@
 """Country to Continent and Regional Block Mapping"""
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
 
 # Continent Mapping
 CONTINENT_MAP = {
@@ -59,6 +65,48 @@ CONTINENT_MAP = {
     'Fiji': 'OCEANIA', 'Solomon Islands': 'OCEANIA', 'Vanuatu': 'OCEANIA', 'Samoa': 'OCEANIA',
 }
 
+# ISO 3166-1 alpha-3 codes, so the map needs no client-side name matching. Names not listed
+# here are matched against plotly.js's country-name patterns (see iso3_of).
+ISO3_MAP = {
+    'Afghanistan': 'AFG', 'Albania': 'ALB', 'Algeria': 'DZA', 'Angola': 'AGO', 'Antigua And Barbuda': 'ATG',
+    'Argentina': 'ARG', 'Armenia': 'ARM', 'Australia': 'AUS', 'Austria': 'AUT', 'Azerbaijan': 'AZE',
+    'Bahamas': 'BHS', 'Bahrain': 'BHR', 'Bangladesh': 'BGD', 'Barbados': 'BRB', 'Belarus': 'BLR',
+    'Belgium': 'BEL', 'Belize': 'BLZ', 'Benin': 'BEN', 'Bhutan': 'BTN', 'Bolivia': 'BOL',
+    'Bosnia And Herzegovina': 'BIH', 'Botswana': 'BWA', 'Brazil': 'BRA', 'Brunei': 'BRN', 'Bulgaria': 'BGR',
+    'Burkina Faso': 'BFA', 'Burundi': 'BDI', 'Cambodia': 'KHM', 'Cameroon': 'CMR', 'Canada': 'CAN',
+    'Cape Verde': 'CPV', 'Central African Republic': 'CAF', 'Chad': 'TCD', 'Chile': 'CHL', 'China': 'CHN',
+    'Colombia': 'COL', 'Comoros': 'COM', 'Congo': 'COG', 'Congo, The Democratic Republic Of': 'COD',
+    'Costa Rica': 'CRI', "Cote D'Ivoire": 'CIV', 'Croatia': 'HRV', 'Cuba': 'CUB', 'Cyprus': 'CYP',
+    'Czech Republic': 'CZE', 'Denmark': 'DNK', 'Djibouti': 'DJI', 'Dominica': 'DMA',
+    'Dominican Republic': 'DOM', 'Ecuador': 'ECU', 'Egypt': 'EGY', 'El Salvador': 'SLV',
+    'Equatorial Guinea': 'GNQ', 'Eritrea': 'ERI', 'Estonia': 'EST', 'Ethiopia': 'ETH', 'Fiji': 'FJI',
+    'Finland': 'FIN', 'France': 'FRA', 'Gabon': 'GAB', 'Gambia': 'GMB', 'Georgia': 'GEO', 'Germany': 'DEU',
+    'Ghana': 'GHA', 'Greece': 'GRC', 'Grenada': 'GRD', 'Guatemala': 'GTM', 'Guinea': 'GIN',
+    'Guinea-Bissau': 'GNB', 'Guyana': 'GUY', 'Haiti': 'HTI', 'Honduras': 'HND', 'Hungary': 'HUN',
+    'Iceland': 'ISL', 'India': 'IND', 'Indonesia': 'IDN', 'Iran': 'IRN', 'Iraq': 'IRQ', 'Ireland': 'IRL',
+    'Israel': 'ISR', 'Italy': 'ITA', 'Jamaica': 'JAM', 'Japan': 'JPN', 'Jordan': 'JOR', 'Kazakhstan': 'KAZ',
+    'Kenya': 'KEN', 'Kuwait': 'KWT', 'Kyrgyzstan': 'KGZ', 'Laos': 'LAO', 'Latvia': 'LVA', 'Lebanon': 'LBN',
+    'Lesotho': 'LSO', 'Liberia': 'LBR', 'Libya': 'LBY', 'Lithuania': 'LTU', 'Luxembourg': 'LUX',
+    'Madagascar': 'MDG', 'Malawi': 'MWI', 'Malaysia': 'MYS', 'Maldives': 'MDV', 'Mali': 'MLI',
+    'Malta': 'MLT', 'Mauritania': 'MRT', 'Mauritius': 'MUS', 'Mexico': 'MEX', 'Moldova': 'MDA',
+    'Mongolia': 'MNG', 'Montenegro': 'MNE', 'Morocco': 'MAR', 'Mozambique': 'MOZ', 'Myanmar': 'MMR',
+    'Namibia': 'NAM', 'Nepal': 'NPL', 'Netherlands': 'NLD', 'New Zealand': 'NZL', 'Nicaragua': 'NIC',
+    'Niger': 'NER', 'Nigeria': 'NGA', 'North Macedonia': 'MKD', 'Norway': 'NOR', 'Oman': 'OMN',
+    'Pakistan': 'PAK', 'Palestine': 'PSE', 'Panama': 'PAN', 'Papua New Guinea': 'PNG', 'Paraguay': 'PRY',
+    'Peru': 'PER', 'Philippines': 'PHL', 'Poland': 'POL', 'Portugal': 'PRT', 'Qatar': 'QAT',
+    'Romania': 'ROU', 'Russia': 'RUS', 'Rwanda': 'RWA', 'Saint Lucia': 'LCA', 'Samoa': 'WSM',
+    'Sao Tome And Principe': 'STP', 'Saudi Arabia': 'SAU', 'Senegal': 'SEN', 'Serbia': 'SRB',
+    'Seychelles': 'SYC', 'Sierra Leone': 'SLE', 'Singapore': 'SGP', 'Slovakia': 'SVK', 'Slovenia': 'SVN',
+    'Solomon Islands': 'SLB', 'Somalia': 'SOM', 'South Africa': 'ZAF', 'South Korea': 'KOR',
+    'South Sudan': 'SSD', 'Spain': 'ESP', 'Sri Lanka': 'LKA', 'Sudan': 'SDN', 'Suriname': 'SUR',
+    'Swaziland': 'SWZ', 'Eswatini': 'SWZ', 'Sweden': 'SWE', 'Switzerland': 'CHE', 'Syria': 'SYR', 'Tajikistan': 'TJK',
+    'Tanzania': 'TZA', 'Thailand': 'THA', 'Togo': 'TGO', 'Tonga': 'TON', 'Trinidad And Tobago': 'TTO',
+    'Tunisia': 'TUN', 'Turkey': 'TUR', 'Turkmenistan': 'TKM', 'Uganda': 'UGA', 'Ukraine': 'UKR',
+    'United Arab Emirates': 'ARE', 'United Kingdom': 'GBR', 'United States': 'USA', 'Uruguay': 'URY',
+    'Uzbekistan': 'UZB', 'Vanuatu': 'VUT', 'Venezuela': 'VEN', 'Vietnam': 'VNM', 'Yemen': 'YEM',
+    'Zambia': 'ZMB', 'Zimbabwe': 'ZWE',
+}
+
 # Regional Blocks
 EAC_COUNTRIES = ['Burundi', 'Kenya', 'South Sudan', 'Tanzania', 'Congo, The Democratic Republic Of', 'Somalia', 'Uganda']
 EAC_PARTNER_STATES = ['Burundi', 'Kenya', 'South Sudan', 'Tanzania', 'Uganda']
@@ -91,25 +139,134 @@ EU_COUNTRIES = ['Austria', 'Belgium', 'Bulgaria', 'Croatia', 'Cyprus', 'Czech Re
                 'Latvia', 'Lithuania', 'Luxembourg', 'Malta', 'Netherlands', 'Poland', 'Portugal',
                 'Romania', 'Slovakia', 'Slovenia', 'Spain', 'Sweden']
 
+# Block -> member countries; EAC_PARTNERS (the EAC partner states) is a selectable subset of EAC
+REGIONAL_BLOCKS = {
+    'EAC': EAC_COUNTRIES,
+    'COMESA': COMESA_COUNTRIES,
+    'SADC': SADC_COUNTRIES,
+    'ECOWAS': ECOWAS_COUNTRIES,
+    'CEPGL': CEPGL_COUNTRIES,
+    'COMMONWEALTH': COMMONWEALTH_COUNTRIES,
+    'EU': EU_COUNTRIES,
+    'EAC_PARTNERS': EAC_PARTNER_STATES,
+}
+
+CONTINENTS = ['AFRICA', 'AMERICA', 'ASIA', 'EUROPE', 'OCEANIA', 'OTHER']
+
+# Lookup tables, built once: one row per known country plus a last row for unknown countries
+COUNTRIES = pd.Index(sorted(set(CONTINENT_MAP).union(*REGIONAL_BLOCKS.values())), name='Partner_Country')
+_CONTINENT_CODES = np.array([CONTINENTS.index(CONTINENT_MAP.get(c, 'OTHER')) for c in COUNTRIES]
+                            + [CONTINENTS.index('OTHER')])
+_MEMBERSHIP = np.vstack([np.column_stack([COUNTRIES.isin(members) for members in REGIONAL_BLOCKS.values()]),
+                         np.zeros(len(REGIONAL_BLOCKS), dtype=bool)])
+
+
+
+def _plotly_country_patterns():
+    """{ISO-3 code: compiled regex} that plotly.js matches lower-cased country names with (its
+    locationmode='country names'), read from the plotly.js bundled with plotly; {} if unreadable
+    """
+    try:
+        import plotly
+        with open(os.path.join(os.path.dirname(plotly.__file__), 'package_data', 'plotly.min.js'),
+                  encoding='utf-8') as f:
+            js = f.read()
+    except (ImportError, OSError):
+        return {}
+
+    entry = r'[A-Z]{3}:"(?:[^"\\]|\\.)*"'
+    table = re.search(r'\{AFG:"(?:[^"\\]|\\.)*"(?:,%s)*\}' % entry, js)
+    patterns = {}
+    for iso3, pattern in re.findall(r'([A-Z]{3}):"((?:[^"\\]|\\.)*)"', table.group() if table else ''):
+        try:
+            patterns[iso3] = re.compile(json.loads(f'"{pattern}"'))
+        except (ValueError, re.error):
+            continue
+    return patterns
+
+
+# Tried in plotly.js's order, first match wins, as in the browser
+COUNTRY_PATTERNS = _plotly_country_patterns()
+
+# Map locations, in the order of the base map figure's z values
+MAP_LOCATIONS = pd.Index(sorted(set(ISO3_MAP.values()).union(COUNTRY_PATTERNS)))
+
+# Countries x blocks membership matrix
+BLOCK_MEMBERSHIP = pd.DataFrame(_MEMBERSHIP[:-1], index=COUNTRIES, columns=list(REGIONAL_BLOCKS))
+
+# Bridge table: one (Partner_Country, Block) row per membership
+_countries, _blocks = np.nonzero(_MEMBERSHIP[:-1])
+BLOCK_BRIDGE = pd.DataFrame({
+    'Partner_Country': COUNTRIES[_countries],
+    'Block': pd.Categorical.from_codes(_blocks, list(REGIONAL_BLOCKS)),
+})
+
+
+def block_column(block):
+    """Name of the boolean membership column of a regional block"""
+    return f'In_{block}'
+
+
+def _lookup_rows(countries):
+    """Row of each country in the lookup tables (-1, the unknown row, when not listed)"""
+    codes, uniques = pd.factorize(np.asarray(countries, dtype=object))
+    return np.append(COUNTRIES.get_indexer(uniques), -1)[codes]
+
+
+def continent_of(countries):
+    """Continent of each country as a Categorical over CONTINENTS ('OTHER' when unmapped)"""
+    return pd.Categorical.from_codes(_CONTINENT_CODES[_lookup_rows(countries)], CONTINENTS)
+
+
+def block_membership(countries):
+    """Boolean frame, one block_column per regional block, of each country's memberships"""
+    return pd.DataFrame(_MEMBERSHIP[_lookup_rows(countries)],
+                        columns=[block_column(block) for block in REGIONAL_BLOCKS])
+
+
+def resolve_iso3(country):
+    """ISO-3 code of a country name: ISO3_MAP's, else the first plotly.js pattern it matches (None if none)"""
+    if country in ISO3_MAP:
+        return ISO3_MAP[country]
+    name = str(country).strip().lower()
+    return next((iso3 for iso3, pattern in COUNTRY_PATTERNS.items() if pattern.search(name)), None)
+
+
+def iso3_of(countries):
+    """ISO-3 code of each country as a Categorical over MAP_LOCATIONS (missing when unmapped)"""
+    codes, uniques = pd.factorize(np.asarray(countries, dtype=object))
+    locations = MAP_LOCATIONS.get_indexer([resolve_iso3(country) for country in uniques])
+    return pd.Categorical.from_codes(np.append(locations, -1)[codes], MAP_LOCATIONS)
+
+
+def unmapped_partners(countries, iso3, values):
+    """Total of `values` per partner name without a map location (`iso3` as from iso3_of), largest first"""
+    countries = np.asarray(countries, dtype=object)
+    unmapped = np.asarray(pd.isna(iso3)) & pd.notna(countries)
+    totals = pd.Series(np.asarray(values)[unmapped], index=countries[unmapped])
+    return totals.groupby(level=0).sum().sort_values(ascending=False)
+
+
+def block_totals(frame, by, blocks=None, value='CValue'):
+    """Sum of `value` per `by` group and block, for all blocks in one grouped pass over BLOCK_BRIDGE.
+
+    Rows are first summed per partner, then each partner's total joins once per block it belongs
+    to: a country in several blocks counts toward each of them, and only once toward any one.
+    """
+    per_country = frame.groupby(by + ['Partner_Country'], observed=True)[value].sum().reset_index()
+    per_country['Partner_Country'] = per_country['Partner_Country'].astype(object)
+    bridge = BLOCK_BRIDGE if blocks is None else BLOCK_BRIDGE[BLOCK_BRIDGE['Block'].isin(blocks)]
+    merged = per_country.merge(bridge, on='Partner_Country')
+    return merged.groupby(by + ['Block'], observed=True)[value].sum().reset_index()
+
+
 def get_continent(country):
     """Get continent for a country"""
     return CONTINENT_MAP.get(country, 'OTHER')
 
 def get_regional_blocks(country):
     """Get all regional blocks a country belongs to"""
-    blocks = []
-    if country in EAC_COUNTRIES:
-        blocks.append('EAC')
-    if country in COMESA_COUNTRIES:
-        blocks.append('COMESA')
-    if country in SADC_COUNTRIES:
-        blocks.append('SADC')
-    if country in ECOWAS_COUNTRIES:
-        blocks.append('ECOWAS')
-    if country in CEPGL_COUNTRIES:
-        blocks.append('CEPGL')
-    if country in COMMONWEALTH_COUNTRIES:
-        blocks.append('COMMONWEALTH')
-    if country in EU_COUNTRIES:
-        blocks.append('EU')
-    return blocks
\ No newline at end of file
+    if country not in COUNTRIES:
+        return []
+    member = BLOCK_MEMBERSHIP.loc[country]
+    return [block for block in member.index[member] if block != 'EAC_PARTNERS']
\ No newline at end of file
@@ -0,0 +1,83 @@
+"""Pre-aggregated trade cube built once at startup"""
+import pandas as pd
+
+from pages.schema import concat_frames
+from pages.views import TradeIndex, is_all, partition_mask
+
+# Dimensions the cube is aggregated over
+CUBE_DIMS = ['TradeType', 'Year', 'Quarter', 'Period', 'Flow', 'Partner_Country',
+             'Via', 'Borders', 'HS2', 'SITC']
+
+# Descriptions carried alongside their code (one description per code)
+CUBE_ATTRS = ['HS2_Description', 'SITC_Description']
+
+# Measures summed in the cube
+CUBE_VALUES = ['CValue', 'CDuty', 'NetWeight']
+
+
+def cube_cells(df):
+    """The rows of `df` summed over the cube dimensions it has"""
+    dims = [c for c in CUBE_DIMS + CUBE_ATTRS if c in df.columns]
+    values = [c for c in CUBE_VALUES if c in df.columns]
+    if df.empty:
+        return pd.DataFrame(columns=dims + values)
+    # dropna=False keeps rows with a missing partner/border/code, so totals match the raw data
+    return df.groupby(dims, dropna=False, observed=True, sort=False)[values].sum().reset_index()
+
+
+class TradeCube:
+    """Trade values pre-summed over CUBE_DIMS, indexed by (TradeType, Year, Flow) for fast lookups"""
+
+    def __init__(self, df, cells=None):
+        """Aggregate the rows of `df`, or index `cells` already aggregated from rows like them"""
+        self.dims = [c for c in CUBE_DIMS + CUBE_ATTRS if c in df.columns]
+        self.values = [c for c in CUBE_VALUES if c in df.columns]
+
+        if cells is None:
+            cells = cube_cells(df)
+            print(f"🧊 Cube built: {len(df):,} rows -> {len(cells):,} cells")
+
+        self.index = TradeIndex(cells)
+        self.data = self.index.df
+
+    def with_partitions(self, rows, partitions):
+        """A new cube whose cells for `partitions` ((TradeType, Year, Period) keys) are re-aggregated
+        from their new `rows`; every other cell is kept. Columns added since the build are dropped.
+        """
+        cells = self.data[self.dims + self.values]
+        cells = concat_frames([cells[~partition_mask(cells, partitions)], cube_cells(rows)])
+        print(f"🧊 Cube updated: {len(partitions)} month(s) re-aggregated from {len(rows):,} rows "
+              f"-> {len(cells):,} cells")
+        return TradeCube(rows, cells=cells)
+
+    def map_column(self, name, source, mapping, default=None):
+        """Add a column derived from another cube column through a lookup dict"""
+        mapped = self.data[source].astype(object).map(mapping)
+        if default is not None:
+            mapped = mapped.fillna(default)
+        self.data[name] = mapped.astype('category')
+
+    def add_columns(self, columns):
+        """Add columns computed for every cube cell (a frame or dict aligned with `data`'s rows)"""
+        for name, values in dict(columns).items():
+            self.data[name] = values.to_numpy() if isinstance(values, pd.Series) else values
+
+    def filter(self, trade_type, **filters):
+        """Cube cells for a trade type, filtered by column values.
+
+        Each filter is a scalar, a list of accepted values, or 'All'/None for no filter.
+        Year and Flow resolve to row ranges of the index; other columns are masked.
+        """
+        data = self.index.select(trade_type, filters.pop('Year', None), filters.pop('Flow', None))
+
+        mask = None
+        for col, value in filters.items():
+            if is_all(value):
+                continue
+            if isinstance(value, (list, tuple, set)):
+                col_mask = data[col].isin(list(value))
+            else:
+                col_mask = data[col] == value
+            mask = col_mask if mask is None else mask & col_mask
+
+        return data if mask is None else data[mask]
@@ -0,0 +1,636 @@
+"""Columnar trade data store: the CSV is converted once into a partitioned Parquet dataset.
+
+New months are added with ingest_extract() (python -m pages.ingest) without reconverting the
+CSV; the manifest lists every ingested extract, so running workers re-read only those months.
+
+Each conversion or ingestion writes a complete new version of the store into its own
+directory under STORE_PATH, then re-points the CURRENT file at it with one atomic replace.
+Readers resolve the live version once (live_store()) and keep reading it; a superseded
+version is removed STORE_KEEP_SECONDS after it was replaced, so there is no moment at which
+the store is missing or half written.
+
+Writers (conversion, extract replay, ingestion) take an exclusive lock on STORE_PATH/.lock
+in turn; a process that waited while another converted the same CSV reuses that version.
+"""
+import glob
+import hashlib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from urllib.parse import quote, unquote
+
+import numpy as np
+import pandas as pd
+
+from pages.views import PARTITION_KEYS, partition_mask
+
+try:
+    import pyarrow  # noqa: F401  (Parquet engine)
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    # No flock (Windows): writers are not serialized, so run one at a time
+    HAS_FCNTL = False
+
+CSV_PATH = 'data/trade_data.csv'
+STORE_PATH = 'data/trade_data.parquet'
+MANIFEST_FILE = '_manifest.json'
+
+# Names the live version directory inside STORE_PATH
+CURRENT_FILE = 'CURRENT'
+VERSION_PREFIX = 'v-'
+BUILD_PREFIX = 'tmp-'
+LOCK_FILE = '.lock'
+
+# How long a replaced version stays readable for the processes (and downloads) still using it
+STORE_KEEP_SECONDS = float(os.environ.get('STORE_KEEP_SECONDS', 600))
+
+# Bumped whenever the conversion changes what is written, so older stores are rebuilt
+STORE_VERSION = 3
+
+# Hive-style partitions: TradeType=.../Year=.../Flow=...
+PARTITION_COLS = ['TradeType', 'Year', 'Flow']
+
+# Explicit dtypes so nothing is guessed from text (HS/SITC codes stay codes, not floats)
+CSV_DTYPES = {
+    'TradeType': 'str', 'Year': 'int64', 'Quarter': 'str', 'Period': 'str', 'Flow': 'str',
+    'HS8': 'str', 'HS8_Description': 'str', 'HS6': 'str', 'HS6_Description': 'str',
+    'HS4': 'str', 'HS4_Description': 'str', 'HS2': 'str', 'HS2_Description': 'str',
+    'SITC': 'str', 'SITC_Description': 'str',
+    'Borders': 'str', 'Partner_Country': 'str', 'Region': 'str', 'Via': 'str',
+    'CDuty': 'float64', 'CValue': 'float64', 'NetWeight': 'float64',
+}
+
+# Canonical width of each product code (None = keep the code's own length)
+CODE_WIDTHS = {'HS2': 2, 'HS4': 4, 'HS6': 6, 'HS8': 8, 'SITC': None}
+
+DESCRIPTION_COLS = ['HS2_Description', 'HS4_Description', 'HS6_Description',
+                    'HS8_Description', 'SITC_Description']
+
+# Accepted codes in an ingested extract
+VALID_CODES = {'TradeType': {'GeneralTrade', 'SpecialTrade'}, 'Flow': {'E', 'I', 'R'}}
+
+# CSV rows converted and written to the store at a time, so the CSV never has to fit in memory
+CONVERT_CHUNK_ROWS = int(os.environ.get('CONVERT_CHUNK_ROWS', 1_000_000))
+
+# Parquet type of each CSV dtype, so every chunk is written with the same schema
+ARROW_TYPES = {'str': 'string', 'int64': 'int64', 'float64': 'float64'}
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextmanager
+def store_lock(store_path=STORE_PATH):
+    """Hold the store's exclusive writer lock (across processes and threads) for the block"""
+    os.makedirs(store_path, exist_ok=True)
+    with open(os.path.join(store_path, LOCK_FILE), 'a') as f:
+        if HAS_FCNTL:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        # Closing the file releases the lock
+        yield
+
+
+def live_store(store_path=STORE_PATH):
+    """Directory of the live version of the store. It stays readable for STORE_KEEP_SECONDS
+    after a newer version replaces it, so resolve it once and read everything from it; a
+    version directory resolves to itself.
+    """
+    try:
+        with open(os.path.join(store_path, CURRENT_FILE)) as f:
+            return os.path.join(store_path, f.read().strip())
+    except OSError:
+        return store_path
+
+
+def read_manifest(store_path=STORE_PATH):
+    """Manifest describing which source file the store was built from (None if missing)"""
+    try:
+        with open(os.path.join(live_store(store_path), MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(version_path, manifest):
+    """Write a version's manifest in one atomic replace, so readers never see half of it"""
+    tmp_file = os.path.join(version_path, f"{MANIFEST_FILE}.tmp-{os.getpid()}")
+    with open(tmp_file, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_file, os.path.join(version_path, MANIFEST_FILE))
+
+
+def _clean_unique(values, func, missing):
+    """Apply a vectorized string cleaner to the distinct values only, then expand back"""
+    codes, uniques = pd.factorize(values)
+    cleaned = func(pd.Series(uniques, dtype=object).astype(str)).to_numpy(dtype=object)
+    # factorize codes missing values as -1, which picks the appended `missing`
+    return pd.Series(np.append(cleaned, missing)[codes], index=values.index, name=values.name)
+
+
+def normalize_code(values, width=None):
+    """Canonical text codes: '101.0' -> '101', zero-padded to `width`, missing -> ''"""
+    def clean(s):
+        s = s.str.strip().str.replace(r'\.0+$', '', regex=True)
+        if width:
+            s = s.where(~s.str.fullmatch(r'\d+'), s.str.zfill(width))
+        return s
+
+    return _clean_unique(values, clean, '')
+
+
+def normalize_description(values):
+    """Descriptions with surrounding whitespace removed, missing -> 'Unknown'"""
+    return _clean_unique(values, lambda s: s.str.strip(), 'Unknown')
+
+
+def normalize_codes(df):
+    """One-time ingestion pass: canonical HS/SITC codes and trimmed descriptions"""
+    for col, width in CODE_WIDTHS.items():
+        if col in df.columns:
+            df[col] = normalize_code(df[col], width)
+    for col in DESCRIPTION_COLS:
+        if col in df.columns:
+            df[col] = normalize_description(df[col])
+    return df
+
+
+def read_csv_typed(csv_path=CSV_PATH, columns=None, chunksize=None):
+    """Read the trade CSV with explicit dtypes (optionally only some columns) and normalized codes;
+    with `chunksize`, an iterator of frames of that many rows
+    """
+    header = pd.read_csv(csv_path, nrows=0).columns
+    usecols = [c for c in header if columns is None or c in columns]
+    dtypes = {c: t for c, t in CSV_DTYPES.items() if c in usecols}
+    if chunksize:
+        return (normalize_codes(chunk)
+                for chunk in pd.read_csv(csv_path, usecols=usecols, dtype=dtypes, chunksize=chunksize))
+    return normalize_codes(pd.read_csv(csv_path, usecols=usecols, dtype=dtypes))
+
+
+def _arrow_schema(df):
+    """Schema of a CSV chunk with the CSV_DTYPES columns fixed (a chunk may hold a column with no values)"""
+    import pyarrow as pa
+
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    for col, dtype in CSV_DTYPES.items():
+        if col in df.columns:
+            schema = schema.set(schema.get_field_index(col), pa.field(col, ARROW_TYPES[dtype]))
+    return schema
+
+
+def _months(df):
+    """The (TradeType, Year, Period) months `df` has rows for"""
+    keys = df[PARTITION_KEYS].drop_duplicates().dropna()
+    return set(zip(keys['TradeType'], keys['Year'].astype(int), keys['Period'].str.zfill(2)))
+
+
+def _new_build(store_path):
+    """An empty directory for a new version of the store, unseen by readers until _swap_in()"""
+    build_path = os.path.join(store_path, f"{BUILD_PREFIX}{os.getpid()}")
+    shutil.rmtree(build_path, ignore_errors=True)
+    os.makedirs(build_path)
+    return build_path
+
+
+def _convert(csv_path, build_path, source_hash=None):
+    """Write the CSV into `build_path` as a complete version of the store; returns its manifest
+    and the (TradeType, Year, Period) months the CSV holds.
+
+    The CSV is read and written CONVERT_CHUNK_ROWS rows at a time, each chunk adding a file to
+    every partition it has rows for.
+    """
+    stat = os.stat(csv_path)
+    columns = list(pd.read_csv(csv_path, nrows=0).columns)
+
+    rows, schema, months = 0, None, set()
+    for i, chunk in enumerate(read_csv_typed(csv_path, chunksize=CONVERT_CHUNK_ROWS)):
+        schema = schema or _arrow_schema(chunk)
+        # Numbered file names keep each partition's files, and so its rows, in CSV order
+        chunk.to_parquet(build_path, engine='pyarrow', partition_cols=PARTITION_COLS, index=False,
+                         schema=schema, basename_template=f'chunk{i:05d}-{{i}}.parquet')
+        rows += len(chunk)
+        months |= _months(chunk)
+    manifest = {
+        'version': STORE_VERSION,
+        'source': os.path.abspath(csv_path),
+        'mtime': stat.st_mtime,
+        'size': stat.st_size,
+        'sha256': source_hash or file_hash(csv_path),
+        'rows': rows,
+        'columns': columns,
+    }
+    _write_manifest(build_path, manifest)
+    return manifest, months
+
+
+def convert_csv(csv_path=CSV_PATH, store_path=STORE_PATH, source_hash=None):
+    """Convert the CSV into a new version of the partitioned Parquet store and make it live.
+
+    Months ingested into the previous version are not carried over; ensure_store() does that.
+    """
+    with store_lock(store_path):
+        build_path = _new_build(store_path)
+        manifest, _ = _convert(csv_path, build_path, source_hash)
+        _swap_in(build_path, store_path)
+    print(f"🗄️ Converted {csv_path} -> {store_path} ({manifest['rows']:,} rows)")
+    return manifest
+
+
+def _created(version):
+    """Creation time (ns) of a version directory, which its name starts with"""
+    return int(version[len(VERSION_PREFIX):].split('-', 1)[0])
+
+
+def _swap_in(build_path, store_path):
+    """Make the version built at `build_path` the live store: it is renamed to a version
+    directory and CURRENT re-pointed at it with one atomic replace, so readers see either
+    the previous version or this one, both complete
+    """
+    name = f"{VERSION_PREFIX}{time.time_ns()}-{os.getpid()}"
+    os.rename(build_path, os.path.join(store_path, name))
+    pointer = os.path.join(store_path, f"{CURRENT_FILE}.tmp-{os.getpid()}")
+    with open(pointer, 'w') as f:
+        f.write(name)
+    os.replace(pointer, os.path.join(store_path, CURRENT_FILE))
+    _remove_replaced(store_path)
+
+
+def _remove_replaced(store_path):
+    """Delete the versions replaced more than STORE_KEEP_SECONDS ago (a version is replaced
+    when the next one is created), and the files of a store in the single-directory layout
+    """
+    live = os.path.basename(live_store(store_path))
+    versions = sorted((entry for entry in os.listdir(store_path) if entry.startswith(VERSION_PREFIX)), key=_created)
+    now = time.time_ns()
+    for version, successor in zip(versions, versions[1:]):
+        if version != live and now - _created(successor) > STORE_KEEP_SECONDS * 1e9:
+            shutil.rmtree(os.path.join(store_path, version), ignore_errors=True)
+
+    for entry in os.listdir(store_path):
+        if entry.startswith('TradeType='):
+            shutil.rmtree(os.path.join(store_path, entry), ignore_errors=True)
+        elif entry == MANIFEST_FILE:
+            try:
+                os.remove(os.path.join(store_path, entry))
+            except FileNotFoundError:
+                pass
+
+
+def _serves(manifest, stat, force=False):
+    """Whether a store with `manifest` answers for the CSV with `stat` as it is: it was converted
+    from it, or refused it (unless `force`)
+    """
+    if not manifest or manifest.get('version') != STORE_VERSION:
+        return False
+    source = (stat.st_mtime, stat.st_size)
+    refused = manifest.get('refused')
+    return ((manifest['mtime'], manifest['size']) == source
+            or (not force and bool(refused) and (refused['mtime'], refused['size']) == source))
+
+
+def ensure_store(csv_path=CSV_PATH, store_path=STORE_PATH, force=False):
+    """Make sure the Parquet store matches the CSV, converting it when the source changed.
+
+    Months ingested from extracts survive a conversion: those the new CSV holds are taken from
+    it, the others are replayed from their extract files. When one of those files is gone or
+    changed, the new CSV is refused with an error and the current store kept as it is; force=True
+    (python -m pages.ingest --rebuild) converts it anyway, without the months of those extracts.
+
+    A conversion holds the store lock. Processes that notice the same new CSV wait for the
+    first one's conversion, then find the store matching it and return at once.
+    """
+    manifest = read_manifest(store_path)
+    if _serves(manifest, os.stat(csv_path), force):
+        _remove_replaced(store_path)
+        return manifest
+    with store_lock(store_path):
+        return _ensure_store(csv_path, store_path, force)
+
+
+def _ensure_store(csv_path, store_path, force=False):
+    """ensure_store() with the store lock held: what it found is looked at again, as another
+    process may have converted the CSV meanwhile
+    """
+    live = live_store(store_path)
+    previous = read_manifest(live)
+    stat = os.stat(csv_path)
+
+    manifest = previous if previous and previous.get('version') == STORE_VERSION else None
+    if manifest:
+        _remove_replaced(store_path)
+        if _serves(manifest, stat, force):
+            return manifest
+
+    # mtime moved (copy, touch, redeploy): only rebuild if the content really changed
+    source_hash = file_hash(csv_path)
+    if manifest and manifest['sha256'] == source_hash:
+        manifest['mtime'] = stat.st_mtime
+        _write_manifest(live, manifest)
+        return manifest
+
+    build_path = _new_build(store_path)
+    converted, csv_months = _convert(csv_path, build_path, source_hash)
+    extracts = previous.get('extracts', []) if previous else []
+    # Rebuilding from the same CSV (a new store format): every ingested month is replayed
+    same_source = previous is not None and previous['sha256'] == source_hash
+    lost = _replay_extracts(build_path, converted, extracts, None if same_source else csv_months)
+    if lost and manifest and not force:
+        shutil.rmtree(build_path, ignore_errors=True)
+        manifest['refused'] = {'sha256': source_hash, 'mtime': stat.st_mtime, 'size': stat.st_size}
+        _write_manifest(live, manifest)
+        print(f"❌ {csv_path} changed but was NOT converted: it lacks months ingested from "
+              f"{', '.join(entry['source'] for entry in lost)}, which can no longer be replayed "
+              f"(file gone or changed). Still serving the current store; restore the extracts, or "
+              f"run python -m pages.ingest --rebuild to convert the CSV without those months.")
+        return manifest
+    if lost:
+        # Forced, or a store of an older format that cannot be kept: say what is missing
+        print(f"❌ The store was rebuilt without the months ingested from "
+              f"{', '.join(entry['source'] for entry in lost)} (file gone or changed); ingest them again.")
+
+    _swap_in(build_path, store_path)
+    replayed = len(converted.get('extracts', []))
+    print(f"🗄️ Converted {csv_path} -> {store_path} ({converted['rows']:,} rows"
+          f"{f', {replayed} ingested extract(s) replayed' if replayed else ''})")
+    return converted
+
+
+def _version(content_hash):
+    return f"{STORE_VERSION}-{content_hash[:16]}"
+
+
+def dataset_version(csv_path=CSV_PATH, store_path=STORE_PATH):
+    """Identifier of the dataset's content: store format version plus the source CSV hash
+    (or, once extracts were ingested, the revision they produced)
+    """
+    manifest = read_manifest(store_path) if HAS_PYARROW else None
+    if manifest is None:
+        return _version(file_hash(csv_path))
+    return _version(manifest.get('revision') or manifest['sha256'])
+
+
+def changes_since(version, csv_path=CSV_PATH, store_path=STORE_PATH):
+    """What changed in the store since dataset `version` was loaded, as (current version, months).
+
+    months is a list of (TradeType, Year, Period) keys ingested since then, [] when nothing
+    changed, or None when everything must be re-read (the source CSV was replaced).
+    """
+    manifest = read_manifest(store_path) if HAS_PYARROW else None
+    if manifest is None:
+        # No store yet: look again later
+        return version, []
+
+    stat = os.stat(csv_path)
+    # A CSV that ensure_store() refused to convert leaves the store as it is
+    known = [manifest, manifest.get('refused') or manifest]
+    if (stat.st_mtime, stat.st_size) not in [(m['mtime'], m['size']) for m in known]:
+        return None, None
+
+    current = _version(manifest.get('revision') or manifest['sha256'])
+    months = []
+    for extract in reversed(manifest.get('extracts', [])):
+        if _version(extract['revision']) == version:
+            break
+        months += [tuple(key) for key in extract['partitions']]
+    else:
+        if _version(manifest['sha256']) != version:
+            return current, None
+    return current, sorted(set(months))
+
+
+def load_trade_data(csv_path=CSV_PATH, columns=None, store_path=STORE_PATH):
+    """Load the trade dataset, reading only `columns` (None = all) from the Parquet store.
+
+    Falls back to a typed CSV read when pyarrow is not installed.
+    """
+    if not HAS_PYARROW:
+        return read_csv_typed(csv_path, columns)
+
+    manifest = ensure_store(csv_path, store_path)
+    if columns is not None:
+        columns = [c for c in columns if c in manifest['columns']]
+
+    return _restore_partition_dtypes(pd.read_parquet(live_store(store_path), engine='pyarrow', columns=columns))
+
+
+def _restore_partition_dtypes(df):
+    """Partition keys come back as dictionary columns; restore the source dtypes"""
+    for col in PARTITION_COLS:
+        if col in df.columns:
+            df[col] = df[col].astype(CSV_DTYPES[col])
+    return df
+
+
+def _partition_path(store_path, key):
+    """Directory of the (TradeType[, Year[, Flow]]) partition `key`"""
+    return os.path.join(store_path, *(f'{col}={quote(str(value), safe="")}' for col, value in zip(PARTITION_COLS, key)))
+
+
+def store_partitions(store_path=STORE_PATH):
+    """Sorted (TradeType, Year, Flow) keys of the partitions in the store"""
+    keys = []
+    for path in glob.glob(os.path.join(live_store(store_path), 'TradeType=*', 'Year=*', 'Flow=*')):
+        trade_type, year, flow = (unquote(part.split('=', 1)[1]) for part in path.split(os.sep)[-3:])
+        keys.append((trade_type, int(year), flow))
+    return sorted(keys)
+
+
+def read_partition(key, columns=None, filters=None, store_path=STORE_PATH):
+    """Rows of one (TradeType, Year, Flow) partition.
+
+    `filters` ({column: accepted values}, None = any) are pushed down to the Parquet reader,
+    which skips the row groups and rows they rule out. Periods match with or without their
+    leading zero; the rows still need the cleaning applied at load time.
+    """
+    # Read the partition's own directory: opening the whole store would rediscover every
+    # partition on each call. The key columns are added back as the store would return them.
+    path = _partition_path(live_store(store_path), key)
+    conditions = []
+    for col, values in (filters or {}).items():
+        if values is None:
+            continue
+        values = [str(value) for value in values]
+        if col == 'Period':
+            values += [value.lstrip('0') for value in values]
+        conditions.append((col, 'in', sorted(set(values))))
+    read = None if columns is None else [col for col in columns if col not in PARTITION_COLS]
+    df = pd.read_parquet(path, engine='pyarrow', columns=read, filters=conditions or None)
+    for col, value in zip(PARTITION_COLS, key):
+        if columns is None or col in columns:
+            df[col] = pd.Series(value, index=df.index, dtype=CSV_DTYPES[col])
+    return df if columns is None else df[list(columns)]
+
+
+def _read_months(store_path, months, columns=None):
+    """Rows of the given (TradeType, Year, Period) months, reading only their (TradeType, Year) partitions"""
+    pairs = sorted({(trade_type, int(year)) for trade_type, year, _ in months})
+    df = _restore_partition_dtypes(pd.read_parquet(
+        store_path, engine='pyarrow', columns=columns,
+        filters=[[('TradeType', '=', trade_type), ('Year', '=', year)] for trade_type, year in pairs]))
+    df['Period'] = df['Period'].str.zfill(2)
+    return df, partition_mask(df, months)
+
+
+def load_partitions(months, columns=None, store_path=STORE_PATH):
+    """The rows of some (TradeType, Year, Period) months, e.g. those changes_since() reported"""
+    if columns is not None:
+        columns = list(dict.fromkeys(list(columns) + PARTITION_KEYS))
+    df, in_months = _read_months(live_store(store_path), months, columns)
+    return df[in_months].reset_index(drop=True)
+
+
+def validate_extract(df, columns):
+    """Problems that keep an extract out of the store (an empty list when it can be ingested)"""
+    missing = [c for c in columns if c not in df.columns]
+    if missing:
+        return [f"missing columns: {', '.join(missing)}"]
+    if df.empty:
+        return ["the extract has no rows"]
+
+    problems = []
+    for col in PARTITION_KEYS + ['Quarter', 'Flow', 'CValue']:
+        empty = int(df[col].isna().sum())
+        if empty:
+            problems.append(f"{empty:,} rows without {col}")
+    for col, codes in VALID_CODES.items():
+        unknown = sorted(set(df[col].dropna()) - codes)
+        if unknown:
+            problems.append(f"unknown {col} values: {', '.join(map(str, unknown))}")
+
+    month = pd.to_numeric(df['Period'], errors='coerce')
+    if not month.between(1, 12).all():
+        problems.append(f"{int((~month.between(1, 12)).sum()):,} rows with a Period outside 01-12")
+    elif (pd.to_numeric(df['Quarter'], errors='coerce') != (month + 2) // 3).any():
+        problems.append("Quarter does not match Period on some rows")
+    return problems
+
+
+def _prepare_extract(df, columns):
+    """An extract's rows with the store's columns and two-digit periods"""
+    df = df[columns]
+    df['Period'] = df['Period'].str.zfill(2)
+    return df
+
+
+def _write_months(version_path, extract, months, columns, source_path=None):
+    """Write `extract` as the rows of `months` into a version of the store; returns how many
+    stored rows it replaced.
+
+    Their (TradeType, Year) partitions are written again, the other months read from
+    `source_path` (a version those partitions were not copied from), or by default from
+    `version_path` itself, whose partitions are then rewritten in place.
+    """
+    stored, replaced = _read_months(source_path or version_path, months, columns)
+    if source_path is None:
+        for pair in sorted({(trade_type, int(year)) for trade_type, year, _ in months}):
+            shutil.rmtree(_partition_path(version_path, pair), ignore_errors=True)
+    rows = pd.concat([stored[~replaced], extract], ignore_index=True)
+    rows.to_parquet(version_path, engine='pyarrow', partition_cols=PARTITION_COLS, index=False)
+    return int(replaced.sum())
+
+
+def _record_extract(manifest, extract_path, source_hash, extract, months, replaced, ingested=None):
+    """Add an extract's entry, and the revision it produces, to `manifest`; returns the entry"""
+    revision = hashlib.sha256(f"{manifest.get('revision') or manifest['sha256']}:{source_hash}".encode()).hexdigest()
+    entry = {
+        'source': os.path.abspath(extract_path),
+        'sha256': source_hash,
+        'ingested': ingested or time.time(),
+        'rows': len(extract),
+        'replaced_rows': replaced,
+        'partitions': [[trade_type, int(year), period] for trade_type, year, period in months],
+        'revision': revision,
+    }
+    manifest.update(revision=revision, rows=manifest['rows'] - replaced + len(extract),
+                    extracts=manifest.get('extracts', []) + [entry])
+    return entry
+
+
+def _replay_extracts(build_path, manifest, extracts, csv_months=None):
+    """Ingest `extracts` (manifest entries of a previous store) again into a freshly converted
+    version, in their original order; returns the entries that could not be replayed.
+
+    Months in `csv_months` (those the new CSV holds; None to replay every month) are left as
+    the CSV has them. An extract with other months is read again from its file, which must
+    be unchanged.
+    """
+    lost = []
+    for entry in extracts:
+        months = sorted(tuple(key) for key in entry['partitions']
+                        if csv_months is None or tuple(key) not in csv_months)
+        if not months:
+            continue
+        if not os.path.exists(entry['source']) or file_hash(entry['source']) != entry['sha256']:
+            lost.append(entry)
+            continue
+        extract = _prepare_extract(read_csv_typed(entry['source']), manifest['columns'])
+        extract = extract[partition_mask(extract, months)]
+        replaced = _write_months(build_path, extract, months, manifest['columns'])
+        _record_extract(manifest, entry['source'], entry['sha256'], extract, months, replaced, entry['ingested'])
+    _write_manifest(build_path, manifest)
+    return lost
+
+
+def ingest_extract(extract_path, csv_path=CSV_PATH, store_path=STORE_PATH):
+    """Add a new period's extract to the store and return its manifest entry.
+
+    The extract replaces every (TradeType, Year, Period) month it contains, so ingesting a
+    revised extract again is safe. Only the (TradeType, Year) partitions it touches are
+    rewritten; the new version is assembled next to the live one (other partitions are hard
+    links) and swapped in whole. Raises ValueError, writing nothing, if validation fails.
+    """
+    if not HAS_PYARROW:
+        raise RuntimeError("Ingesting extracts needs the Parquet store: pip install pyarrow")
+
+    # Under the store lock: the version copied from is still the live one when this one replaces it
+    with store_lock(store_path):
+        return _ingest_extract(extract_path, csv_path, store_path)
+
+
+def _ingest_extract(extract_path, csv_path, store_path):
+    _ensure_store(csv_path, store_path)
+    live = live_store(store_path)
+    manifest = read_manifest(live)
+    extract = read_csv_typed(extract_path)
+    problems = validate_extract(extract, manifest['columns'])
+    if problems:
+        raise ValueError(f"{extract_path} was not ingested: " + "; ".join(problems))
+
+    extract = _prepare_extract(extract, manifest['columns'])
+    months = sorted(set(zip(extract['TradeType'], extract['Year'].astype(int), extract['Period'])))
+    rewritten = {(trade_type, year) for trade_type, year, _ in months}
+
+    # Every partition the extract does not touch goes into the new version as a hard link
+    def skip(directory, names):
+        if os.path.samefile(directory, live):
+            return [name for name in names if name.startswith(MANIFEST_FILE)]
+        parent = os.path.basename(directory)
+        return [name for name in names if parent.startswith('TradeType=') and name.startswith('Year=')
+                and (parent.split('=', 1)[1], int(name.split('=', 1)[1])) in rewritten]
+
+    build_path = _new_build(store_path)
+    shutil.copytree(live, build_path, copy_function=os.link, ignore=skip, dirs_exist_ok=True)
+
+    # The touched partitions are written again: their other months plus the extract
+    replaced = _write_months(build_path, extract, months, manifest['columns'], source_path=live)
+    entry = _record_extract(manifest, extract_path, file_hash(extract_path), extract, months, replaced)
+    _write_manifest(build_path, manifest)
+    _swap_in(build_path, store_path)
+
+    print(f"📥 Ingested {extract_path}: {len(extract):,} rows for {len(months)} month(s), "
+          f"replacing {entry['replaced_rows']:,} rows")
+    return entry
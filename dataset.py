@@ -0,0 +1,352 @@
+"""The trade dataset and the structures derived from it, loaded off the request path.
+
+app.py creates one TradeData and starts loading it in a background thread, so the server
+answers health checks while the data is read, cleaned, indexed and aggregated. Callbacks
+reach the data through the holder; its attributes wait for the load to finish.
+
+Each process also watches the store for newly ingested months (see pages.ingest) and
+refreshes: it re-reads those months only, rebuilds the index and the affected cube cells
+aside, then publishes the new data with one assignment, so a callback sees either the old
+dataset or the new one, never a mix.
+
+DATA_MODE=disk is for datasets larger than memory: the rows stay in the Parquet store and
+only the cube and the product index are kept, both built a partition at a time (see
+pages.partitions). `df` is then None and `index` reads the partitions a query selects.
+"""
+import functools
+import os
+import threading
+import time
+import weakref
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from pages.cube import TradeCube, cube_cells
+from pages.data_store import (CSV_PATH, HAS_PYARROW, changes_since, dataset_version, ensure_store, live_store,
+                              load_partitions, load_trade_data, read_partition, store_partitions)
+from pages.partitions import PartitionIndex
+from pages.products import ProductIndex, product_tables
+from pages.schema import apply_schema, concat_frames
+from pages.views import TradeIndex, partition_mask
+
+# Modules only the figures need, imported during warm-up instead of at startup
+WARMUP_IMPORTS = ['plotly.express', 'plotly.subplots']
+
+# Seconds between checks of the store for newly ingested data (0 = never check)
+REFRESH_SECONDS = float(os.environ.get('DATA_REFRESH_SECONDS', 60))
+
+# 'memory' loads the trade rows; 'disk' keeps them in the Parquet store (needs pyarrow)
+DATA_MODE = os.environ.get('DATA_MODE', 'memory')
+
+# One published state of the dataset; replaced as a whole on refresh
+Snapshot = namedtuple('Snapshot', ['df', 'index', 'cube', 'products', 'version'])
+
+# Every TradeData of this process, to reset their locks in a forked child
+_instances = weakref.WeakSet()
+
+
+def clean_trade_data(df, report=True):
+    """Validation and cleaning applied to the raw trade rows after loading"""
+    if df.empty:
+        return df
+
+    # Ensure proper data types
+    df['Year'] = df['Year'].astype(int)
+    df['Quarter'] = df['Quarter'].astype(str)
+    df['Period'] = df['Period'].astype(str).str.zfill(2)  # Ensure 2 digits: 01, 02, etc.
+
+    # Map Flow codes to readable names
+    flow_mapping = {'E': 'Export', 'I': 'Import', 'R': 'Re-export'}
+    df['Flow_Name'] = df['Flow'].map(flow_mapping)
+
+    # Clean Via column - map transport modes
+    df['Transport_Mode'] = np.where(df['Via'] == 'Air', 'Air', 'Land')
+
+    # Compact dtypes: categoricals for text, int16 years, float32 where precision allows
+    return apply_schema(df, report=report)
+
+
+class TradeData:
+    """Holder for the trade rows (`df`), their row index (`index`), the cube (`cube`)
+    and the product hierarchy (`products`)
+    """
+
+    def __init__(self, csv_path=CSV_PATH, columns=None, mode=DATA_MODE):
+        if mode == 'disk' and not HAS_PYARROW:
+            print("⚠️ DATA_MODE=disk needs the Parquet store (pip install pyarrow); loading into memory")
+            mode = 'memory'
+        self.csv_path = csv_path
+        self.columns = columns
+        self.mode = mode
+        self.load_seconds = None
+        # Why the last load or refresh published an empty dataset instead of the data (None if it didn't)
+        self.load_error = None
+        self._snapshot = None
+        self._on_load = []
+        self._on_ready = []
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+        self._building = threading.local()
+        self._loader = None
+        self._loader_pid = None
+        self._watcher_pid = None
+        self._standing_by = False
+        _instances.add(self)
+
+    def _after_fork(self):
+        # A worker may be forked while a thread of the master (loader, watcher) holds a lock;
+        # no thread of the child would ever release it, so the child starts with fresh ones
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+
+    def on_load(self, prepare):
+        """Run `prepare(data)` on every newly loaded dataset before it is published,
+        e.g. to add a page's derived cube columns
+        """
+        self._on_load.append(prepare)
+
+    def on_ready(self, notify):
+        """Run `notify(data)` each time a loaded or refreshed dataset has been published"""
+        self._on_ready.append(notify)
+
+    def _build(self, df, version):
+        """Clean, index and aggregate freshly read rows"""
+        df = clean_trade_data(df)
+
+        # Sort rows by (TradeType, Year, Flow) once so callbacks select row slices instead of copies
+        index = TradeIndex(df)
+
+        # Pre-aggregate once so page callbacks answer from the cube instead of raw rows
+        return Snapshot(index.df, index, TradeCube(index.df), ProductIndex(index.df), version)
+
+    def _update(self, months, version):
+        """The current snapshot with `months` re-read from the store, and only their cube cells rebuilt"""
+        current = self._snapshot
+        rows = clean_trade_data(load_partitions(months, columns=self.columns))
+        if not rows.empty:
+            rows = rows[[c for c in current.df.columns if c in rows.columns]]
+
+        kept = current.df[~partition_mask(current.df, months)]
+        index = TradeIndex(concat_frames([kept, rows]))
+        return Snapshot(index.df, index, current.cube.with_partitions(rows, months),
+                        current.products.with_partitions(index, months), version)
+
+    def _build_from_store(self):
+        """Aggregate the store a partition at a time into the cube and the product index,
+        leaving the rows on disk
+        """
+        manifest = ensure_store(self.csv_path)
+        # Everything is read from the version live now, whatever is ingested meanwhile
+        store = live_store()
+        version = dataset_version(self.csv_path, store)
+        read_columns = [c for c in self.columns or manifest['columns'] if c in manifest['columns']]
+        prepare = functools.partial(clean_trade_data, report=False)
+
+        cells, tables, rows_read, sample = [], [], 0, None
+        keys = store_partitions(store)
+        for key in keys:
+            rows = read_partition(key, read_columns, store_path=store)
+            if rows.empty:
+                continue
+            rows = prepare(rows)
+            cells.append(cube_cells(rows))
+            tables.append(product_tables(rows))
+            rows_read += len(rows)
+            sample = rows.iloc[:0]
+        if sample is None:
+            return self._build(pd.DataFrame(), version)
+
+        cube = TradeCube(sample, cells=concat_frames(cells))
+        products = ProductIndex(sample, tables={name: concat_frames([t[name] for t in tables]) for name in tables[0]})
+        print(f"💿 {rows_read:,} rows aggregated from {len(keys)} partitions on disk -> "
+              f"{len(cube.data):,} cube cells, {len(products.codes.df):,} code combinations")
+        index = PartitionIndex(sample.columns, read_columns, prepare, version_path=store)
+        return Snapshot(None, index, cube, products, version)
+
+    def _update_from_store(self, months, version):
+        """The current snapshot with the cube cells and product roll-ups of `months` rebuilt from
+        the years they fall in, read from disk
+        """
+        current = self._snapshot
+        index = current.index.rescan()
+        pairs = sorted({(trade_type, int(year)) for trade_type, year, _ in months})
+        years = [rows for trade_type, year in pairs for _, rows in index.frames(trade_type, year)]
+        years = concat_frames(years) if years else pd.DataFrame(columns=index.columns)
+
+        rows = years[partition_mask(years, months)]
+        return Snapshot(None, index, current.cube.with_partitions(rows, months),
+                        current.products.with_partitions(TradeIndex(years), months), version)
+
+    def _publish(self, snapshot):
+        """Run the on_load preparations on `snapshot`, then make it the data every callback sees"""
+        self._building.snapshot = snapshot
+        try:
+            for prepare in self._on_load:
+                prepare(self)
+        finally:
+            self._building.snapshot = None
+        self._snapshot = snapshot
+        for notify in self._on_ready:
+            notify(self)
+
+    def load(self):
+        """Load, clean, index and aggregate the data, then run the on_load preparations"""
+        start = time.perf_counter()
+        try:
+            version, snapshot = None, None
+            try:
+                if self.mode == 'disk':
+                    snapshot = self._build_from_store()
+                else:
+                    df = load_trade_data(self.csv_path, columns=self.columns)
+                    version = dataset_version(self.csv_path)
+                    print("✅ Data loaded successfully!")
+                    print(f"📊 Shape: {df.shape}")
+                    print(f"📋 Columns: {list(df.columns)}")
+                    print(f"📅 Years: {sorted(df['Year'].unique())}")
+                    print(f"🔄 Trade Types: {df['TradeType'].unique()}")
+                    print(f"➡️ Flows: {df['Flow'].unique()}")
+            except Exception as e:
+                print(f"❌ Error loading data: {e}")
+                self.load_error = f"Error loading data: {e}"
+                df = pd.DataFrame()
+
+            try:
+                if snapshot is None:
+                    snapshot = self._build(df, version)
+                self._publish(snapshot)
+            except Exception as e:
+                # Serve an empty dataset rather than none, as when the read itself fails
+                print(f"❌ Error preparing data: {e}")
+                self.load_error = f"Error preparing data: {e}"
+                self._publish(self._build(pd.DataFrame(), None))
+
+            for module in WARMUP_IMPORTS:
+                __import__(module)
+        finally:
+            self.load_seconds = time.perf_counter() - start
+            self._ready.set()
+        print(f"🚀 Data ready in {self.load_seconds:.1f}s")
+
+    def refresh(self):
+        """Bring the data up to date with the store; True if a new version was published.
+
+        Only the months ingested since the loaded version are re-read; when the source CSV
+        itself was replaced, everything is.
+        """
+        if not self.ready or not self._refreshing.acquire(blocking=False):
+            return False
+        try:
+            start = time.perf_counter()
+            version, months = changes_since(self.version, self.csv_path)
+            if months == []:
+                return False
+            if self.mode == 'disk':
+                snapshot = self._build_from_store() if months is None else self._update_from_store(months, version)
+            elif months is None:
+                df = load_trade_data(self.csv_path, columns=self.columns)
+                snapshot = self._build(df, dataset_version(self.csv_path))
+            else:
+                snapshot = self._update(months, version)
+            self._publish(snapshot)
+            self.load_error = None
+            print(f"🔁 Data refreshed to version {snapshot.version} in {time.perf_counter() - start:.1f}s")
+            return True
+        finally:
+            self._refreshing.release()
+
+    def stand_by(self):
+        """Don't load in this process: another one (the gunicorn master) is loading the data and
+        replaces this process once it has. Until then the data is reported as loading.
+        """
+        self._standing_by = True
+
+    def start(self):
+        """Start loading in a background thread (once per process; a forked worker restarts it)"""
+        with self._lock:
+            if (self._standing_by or self._ready.is_set()
+                    or (self._loader is not None and self._loader_pid == os.getpid())):
+                return
+            self._loader_pid = os.getpid()
+            self._loader = threading.Thread(target=self.load, name='trade-data-loader', daemon=True)
+            self._loader.start()
+
+    def watch(self, interval=REFRESH_SECONDS):
+        """Check the store every `interval` seconds in a background thread and refresh() on changes
+        (once per process: a forked worker calls it again to start its own watcher)
+        """
+        with self._lock:
+            if not interval or self._watcher_pid == os.getpid():
+                return
+            self._watcher_pid = os.getpid()
+        threading.Thread(target=self._watch, args=(interval,), name='trade-data-watcher', daemon=True).start()
+
+    def _watch(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                # Keep serving the data already loaded and try again at the next check
+                print(f"❌ Error refreshing data: {e}")
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        """Block until the data is loaded (starting the load if needed); False on timeout"""
+        if self._ready.is_set() or threading.current_thread() is self._loader:
+            # on_load preparations run inside the loader and see the data as it is built
+            return True
+        if self._standing_by:
+            # The data never arrives in this process: answer at once instead of holding a request
+            return False
+        self.start()
+        return self._ready.wait(timeout)
+
+    def _current(self):
+        # on_load preparations see the snapshot they are preparing, callbacks the published one
+        return getattr(self._building, 'snapshot', None) or self._snapshot
+
+    def _loaded(self):
+        """The snapshot to answer from, once there is one"""
+        self.wait()
+        snapshot = self._current()
+        if snapshot is None:
+            raise RuntimeError(self.load_error or "The trade data is still loading")
+        return snapshot
+
+    @property
+    def version(self):
+        """Version of the published dataset (None until loaded)"""
+        snapshot = self._current()
+        return snapshot.version if snapshot else None
+
+    @property
+    def df(self):
+        """The trade rows (None in disk mode)"""
+        return self._loaded().df
+
+    @property
+    def index(self):
+        return self._loaded().index
+
+    @property
+    def cube(self):
+        return self._loaded().cube
+
+    @property
+    def products(self):
+        return self._loaded().products
+
+
+def _reset_after_fork():
+    for data in list(_instances):
+        data._after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
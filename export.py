@@ -0,0 +1,368 @@
+"""Server-side export of full query results, streamed as CSV or xlsx.
+
+A DataTable's export button only saves the rows already sent to the browser. These endpoints
+run the query on the server instead and write the result batch by batch, so the worker holds
+at most one (TradeType, Year, Flow) group of the extract and the browser none of it:
+
+    /export/rows.csv?trade_type=GeneralTrade&year=2024&flow=I&columns=Period,HS8,Partner_Country,CValue
+    /export/summary.xlsx?trade_type=GeneralTrade&year=2023,2024&flow=E&by=Period,HS8,Partner_Country
+
+`rows` streams the matching trade rows (all columns unless `columns` is given). `summary`
+sums the trade values over the `by` columns, one (TradeType, Year, Flow) group at a time, so
+each line also carries those three keys. year, quarter, period, flow and via (transport
+mode) take 'All' (the default) or comma-separated values; continent and block keep the
+partner countries of a continent or of regional blocks, as on page 2. In disk mode
+(DATA_MODE=disk) only the partitions the filters select are read, with the other filters
+pushed down to the reader.
+
+Both formats are sent as they are produced (chunked). An xlsx file is a zip archive: its
+sheets are written straight into the compressed stream batch by batch (a new sheet every
+1,048,575 rows or 2 GB of sheet XML), and the workbook parts that list the sheets come last, so neither the file
+nor a temporary copy of it is ever held whole. With the sync serving profile, the whole
+download must finish within the gunicorn timeout.
+"""
+import os
+import re
+import zipfile
+from urllib.parse import urlencode
+from xml.sax.saxutils import escape
+
+import flask
+import numpy as np
+import pandas as pd
+from dash import html
+
+from pages.country_mapping import CONTINENT_MAP, REGIONAL_BLOCKS
+from pages.cube import CUBE_VALUES
+from pages.views import is_all
+
+# Rows per batch read, converted and written at a time
+BATCH_ROWS = int(os.environ.get('EXPORT_BATCH_ROWS', 50_000))
+
+# Data rows per xlsx sheet (Excel's limit less the header row)
+XLSX_SHEET_ROWS = 1_048_575
+
+# Bytes of XML per sheet, kept under the size from which a zip entry needs Zip64 extensions
+# (not known in advance for a streamed entry); a sheet this large continues on the next one
+XLSX_SHEET_BYTES = zipfile.ZIP64_LIMIT - (1 << 20)
+
+# Characters XML 1.0 cannot hold, dropped from xlsx text cells
+XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+SPREADSHEET_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+RELATIONSHIP_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+PACKAGE_RELATIONSHIP_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+GROUP_KEYS = ['TradeType', 'Year', 'Flow']
+
+MIMETYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def _values(args, name):
+    """Comma-separated query values, or None for 'All'"""
+    raw = args.get(name, 'All')
+    if is_all(raw):
+        return None
+    values = [value.strip() for value in raw.split(',') if value.strip()]
+    return values or None
+
+
+def _columns(args, name, allowed):
+    columns = _values(args, name)
+    unknown = [c for c in columns or [] if c not in allowed]
+    if unknown:
+        raise ValueError(f"unknown {name}: {', '.join(unknown)}")
+    return columns
+
+
+def _partners(args):
+    """Partner countries of the requested continent(s) and regional block(s), None for any partner"""
+    continents, blocks = _values(args, 'continent'), _values(args, 'block')
+    unknown = ([c for c in continents or [] if c not in set(CONTINENT_MAP.values())]
+               + [b for b in blocks or [] if b not in REGIONAL_BLOCKS])
+    if unknown:
+        raise ValueError(f"unknown continent or block: {', '.join(unknown)}")
+
+    partners = None
+    if continents:
+        partners = {country for country, continent in CONTINENT_MAP.items() if continent in continents}
+    if blocks:
+        members = set().union(*(REGIONAL_BLOCKS[block] for block in blocks))
+        partners = members if partners is None else partners & members
+    return None if partners is None else sorted(partners)
+
+
+def parse_query(args, columns):
+    """Filters and columns of an export request, checked against the data's columns (ValueError if invalid)"""
+    try:
+        years = [int(year) for year in _values(args, 'year') or []] or None
+    except ValueError:
+        raise ValueError("year must be 'All' or comma-separated years") from None
+    periods = _values(args, 'period')
+    via, partner = _values(args, 'via'), _partners(args)
+    for name, col, values in [('via', 'Via', via), ('continent/block', 'Partner_Country', partner)]:
+        if values is not None and col not in columns:
+            raise ValueError(f"{name} filters {col}, which this data does not have")
+
+    return {
+        'trade_type': args.get('trade_type', 'GeneralTrade'),
+        'year': years,
+        'flow': _values(args, 'flow'),
+        'quarter': _values(args, 'quarter'),
+        'period': [period.zfill(2) for period in periods] if periods else None,
+        'via': via,
+        'partner': partner,
+        'columns': _columns(args, 'columns', columns),
+        'by': _columns(args, 'by', [c for c in columns if c not in GROUP_KEYS + CUBE_VALUES]),
+    }
+
+
+def _filters(quarter=None, period=None, via=None, partner=None):
+    """Accepted values of the filtered columns (None = any)"""
+    return {'Quarter': quarter, 'Period': period, 'Via': via, 'Partner_Country': partner}
+
+
+def row_batches(index, trade_type, year=None, flow=None, quarter=None, period=None, via=None, partner=None,
+                columns=None, **_):
+    """The matching trade rows, BATCH_ROWS at a time, one (TradeType, Year, Flow) group after another"""
+    filters = _filters(quarter, period, via, partner)
+    for _, rows in index.frames(trade_type, year, flow, columns=columns, filters=filters):
+        for begin in range(0, len(rows), BATCH_ROWS):
+            yield rows.iloc[begin:begin + BATCH_ROWS]
+
+
+def summary_batches(index, trade_type, year=None, flow=None, quarter=None, period=None, via=None, partner=None,
+                    by=None, **_):
+    """Trade values summed over `by`, aggregated and written one (TradeType, Year, Flow) group at a time"""
+    if not by:
+        raise ValueError("summary needs the columns to group by, e.g. by=Period,HS8,Partner_Country")
+    values = [c for c in CUBE_VALUES if c in index.columns]
+
+    filters = _filters(quarter, period, via, partner)
+    for key, rows in index.frames(trade_type, year, flow, columns=by + values, filters=filters):
+        summary = rows.groupby(by, observed=True, dropna=False)[values].sum().reset_index()
+        for col, value in reversed(list(zip(index.keys, key))):
+            summary.insert(0, col, value)
+        for begin in range(0, len(summary), BATCH_ROWS):
+            yield summary.iloc[begin:begin + BATCH_ROWS]
+
+
+QUERIES = {'rows': row_batches, 'summary': summary_batches}
+
+
+def csv_stream(batches, columns):
+    """CSV text, one chunk per batch (a header alone when nothing matched)"""
+    header = True
+    for batch in batches:
+        yield batch.to_csv(index=False, header=header)
+        header = False
+    if header:
+        yield ','.join(columns) + '\n'
+
+
+class _Drain:
+    """Unseekable file the xlsx zip is written to; drain() takes the bytes written so far"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _column_letters(count):
+    letters = []
+    for number in range(1, count + 1):
+        name = ''
+        while number:
+            number, rest = divmod(number - 1, 26)
+            name = chr(65 + rest) + name
+        letters.append(name)
+    return letters
+
+
+def _cell(ref, kind, value):
+    """One sheet cell: numbers and booleans as values (already as text), anything else as inline text"""
+    if value is None:
+        return ''
+    if kind == 's':
+        text = escape(XML_ILLEGAL.sub('', str(value)))
+        return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+    return f'<c r="{ref}"{kind}><v>{value}</v></c>'
+
+
+def _cell_values(batch):
+    """The batch's rows of values for _cell() and each column's kind of cell.
+
+    Numbers keep the text pandas gives them (float32 values in their shortest float32 form,
+    as in the CSV); missing values and those Excel cannot hold (NaN, inf) become empty cells.
+    """
+    values, kinds = [], []
+    for _, col in batch.items():
+        if pd.api.types.is_bool_dtype(col):
+            kinds.append(' t="b"')
+            values.append(col.astype(object).map({True: '1', False: '0'}).where(col.notna(), None))
+        elif pd.api.types.is_numeric_dtype(col):
+            kinds.append('')
+            finite = np.isfinite(pd.to_numeric(col, errors='coerce').to_numpy(dtype='float64', na_value=np.nan))
+            values.append(col.astype(str).where(finite, None))
+        else:
+            kinds.append('s')
+            values.append(col.astype(object).where(col.notna(), None))
+    return list(zip(*values)), kinds
+
+
+def _sheet_rows(rows, first, letters, kinds):
+    return ''.join(f'<row r="{number}">' + ''.join(_cell(f'{letter}{number}', kind, value)
+                                                  for letter, kind, value in zip(letters, kinds, row)) + '</row>'
+                   for number, row in enumerate(rows, first))
+
+
+def _workbook_parts(sheets):
+    """Workbook and its relationships, listing the `sheets` written"""
+    names = ''.join(f'<sheet name="Sheet{i}" sheetId="{i}" r:id="rId{i}"/>' for i in range(1, sheets + 1))
+    relationships = ''.join(
+        f'<Relationship Id="rId{i}" Target="worksheets/sheet{i}.xml" '
+        f'Type="{RELATIONSHIP_NS}/worksheet"/>' for i in range(1, sheets + 1))
+    return {
+        'xl/workbook.xml': f'{XML_HEADER}<workbook xmlns="{SPREADSHEET_NS}" xmlns:r="{RELATIONSHIP_NS}">'
+                           f'<sheets>{names}</sheets></workbook>',
+        'xl/_rels/workbook.xml.rels': f'{XML_HEADER}<Relationships xmlns="{PACKAGE_RELATIONSHIP_NS}">'
+                                      f'{relationships}</Relationships>',
+    }
+
+
+# Package parts written before the sheets: every other .xml part is a worksheet
+XLSX_PREAMBLE = {
+    '[Content_Types].xml': f'{XML_HEADER}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                           '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                           '<Default Extension="xml" ContentType="application/vnd.openxmlformats-officedocument.'
+                           'spreadsheetml.worksheet+xml"/>'
+                           '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-'
+                           'officedocument.spreadsheetml.sheet.main+xml"/></Types>',
+    '_rels/.rels': f'{XML_HEADER}<Relationships xmlns="{PACKAGE_RELATIONSHIP_NS}">'
+                   f'<Relationship Id="rId1" Target="xl/workbook.xml" Type="{RELATIONSHIP_NS}/officeDocument"/>'
+                   '</Relationships>',
+}
+
+
+def xlsx_stream(batches, columns):
+    """An xlsx workbook of the batches, compressed and yielded as each batch is written"""
+    sink = _Drain()
+    archive = zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED)
+    for name, text in XLSX_PREAMBLE.items():
+        archive.writestr(name, text)
+
+    sheets, sheet = [], None
+    sheet_rows = sheet_bytes = 0
+    header, letters = list(columns), _column_letters(len(columns))
+
+    def write(data):
+        nonlocal sheet_bytes
+        sheet.write(data)
+        sheet_bytes += len(data)
+
+    def next_sheet():
+        nonlocal sheet, sheet_rows, sheet_bytes
+        if sheet is not None:
+            write(b'</sheetData></worksheet>')
+            sheet.close()
+        sheets.append(f'xl/worksheets/sheet{len(sheets) + 1}.xml')
+        sheet, sheet_rows, sheet_bytes = archive.open(sheets[-1], 'w'), 0, 0
+        write(f'{XML_HEADER}<worksheet xmlns="{SPREADSHEET_NS}"><sheetData>'.encode())
+        write(_sheet_rows([header], 1, letters, ['s'] * len(header)).encode())
+
+    for batch in batches:
+        header, letters = list(batch.columns), _column_letters(len(batch.columns))
+        rows, kinds = _cell_values(batch)
+        while rows:
+            if sheet is None or sheet_rows == XLSX_SHEET_ROWS:
+                next_sheet()
+            take = rows[:XLSX_SHEET_ROWS - sheet_rows]
+            data = _sheet_rows(take, sheet_rows + 2, letters, kinds).encode()
+            if sheet_rows and sheet_bytes + len(data) > XLSX_SHEET_BYTES:
+                next_sheet()
+                continue
+            write(data)
+            sheet_rows += len(take)
+            rows = rows[len(take):]
+        data = sink.drain()
+        if data:
+            yield data
+
+    if sheet is None:
+        next_sheet()
+    write(b'</sheetData></worksheet>')
+    sheet.close()
+    for name, text in _workbook_parts(len(sheets)).items():
+        archive.writestr(name, text)
+    archive.close()
+    yield sink.drain()
+
+
+def url(query, fmt, **params):
+    """Path of an export; list values are joined with commas and 'All'/None filters left out"""
+    params = {name: ','.join(map(str, value)) if isinstance(value, (list, tuple)) else value
+              for name, value in params.items() if not is_all(value)}
+    return f"/export/{query}.{fmt}?{urlencode(params)}"
+
+
+def download_links(label, query, **params):
+    """'⬇️ label: CSV · Excel' links to the full result of a query, for under a page's filters"""
+    return html.Div([
+        html.Span(f"⬇️ {label}: ", className="text-muted small"),
+        html.A("CSV", href=url(query, 'csv', **params), className="small"),
+        html.Span(" · ", className="text-muted small"),
+        html.A("Excel", href=url(query, 'xlsx', **params), className="small"),
+    ], className="mb-3")
+
+
+def register_routes(server, data):
+    """Serve /export/<rows|summary>.<csv|xlsx> from the dataset loaded in `data`"""
+
+    @server.route('/export/<query>.<fmt>')
+    def export(query, fmt):
+        if query not in QUERIES or fmt not in MIMETYPES:
+            flask.abort(404)
+        if not data.ready:
+            return {'status': 'loading'}, 503
+
+        # One snapshot for the whole download, even if newly ingested data is published meanwhile
+        index = data.index
+        try:
+            params = parse_query(flask.request.args, index.columns)
+            batches = QUERIES[query](index, **params)
+            # Run to the first batch here, so bad parameters answer 400 rather than a broken download
+            first = next(batches, None)
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
+        if query == 'summary':
+            columns = GROUP_KEYS + params['by'] + [c for c in CUBE_VALUES if c in index.columns]
+        else:
+            columns = params['columns'] or index.columns
+
+        def all_batches():
+            if first is not None:
+                yield first
+                yield from batches
+
+        label = ''.join(ch for ch in params['trade_type'] if ch.isalnum())
+        name = f"trade_{query}_{label}.{fmt}"
+        headers = {'Content-Disposition': f'attachment; filename="{name}"'}
+        stream = csv_stream if fmt == 'csv' else xlsx_stream
+        body = flask.stream_with_context(stream(all_batches(), columns))
+        return flask.Response(body, mimetype=MIMETYPES[fmt], headers=headers)
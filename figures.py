@@ -0,0 +1,44 @@
+"""Partial figure updates: a base figure is sent once with the page, callbacks patch its traces.
+
+A page builds each chart's base figure (layout, colours, axes and a fixed list of traces) once
+and puts it in the layout; on a filter change the callback returns patch_traces(...), which only
+carries the new trace data, so the browser re-renders without receiving the whole figure again.
+"""
+import numpy as np
+import pandas as pd
+from dash import Patch
+
+
+def _plain(value):
+    """Lists for array-likes, so patches stay small and picklable for the callback cache"""
+    if isinstance(value, (pd.Series, pd.Index, np.ndarray, pd.Categorical)):
+        return [None if pd.isna(v) else v for v in np.asarray(value, dtype=object).tolist()]
+    return value
+
+
+def patch_traces(traces, layout=None, message=None):
+    """Patch setting the data of a base figure's traces, in the base figure's trace order.
+
+    `traces` holds one dict of trace properties (e.g. x, y, text; 'marker.colors' paths allowed)
+    per trace, or None to hide that trace. `layout` maps dotted layout paths to new values.
+    `message` is shown as a centred annotation (e.g. "No data"); otherwise annotations are cleared.
+    """
+    patch = Patch()
+    for i, trace in enumerate(traces):
+        patch['data'][i]['visible'] = trace is not None
+        for path, value in (trace or {}).items():
+            _assign(patch['data'][i], path, value)
+
+    for path, value in (layout or {}).items():
+        _assign(patch['layout'], path, value)
+
+    patch['layout']['annotations'] = [] if message is None else [
+        dict(text=message, xref="paper", yref="paper", x=0.5, y=0.5, showarrow=False, font=dict(size=14))]
+    return patch
+
+
+def _assign(target, path, value):
+    *parents, leaf = path.split('.')
+    for key in parents:
+        target = target[key]
+    target[leaf] = _plain(value)
@@ -0,0 +1,156 @@
+"""Gunicorn settings: the dataset is loaded once in the master and shared with every worker.
+
+GUNICORN_PROFILE picks how each worker serves requests:
+
+    gthread (default)  one process per core, GUNICORN_THREADS (4) threads each. A slow
+                       callback holds one thread, not the process; pandas releases the GIL
+                       in its inner loops, and a thread waiting on a client costs nothing.
+    sync               a pool of single-threaded processes, two per core. One request per
+                       process at a time, so memory per worker is predictable; put a
+                       buffering proxy (nginx) in front, as a slow client blocks a worker.
+
+WEB_CONCURRENCY overrides the number of workers. Compare the profiles on your hardware with
+benchmarks/bench_serving.py.
+"""
+import gc
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+# Import app.py in the master, which loads the data there in the background. Workers boot at
+# once and answer /healthz (and /readyz with a 503) while it loads, without loading anything
+# themselves; once the data is in, they are replaced by workers forked from the master, which
+# share its memory pages copy-on-write instead of each loading a copy (see when_ready).
+# GUNICORN_PRELOAD=0 has each worker load its own copy in the background instead.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+CORES = multiprocessing.cpu_count()
+
+PROFILES = {
+    'gthread': {'worker_class': 'gthread', 'workers': CORES,
+                'threads': int(os.environ.get('GUNICORN_THREADS', 4))},
+    'sync': {'worker_class': 'sync', 'workers': 2 * CORES, 'threads': 1},
+}
+profile = os.environ.get('GUNICORN_PROFILE', 'gthread')
+if profile not in PROFILES:
+    raise ValueError(f"GUNICORN_PROFILE must be one of {', '.join(PROFILES)}, not {profile!r}")
+
+# The data is shared, so workers are cheap
+worker_class = PROFILES[profile]['worker_class']
+threads = PROFILES[profile]['threads']
+workers = int(os.environ.get('WEB_CONCURRENCY', PROFILES[profile]['workers']))
+
+# The slowest callbacks (page 3 at HS8 over all years, page 6 on a full year) take a few
+# seconds on tens of millions of rows; a worker silent for two minutes is stuck, not busy.
+# Startup (CSV -> Parquet conversion on a new file) happens in a background thread, not in a request.
+timeout = 120
+graceful_timeout = 30
+
+# The browser sends each page's callbacks back to back; keep its connection open between them
+keepalive = 5
+
+# Recycle workers after a number of requests (jittered so they don't all restart at once)...
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+
+# ...or as soon as one's private memory passes WORKER_MAX_MEMORY_MB (0 turns the check off).
+# Only memory the worker owns counts: the preloaded dataset it shares with the master does not.
+WORKER_MAX_MEMORY_MB = int(os.environ.get('WORKER_MAX_MEMORY_MB', 1536))
+
+# Reading the memory maps takes a few milliseconds on a large process, so not on every request
+MEMORY_CHECK_EVERY = 20
+
+
+# While the master loads, this pipe is open: workers forked meanwhile stand in without the data
+# and exit when the master closes its write end, so the master forks replacements that share it.
+# The lock keeps a fork from landing between closing the pipe and forgetting it.
+_loading = None
+_loading_lock = threading.Lock()
+os.register_at_fork(before=_loading_lock.acquire, after_in_parent=_loading_lock.release,
+                    after_in_child=_loading_lock.release)
+
+
+def _trade_data(server):
+    return server.app.wsgi().extensions['trade_data']
+
+
+def when_ready(server):
+    global _loading
+    server.log.info("Serving profile %r: %d %s worker(s) x %d thread(s)", profile, workers, worker_class, threads)
+    if not preload_app:
+        return
+
+    # Fork the workers now, so they answer health checks, and share the data once it is in
+    _loading = os.pipe()
+    threading.Thread(target=_share_when_loaded, args=(server,), name='share-when-loaded', daemon=True).start()
+
+
+def _share_when_loaded(server):
+    global _loading
+    trade_data = _trade_data(server)
+    trade_data.wait()
+
+    # Everything allocated while preloading is long-lived. Freezing it keeps the cyclic
+    # garbage collector from writing to those objects in each worker, which would copy
+    # their pages one by one until every worker held its own copy again.
+    gc.freeze()
+    server.log.info("Froze %d preloaded objects for sharing across workers", gc.get_freeze_count())
+
+    # The master refreshes too when new months are ingested, so workers forked later (recycled
+    # ones) start from the new data, shared again, instead of each re-reading it
+    trade_data.on_ready(lambda data: gc.freeze())
+
+    with _loading_lock:
+        for fd in _loading:
+            os.close(fd)
+        _loading = None
+    server.log.info("Data loaded in the master; replacing the workers that stood in meanwhile")
+
+
+def post_fork(server, worker):
+    if _loading is None:
+        return
+    read_end, write_end = _loading
+    # Only the master keeps the write end, so its closing reaches every stand-in as end-of-file
+    os.close(write_end)
+    _trade_data(server).stand_by()
+    threading.Thread(target=_retire_when_loaded, args=(worker, read_end), name='retire-when-loaded',
+                     daemon=True).start()
+
+
+def _retire_when_loaded(worker, read_end):
+    os.read(read_end, 1)
+    os.close(read_end)
+    # SIGTERM is a graceful exit once the worker has set up its signal handlers
+    while not worker.booted:
+        time.sleep(0.1)
+    worker.log.info("Worker %s stood in while the master loaded the data, exiting", worker.pid)
+    os.kill(worker.pid, signal.SIGTERM)
+
+
+def post_worker_init(worker):
+    # Threads don't survive the fork: each worker starts its own watcher for ingested data
+    worker.wsgi.extensions['trade_data'].watch()
+
+
+def private_memory_mb():
+    """Memory this process does not share with the others (Linux), None where unknown"""
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = dict(line.split(':', 1) for line in f if line.startswith('Private_'))
+    except OSError:
+        return None
+    return sum(int(value.split()[0]) for value in fields.values()) / 1024
+
+
+def post_request(worker, req, environ, resp):
+    if not WORKER_MAX_MEMORY_MB or worker.nr % MEMORY_CHECK_EVERY:
+        return
+    memory = private_memory_mb()
+    if memory is not None and memory > WORKER_MAX_MEMORY_MB and worker.alive:
+        # Finish the requests in flight, then exit; the master forks a fresh worker
+        worker.log.info("Worker %s uses %.0f MB of private memory (limit %d MB), recycling",
+                        worker.pid, memory, WORKER_MAX_MEMORY_MB)
+        worker.alive = False
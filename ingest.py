@@ -0,0 +1,48 @@
+"""Add newly published months to the trade data store without reconverting the full CSV.
+
+    python -m pages.ingest data/extracts/trade_2025_01.csv [more extracts...]
+
+An extract has the trade_data.csv columns and holds whole months: every (TradeType, Year,
+Period) it contains replaces what the store had for that month, so a corrected extract can
+simply be ingested again. Each extract is validated first and nothing is written if a check
+fails. Running workers pick up the new version at their next check (DATA_REFRESH_SECONDS)
+and re-read only the months that changed; no restart is needed.
+
+Replacing data/trade_data.csv itself triggers a full conversion. Ingested months the new CSV
+holds are taken from it; the others are replayed from their extracts. If an extract needed
+for that is gone or changed, the new CSV is refused and the current store kept; then
+
+    python -m pages.ingest --rebuild
+
+converts the CSV anyway, without the months of those extracts.
+"""
+import argparse
+import sys
+
+from pages.data_store import CSV_PATH, STORE_PATH, ensure_store, ingest_extract
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('extracts', nargs='*', help="CSV extracts of new or revised months, ingested in order")
+    parser.add_argument('--csv', default=CSV_PATH, help="the full dataset the store was converted from")
+    parser.add_argument('--store', default=STORE_PATH, help="the Parquet store to add the months to")
+    parser.add_argument('--rebuild', action='store_true',
+                        help="convert a CSV that was refused, dropping the ingested months that cannot be replayed")
+    args = parser.parse_args()
+    if not args.extracts and not args.rebuild:
+        parser.error("give the extracts to ingest, or --rebuild")
+
+    if args.rebuild:
+        ensure_store(args.csv, args.store, force=True)
+
+    for path in args.extracts:
+        try:
+            ingest_extract(path, csv_path=args.csv, store_path=args.store)
+        except ValueError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
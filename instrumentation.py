@@ -0,0 +1,142 @@
+"""Opt-in callback instrumentation: stage timings and payload sizes, served on /metrics.
+
+Enabled with CALLBACK_METRICS=1. Page callbacks mark the end of each stage with lap(),
+e.g. lap('filter') after selecting rows and lap('trend figure') after building a chart;
+the time after the last lap (Dash serializing the outputs) is recorded as 'serialize',
+and the JSON size of every output is measured from the response.
+"""
+import inspect
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+import flask
+import numpy as np
+
+ENABLED = os.environ.get('CALLBACK_METRICS', '') not in ('', '0')
+
+# Latencies kept per callback for percentiles
+WINDOW = 500
+
+_current = threading.local()
+_lock = threading.Lock()
+_metrics = {}
+
+
+def lap(stage):
+    """End `stage` of the running callback; a no-op when instrumentation is off"""
+    listener = getattr(_current, 'listener', None)
+    if listener is not None:
+        listener(stage)
+
+    record = getattr(_current, 'record', None)
+    if record is None:
+        return
+    now = time.perf_counter()
+    record['stages'][stage] = record['stages'].get(stage, 0) + now - record['mark']
+    record['mark'] = now
+
+
+@contextmanager
+def on_lap(listener):
+    """Call `listener(stage)` at every lap() in this thread while the block runs (e.g. progress)"""
+    previous = getattr(_current, 'listener', None)
+    _current.listener = listener
+    try:
+        yield
+    finally:
+        _current.listener = previous
+
+
+def _new_entry(function):
+    return {'function': function, 'calls': 0, 'errors': 0, 'latencies': deque(maxlen=WINDOW),
+            'stages': defaultdict(float), 'payload': defaultdict(int)}
+
+
+def _output_sizes(response):
+    """Bytes of each output ('id.prop') in a serialized Dash callback response"""
+    try:
+        outputs = json.loads(response)['response']
+    except (TypeError, ValueError, KeyError):
+        return {}
+    return {f'{component}.{prop}': len(json.dumps(value))
+            for component, props in outputs.items() for prop, value in props.items()}
+
+
+def _record(key, function, record, total, response, failed):
+    stages = record['stages']
+    stages['serialize'] = stages.get('serialize', 0) + time.perf_counter() - record['mark']
+    sizes = _output_sizes(response) if response is not None else {}
+
+    with _lock:
+        entry = _metrics.setdefault(key, _new_entry(function))
+        entry['calls'] += 1
+        entry['errors'] += failed
+        entry['latencies'].append(total)
+        for stage, seconds in stages.items():
+            entry['stages'][stage] += seconds
+        for output, size in sizes.items():
+            entry['payload'][output] += size
+
+
+def _timed(key, callback):
+    function = inspect.unwrap(callback).__name__
+
+    def wrapper(*args, **kwargs):
+        record = _current.record = {'mark': time.perf_counter(), 'stages': {}}
+        start = record['mark']
+        response, failed = None, True
+        try:
+            response = callback(*args, **kwargs)
+            failed = False
+            return response
+        finally:
+            _current.record = None
+            _record(key, function, record, time.perf_counter() - start,
+                    response if isinstance(response, str) else None, failed)
+
+    wrapper.__wrapped__ = callback
+    return wrapper
+
+
+def metrics():
+    """Per callback (keyed by its outputs, as one function may serve several callbacks): function
+    name, call count, latency percentiles, mean ms per stage and mean bytes per output
+    """
+    report = {}
+    with _lock:
+        for key, entry in _metrics.items():
+            calls = entry['calls'] or 1
+            ms = np.array(entry['latencies']) * 1000
+            report[key] = {
+                'function': entry['function'],
+                'calls': entry['calls'],
+                'errors': entry['errors'],
+                'p50_ms': round(float(np.percentile(ms, 50)), 1) if len(ms) else None,
+                'p95_ms': round(float(np.percentile(ms, 95)), 1) if len(ms) else None,
+                'stages_ms': {stage: round(total * 1000 / calls, 1) for stage, total in entry['stages'].items()},
+                'payload_bytes': {output: total // calls for output, total in entry['payload'].items()},
+            }
+    return report
+
+
+def instrument(app):
+    """Time every registered callback and serve the results on /metrics (local requests only)"""
+    from dash._callback import GLOBAL_CALLBACK_MAP
+    from pages.callback_cache import cache
+
+    # dash.callback registrations move into app.callback_map on the first request
+    for callback_map in (GLOBAL_CALLBACK_MAP, app.callback_map):
+        for key, entry in callback_map.items():
+            entry['callback'] = _timed(key, entry['callback'])
+
+    @app.server.route('/metrics')
+    def metrics_endpoint():
+        if flask.request.remote_addr not in ('127.0.0.1', '::1'):
+            flask.abort(404)
+        return flask.jsonify({'pid': os.getpid(), 'callbacks': metrics(), 'cache': cache.stats()})
+
+    print(f"⏱️ Callback metrics enabled on /metrics ({len(GLOBAL_CALLBACK_MAP) + len(app.callback_map)} callbacks)")
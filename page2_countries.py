@@ -1,15 +1,62 @@
+import functools
+
 from dash import html, dcc, callback, Input, Output, dash_table, State
 import dash_bootstrap_components as dbc
-import plotly.express as px
 import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 import pandas as pd
 from pages.country_mapping import *
+from pages.callback_cache import memoize
+from pages.export import download_links
+from pages.figures import patch_traces
+from pages.instrumentation import lap
+
+# Raw columns this page reads from the trade data store
+COLUMNS = ['TradeType', 'Year', 'Quarter', 'Flow', 'Partner_Country', 'CValue']
+
+# Blocks shown side by side when the comparison view opens
+DEFAULT_COMPARISON = ['COMESA', 'SADC', 'EAC', 'EU']
+
+BLOCK_LABELS = {'EAC_PARTNERS': 'EAC Partner States'}
 
 def format_value(value):
     if pd.isna(value): return "$0.0M"
     return f"${value/1_000_000:.1f}M"
 
+def map_names(df):
+    """Hover name of each map location: the data's partner name for it, else ISO3_MAP's, else the code"""
+    countries = df['Partner_Country']
+    countries = (countries.cat.categories if isinstance(countries.dtype, pd.CategoricalDtype)
+                 else pd.Index(countries.dropna().unique()))
+    names = {}
+    for country, iso3 in ISO3_MAP.items():
+        names.setdefault(iso3, country)
+    names.update((iso3, country) for country, iso3 in zip(countries, iso3_of(countries)) if pd.notna(iso3))
+    return tuple(names.get(iso3, iso3) for iso3 in MAP_LOCATIONS)
+
+@functools.lru_cache(maxsize=1)
+def base_map(names):
+    """The trade map without values: one ISO-3 location per country, named `names`, sent once with the page.
+
+    Callbacks fill in the z values with map_values(), so an update carries numbers, not geometry.
+    """
+    fig = go.Figure(go.Choropleth(
+        locations=list(MAP_LOCATIONS), z=[None] * len(MAP_LOCATIONS),
+        text=list(names), colorscale='Viridis',
+        colorbar=dict(title='CValue'),
+        hovertemplate='Partner_Country=%{text}<br>CValue=%{z:,.0f}<extra></extra>'
+    ))
+    fig.update_layout(margin=dict(l=0,r=0,t=0,b=0), height=500)
+    return fig
+
+def map_values(fdf, message=None):
+    """Patch setting the base map's z values to the partners' total trade (None for no data)"""
+    if fdf is None:
+        z = [None] * len(MAP_LOCATIONS)
+    else:
+        # ISO3 is a Categorical over MAP_LOCATIONS, so the groups come out in the base map's order
+        z = fdf.groupby('ISO3', observed=False)['CValue'].sum(min_count=1).round()
+    return patch_traces([{'z': z}], message=message)
+
 def layout(df):
     return html.Div([
         # Partner Type Radio Buttons
@@ -18,7 +65,8 @@ def layout(df):
             id='p2-partner-type',
             options=[
                 {'label': ' Trade by Continent', 'value': 'continent'},
-                {'label': ' Regional Blocks', 'value': 'regional'}
+                {'label': ' Regional Blocks', 'value': 'regional'},
+                {'label': ' Compare Blocks', 'value': 'compare'}
             ],
             value='continent',
             inline=True,
@@ -58,13 +106,14 @@ def layout(df):
         # Hidden stores
         dcc.Store(id='p2-cont-store', data='All'),
         dcc.Store(id='p2-reg-store', data='COMESA'),
+        dcc.Store(id='p2-cmp-store', data=DEFAULT_COMPARISON),
         
         # Map Section
         dbc.Row([
             dbc.Col([
                 dbc.Card([
                     dbc.CardHeader(html.H5(id='p2-map-title')),
-                    dbc.CardBody([dcc.Graph(id='p2-map', style={'height': '500px'})])
+                    dbc.CardBody([dcc.Graph(id='p2-map', figure=base_map(map_names(df)), style={'height': '500px'})])
                 ], className="shadow-sm")
             ], width=12)
         ], className="mb-4"),
@@ -73,8 +122,22 @@ def layout(df):
         html.Div(id='p2-charts-tables')
     ])
 
-def register_callbacks(app, df):
-    df['Continent'] = df['Partner_Country'].apply(get_continent)
+def add_country_lookups(data):
+    """Continent, map location and block memberships of each partner as cube columns (runs once, when the data has loaded)"""
+    countries = data.cube.data['Partner_Country']
+    iso3 = iso3_of(countries)
+    data.cube.add_columns({'Continent': continent_of(countries), 'ISO3': iso3})
+    data.cube.add_columns(block_membership(countries))
+
+    # Partners the map can't place are left off it; say which, and how much trade that is
+    unmapped = unmapped_partners(countries, iso3, data.cube.data['CValue'])
+    if len(unmapped):
+        print(f"⚠️ {len(unmapped)} partner(s) not on the trade map, {unmapped.sum() / 1e6:,.1f}M of trade: "
+              + ", ".join(f"{country} ({value / 1e6:,.1f}M)" for country, value in unmapped.head(20).items())
+              + (", ..." if len(unmapped) > 20 else ""))
+
+def register_callbacks(app, data):
+    data.on_load(add_country_lookups)
     
     # Show conditional filter
     @callback(
@@ -94,6 +157,13 @@ def register_callbacks(app, df):
                     {'label': 'OCEANIA', 'value': 'OCEANIA'}
                 ], value='All', clearable=False)
             ])
+        elif ptype == 'compare':
+            return html.Div([
+                html.Label("Blocks to Compare:", className="fw-bold"),
+                dcc.Dropdown(id='p2-cmp-dd', options=[
+                    {'label': BLOCK_LABELS.get(b, b), 'value': b} for b in REGIONAL_BLOCKS
+                ], value=DEFAULT_COMPARISON, multi=True, clearable=False)
+            ])
         else:
             return html.Div([
                 html.Label("Regional Block:", className="fw-bold"),
@@ -116,6 +186,9 @@ def register_callbacks(app, df):
     @callback(Output('p2-reg-store', 'data'), Input('p2-reg-dd', 'value'), prevent_initial_call=True)
     def store_reg(v): return v if v else 'COMESA'
     
+    @callback(Output('p2-cmp-store', 'data'), Input('p2-cmp-dd', 'value'), prevent_initial_call=True)
+    def store_cmp(v): return v if v else DEFAULT_COMPARISON
+    
     # Main update
     @callback(
         Output('p2-map-title', 'children'),
@@ -127,57 +200,64 @@ def register_callbacks(app, df):
         Input('p2-quarter', 'value'),
         Input('p2-flow', 'value'),
         Input('p2-cont-store', 'data'),
-        Input('p2-reg-store', 'data')
+        Input('p2-reg-store', 'data'),
+        Input('p2-cmp-store', 'data')
     )
-    def update_all(ttype, ptype, yr, qtr, flw, cont, reg):
-        # Filter
-        fdf = df[df['TradeType'] == ttype].copy()
-        if yr != 'All': fdf = fdf[fdf['Year'] == yr]
-        if qtr != 'All': fdf = fdf[fdf['Quarter'] == qtr]
-        if flw != 'All': fdf = fdf[fdf['Flow'] == flw]
-        
-        # Geographic filter
+    @memoize('page2')
+    def update_all(ttype, ptype, yr, qtr, flw, cont, reg, cmp):
+        # Geographic filter: a continent, or a block's membership column
         if ptype == 'continent':
-            if cont != 'All': fdf = fdf[fdf['Continent'] == cont]
+            geo = {'Continent': cont}
             title = f"Trade Map - {cont if cont != 'All' else 'All Continents'}"
+        elif ptype == 'compare':
+            blocks = [b for b in REGIONAL_BLOCKS if b in cmp]
+            geo = {}
+            title = f"Trade Map - {' vs '.join(b.replace('_', ' ') for b in blocks)}"
         else:
-            if reg == 'EAC': fdf = fdf[fdf['Partner_Country'].isin(EAC_COUNTRIES)]
-            elif reg == 'EAC_PARTNERS': fdf = fdf[fdf['Partner_Country'].isin(EAC_PARTNER_STATES)]
-            elif reg == 'COMESA': fdf = fdf[fdf['Partner_Country'].isin(COMESA_COUNTRIES)]
-            elif reg == 'SADC': fdf = fdf[fdf['Partner_Country'].isin(SADC_COUNTRIES)]
-            elif reg == 'ECOWAS': fdf = fdf[fdf['Partner_Country'].isin(ECOWAS_COUNTRIES)]
-            elif reg == 'CEPGL': fdf = fdf[fdf['Partner_Country'].isin(CEPGL_COUNTRIES)]
-            elif reg == 'COMMONWEALTH': fdf = fdf[fdf['Partner_Country'].isin(COMMONWEALTH_COUNTRIES)]
-            elif reg == 'EU': fdf = fdf[fdf['Partner_Country'].isin(EU_COUNTRIES)]
+            geo = {block_column(reg): True}
             title = f"Trade Map - {reg.replace('_', ' ')}"
         
+        # Filter
+        fdf = data.cube.filter(ttype, Year=yr, Quarter=qtr, Flow=flw, **geo)
+        if ptype == 'compare':
+            # Partners in any of the compared blocks
+            fdf = fdf[fdf[[block_column(b) for b in blocks]].any(axis=1)]
+        lap('filter')
+        
         if len(fdf) == 0:
-            empty = go.Figure()
-            empty.add_annotation(text="No data", xref="paper", yref="paper", x=0.5, y=0.5, showarrow=False)
-            return title, empty, dbc.Alert("No data available", color="warning")
+            return title, map_values(None, "No data"), dbc.Alert("No data available", color="warning")
         
-        # Map
-        mdata = fdf.groupby('Partner_Country')['CValue'].sum().reset_index()
-        fig_map = px.choropleth(mdata, locations='Partner_Country', locationmode='country names',
-                               color='CValue', color_continuous_scale='Viridis')
-        fig_map.update_layout(margin=dict(l=0,r=0,t=0,b=0), height=500)
+        # Map: only the values change, the base figure stays in the browser
+        fig_map = map_values(fdf)
+        lap('map figure')
         
         # Charts based on selection
-        if ptype == 'regional' and reg == 'EAC':
+        if ptype == 'compare':
+            charts = build_block_comparison(fdf, blocks)
+        elif ptype == 'regional' and reg == 'EAC':
             charts = build_eac_line_chart(fdf)
         elif ptype == 'regional' and reg == 'EAC_PARTNERS':
             charts = build_eac_partners_combo(fdf, flw)
         else:
             charts = build_standard_chart(fdf)
         
+        # Full extract behind the annex tables, exported on the server
+        if ptype != 'regional' or reg != 'EAC_PARTNERS':
+            region = {'continent': cont} if ptype == 'continent' else {'block': blocks if ptype == 'compare' else reg}
+            links = download_links("All partners by quarter", 'summary', trade_type=ttype, year=yr, quarter=qtr,
+                                   flow=flw, by=['Quarter', 'Partner_Country'], **region)
+            charts = html.Div([links, charts])
+        lap('charts')
+        
         return title, fig_map, charts
 
 def build_standard_chart(fdf):
     """Clustered bar (flows) + line (total trade) for last 3 years"""
+    from plotly.subplots import make_subplots
     years = sorted(fdf['Year'].unique(), reverse=True)[:3]
-    three_df = fdf[fdf['Year'].isin(years)].copy()
+    three_df = fdf[fdf['Year'].isin(years)]
     
-    agg = three_df.groupby(['Year', 'Quarter', 'Flow'])['CValue'].sum().reset_index()
+    agg = three_df.groupby(['Year', 'Quarter', 'Flow'], observed=True)['CValue'].sum().reset_index()
     agg['CValue_M'] = agg['CValue'] / 1_000_000
     agg['YQ'] = agg['Year'].astype(str) + '-Q' + agg['Quarter'].astype(str)
     agg = agg.sort_values(['Year', 'Quarter'])
@@ -201,7 +281,7 @@ def build_standard_chart(fdf):
     fig.update_layout(barmode='group', height=500)
     
     # Annex table
-    annex = agg.pivot_table(index=['Year','Quarter'], columns='Flow', values='CValue_M', fill_value=0).reset_index()
+    annex = agg.pivot_table(index=['Year','Quarter'], columns='Flow', values='CValue_M', fill_value=0, observed=True).reset_index()
     annex.columns.name = None
     for c in ['E','I','R']:
         if c in annex.columns:
@@ -223,9 +303,46 @@ def build_standard_chart(fdf):
                                    dbc.CardBody([tbl])],className="shadow-sm")],width=12)])
     ])
 
+def build_block_comparison(fdf, blocks):
+    """Compare: bars per block, side by side for each quarter"""
+    import plotly.express as px
+    agg = block_totals(fdf, ['Year', 'Quarter'], blocks)
+    agg['CValue_M'] = agg['CValue']/1_000_000
+    agg['YQ'] = agg['Year'].astype(str)+'-Q'+agg['Quarter'].astype(str)
+    agg = agg.sort_values(['Year', 'Quarter', 'Block'])
+    
+    fig = px.bar(agg, x='YQ', y='CValue_M', color='Block', barmode='group',
+                 category_orders={'Block': blocks})
+    fig.update_layout(height=500, xaxis_title="Year-Quarter", yaxis_title="Trade Value (US$ M)")
+    
+    annex = agg.pivot_table(index=['Year','Quarter'], columns='Block', values='CValue_M', fill_value=0, observed=True).reset_index()
+    annex.columns = [str(c) for c in annex.columns]
+    present = [b for b in blocks if b in annex.columns]
+    for b in present:
+        annex[f'{b}_f'] = annex[b].apply(lambda x: f"{x:.1f}")
+    
+    tbl = dash_table.DataTable(
+        data=annex.to_dict('records'),
+        columns=[{'name':'Year','id':'Year'},{'name':'Quarter','id':'Quarter'}] +
+                [{'name':f"{BLOCK_LABELS.get(b, b)}(M)",'id':f'{b}_f'} for b in present],
+        style_cell={'textAlign':'center','padding':'10px'},
+        style_header={'backgroundColor':'#2c3e50','color':'white','fontWeight':'bold'},
+        export_format='xlsx'
+    )
+    
+    return html.Div([
+        dbc.Row([dbc.Col([dbc.Card([dbc.CardHeader(html.H5("Regional Blocks Compared")),
+                                   dbc.CardBody([dcc.Graph(figure=fig),
+                                                 html.Small("A country in several blocks counts toward each of them.",
+                                                            className="text-muted")])],className="shadow-sm")],width=12)],className="mb-4"),
+        dbc.Row([dbc.Col([dbc.Card([dbc.CardHeader(html.H5("📋 Annex Table")),
+                                   dbc.CardBody([tbl])],className="shadow-sm")],width=12)])
+    ])
+
 def build_eac_line_chart(fdf):
     """EAC: Line chart with flows"""
-    agg = fdf.groupby(['Year','Quarter','Flow'])['CValue'].sum().reset_index()
+    import plotly.express as px
+    agg = fdf.groupby(['Year','Quarter','Flow'], observed=True)['CValue'].sum().reset_index()
     agg['CValue_M'] = agg['CValue']/1_000_000
     agg['YQ'] = agg['Year'].astype(str)+'-Q'+agg['Quarter'].astype(str)
     agg = agg.sort_values(['Year','Quarter'])
@@ -234,7 +351,7 @@ def build_eac_line_chart(fdf):
                  color_discrete_map={'E':'#28a745','I':'#dc3545','R':'#17a2b8'})
     fig.update_layout(height=500, xaxis_title="Year-Quarter", yaxis_title="Trade Value (US$ M)")
     
-    annex = agg.pivot_table(index=['Year','Quarter'], columns='Flow', values='CValue_M', fill_value=0).reset_index()
+    annex = agg.pivot_table(index=['Year','Quarter'], columns='Flow', values='CValue_M', fill_value=0, observed=True).reset_index()
     annex.columns.name = None
     for c in ['E','I','R']:
         if c in annex.columns: annex[f'{c}_f'] = annex[c].apply(lambda x: f"{x:.1f}")
@@ -257,20 +374,21 @@ def build_eac_line_chart(fdf):
 
 def build_eac_partners_combo(fdf, flw):
     """EAC Partners: Bars for 5 countries, line for total EAC (7)"""
+    from plotly.subplots import make_subplots
     if flw == 'All':
         return dbc.Alert("Please select a specific flow (Exports, Imports, or Re-exports)", color="info")
     
-    flow_df = fdf[fdf['Flow']==flw].copy()
+    flow_df = fdf[fdf['Flow']==flw]
     
     # 5 partners
-    partners = flow_df[flow_df['Partner_Country'].isin(EAC_PARTNER_STATES)]
-    pagg = partners.groupby(['Year','Quarter','Partner_Country'])['CValue'].sum().reset_index()
+    partners = flow_df[flow_df[block_column('EAC_PARTNERS')]]
+    pagg = partners.groupby(['Year','Quarter','Partner_Country'], observed=True)['CValue'].sum().reset_index()
     pagg['CValue_M'] = pagg['CValue']/1_000_000
     pagg['YQ'] = pagg['Year'].astype(str)+'-Q'+pagg['Quarter'].astype(str)
     
     # 7 EAC total
-    eac = flow_df[flow_df['Partner_Country'].isin(EAC_COUNTRIES)]
-    eagg = eac.groupby(['Year','Quarter'])['CValue'].sum().reset_index()
+    eac = flow_df[flow_df[block_column('EAC')]]
+    eagg = eac.groupby(['Year','Quarter'], observed=True)['CValue'].sum().reset_index()
     eagg['CValue_M'] = eagg['CValue']/1_000_000
     eagg['YQ'] = eagg['Year'].astype(str)+'-Q'+eagg['Quarter'].astype(str)
     
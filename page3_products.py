@@ -1,6 +1,18 @@
-from dash import html, dcc, callback, Input, Output, dash_table
+import re
+
+from dash import html, dcc, callback, Input, Output, State, dash_table
 import dash_bootstrap_components as dbc
 import pandas as pd
+from pages import background
+from pages.export import download_links
+from pages.callback_cache import memoize
+from pages.instrumentation import lap
+from pages.products import CHILD, HS_LEVELS, PARENT, description_col
+
+# Raw columns this page reads from the trade data store
+COLUMNS = ['TradeType', 'Year', 'Quarter', 'Flow', 'CValue',
+           'HS2', 'HS2_Description', 'HS4', 'HS4_Description', 'HS6', 'HS6_Description',
+           'HS8', 'HS8_Description', 'SITC', 'SITC_Description']
 
 def format_value(value):
     if pd.isna(value): return "$0.0M"
@@ -69,6 +81,12 @@ def layout(df):
         
         html.Hr(),
         
+        # Background job progress (shown only when background callbacks are enabled)
+        background.controls('p3'),
+        
+        # Full, untruncated extract for the selected filters, exported on the server
+        html.Div(id='p3-export'),
+        
         # Table 1: Top 10 Products with Year-Quarter Performance
         dbc.Row([
             dbc.Col([
@@ -93,10 +111,89 @@ def layout(df):
                     ])
                 ], className="shadow-sm")
             ], width=12)
-        ])
+        ]),
+        
+        # Drill-down through the HS hierarchy: HS2 -> HS4 -> HS6 -> HS8
+        dbc.Row([
+            dbc.Col([
+                dbc.Card([
+                    dbc.CardHeader(html.H5("🔎 HS Drill-down")),
+                    dbc.CardBody([
+                        html.P("Pick a chapter, then a heading and a subheading, to see what each breaks down into "
+                               "for the selected year, quarter and flow.", className="text-muted mb-3"),
+                        dbc.Row([
+                            dbc.Col([
+                                html.Label(f"{level}:", className="fw-bold"),
+                                dcc.Dropdown(id=f'p3-drill-{level}', options=[], placeholder=placeholder)
+                            ], width=4)
+                            for level, placeholder in [('HS2', "All chapters"), ('HS4', "All headings"),
+                                                       ('HS6', "All subheadings")]
+                        ], className="mb-3"),
+                        html.Div(id='p3-drill')
+                    ])
+                ], className="shadow-sm")
+            ], width=12)
+        ], className="mt-4")
     ])
 
-def register_callbacks(app, df):
+def drill_options(products, level, trade_type, parent_code=None):
+    """Dropdown options for the codes of `level` (under `parent_code` of the level above)"""
+    if level not in products.levels:
+        return []
+    return [{'label': f"{code} - {description}", 'value': code}
+            for code, description in products.children(level, trade_type, parent_code)]
+
+# Rows of the mapping table sent per page; sorting, filtering and paging happen on the server
+MAPPING_PAGE_SIZE = 50
+
+# DataTable filter clause: '{column}', then the operator as its own token, then the value
+FILTER_CLAUSE = re.compile(r'\s*\{(?P<name>[^}]*)\}\s+'
+                           r'(?:(?P<word>contains|datestartswith|eq|ne|lt|le|gt|ge)(?:\s+|$)|(?P<symbol>>=|<=|!=|<|>|=)\s*)'
+                           r'(?P<value>.*)', re.DOTALL)
+FILTER_SYMBOLS = {'>=': 'ge', '<=': 'le', '<': 'lt', '>': 'gt', '!=': 'ne', '=': 'eq'}
+
+def split_filter_part(filter_part):
+    """(column, operator, value) of one clause of a DataTable filter_query, e.g. '{HS4} contains "0101"'"""
+    match = FILTER_CLAUSE.fullmatch(filter_part)
+    if not match:
+        return None, None, None
+    operator = match['word'] or FILTER_SYMBOLS[match['symbol']]
+    value = match['value'].strip()
+    quote = value[:1]
+    if quote in ("'", '"', '`') and value.endswith(quote) and len(value) > 1:
+        value = value[1:-1].replace('\\' + quote, quote)
+    return match['name'], operator, value
+
+def filter_rows(rows, filter_query):
+    """Rows matching every clause of a DataTable filter_query (codes and descriptions compare as text)"""
+    for filter_part in (filter_query or '').split(' && '):
+        col, operator, value = split_filter_part(filter_part)
+        if col not in rows.columns:
+            continue
+        text = rows[col].astype(str)
+        if operator == 'contains':
+            mask = text.str.contains(value, regex=False)
+        elif operator == 'datestartswith':
+            mask = text.str.startswith(value)
+        else:
+            mask = getattr(text, operator)(value)
+        rows = rows[mask.to_numpy()]
+    return rows
+
+def mapping_page(products, query, page_current, page_size, sort_by, filter_query):
+    """One page of the classification mapping table and the number of pages, for the table's query"""
+    rows = products.mapping(query['level'], query['trade_type'], query['flow'], query['codes'])
+    rows = filter_rows(rows, filter_query)
+    if sort_by:
+        rows = rows.sort_values([s['column_id'] for s in sort_by],
+                                ascending=[s['direction'] == 'asc' for s in sort_by], kind='stable')
+    
+    page_size = page_size or MAPPING_PAGE_SIZE
+    start = (page_current or 0) * page_size
+    page_count = max(1, -(-len(rows) // page_size))
+    return rows.iloc[start:start + page_size].to_dict('records'), page_count
+
+def register_callbacks(app, data):
     
     @callback(
         Output('p3-table1-title', 'children'),
@@ -106,37 +203,24 @@ def register_callbacks(app, df):
         Input('p3-year', 'value'),
         Input('p3-quarter', 'value'),
         Input('p3-flow', 'value'),
-        Input('p3-classification', 'value')
+        Input('p3-classification', 'value'),
+        **background.options('p3')
     )
+    @background.with_progress(stages=4)
+    @memoize('page3')
     def update_page3(trade_type, year, quarter, flow, classification):
         
         try:
-            # Filter data
-            fdf = df[df['TradeType'] == trade_type].copy()
-            fdf = fdf[fdf['Flow'] == flow].copy()
-            
-            # Clean classification codes - remove decimals, handle non-numeric values
-            def clean_code(x):
-                try:
-        # Try to convert to number and remove decimals
-                    return str(int(float(x)))
-                except (ValueError, TypeError):
-        # If not a number, just return as string without decimals
-                  return str(x).replace('.0', '').strip() if pd.notna(x) else ''
-
-            fdf['HS2'] = fdf['HS2'].apply(clean_code)
-            fdf['HS4'] = fdf['HS4'].apply(clean_code)
-            fdf['HS6'] = fdf['HS6'].apply(clean_code)
-            fdf['HS8'] = fdf['HS8'].apply(clean_code)
-            fdf['SITC'] = fdf['SITC'].apply(clean_code)
+            # Check the classification is in the product index (HS2-HS8 and SITC when present)
+            products = data.products
+            if classification not in products.levels:
+                return "Error", dbc.Alert(f"Classification {classification} not found in data", color="danger"), html.Div()
             
-            # Clean descriptions - remove extra whitespace
-            for col in ['HS2_Description', 'HS4_Description', 'HS6_Description', 'HS8_Description', 'SITC_Description']:
-                if col in fdf.columns:
-                    fdf[col] = fdf[col].astype(str).str.strip()
+            # Filter the classification's roll-up (CValue per code and quarter) instead of raw rows
+            fdf = products.select(classification, trade_type, flow=flow)
             
             # Apply year/quarter filter for sorting
-            sort_df = fdf.copy()
+            sort_df = fdf
             if year != 'All':
                 sort_df = sort_df[sort_df['Year'] == year]
             if quarter != 'All':
@@ -144,22 +228,20 @@ def register_callbacks(app, df):
             
             if len(sort_df) == 0:
                 return "No Data", dbc.Alert("No data available for selected filters", color="warning"), html.Div()
+            lap('filter')
             
             # Get description column
-            desc_col = f'{classification}_Description'
-            
-            # Check if classification and description columns exist
-            if classification not in fdf.columns or desc_col not in fdf.columns:
-                return "Error", dbc.Alert(f"Classification {classification} not found in data", color="danger"), html.Div()
+            desc_col = description_col(classification)
             
             # Get top 10 products by selected classification
-            top10_agg = sort_df.groupby([classification, desc_col])['CValue'].sum().reset_index()
+            top10_agg = sort_df.groupby([classification, desc_col], observed=True)['CValue'].sum().reset_index()
             top10_agg = top10_agg.sort_values('CValue', ascending=False).head(10)
             
             if len(top10_agg) == 0:
                 return "No Data", dbc.Alert("No products found for selected filters", color="warning"), html.Div()
             
             top10_codes = top10_agg[classification].tolist()
+            lap('top 10')
             
             # TABLE 1: Year-Quarter Performance for Top 10
             # Determine which years to display (last 3 years)
@@ -183,7 +265,7 @@ def register_callbacks(app, df):
             top10_df['YearQuarter'] = top10_df['Year'].astype(str) + '-Q' + top10_df['Quarter'].astype(str)
             
             # Aggregate by classification and year-quarter
-            agg_df = top10_df.groupby([classification, desc_col, 'YearQuarter'])['CValue'].sum().reset_index()
+            agg_df = top10_df.groupby([classification, desc_col, 'YearQuarter'], observed=True)['CValue'].sum().reset_index()
             
             # Pivot table: Rows = Products, Columns = Year-Quarters
             pivot = agg_df.pivot_table(
@@ -191,7 +273,8 @@ def register_callbacks(app, df):
                 columns='YearQuarter',
                 values='CValue',
                 aggfunc='sum',
-                fill_value=0
+                fill_value=0,
+                observed=True
             ).reset_index()
             
             # Get year-quarter columns and sort them
@@ -257,36 +340,15 @@ def register_callbacks(app, df):
                 export_headers='display',
                 page_size=10
             )
+            lap('performance table')
             
-# TABLE 2: Classification Mapping
-            # Get all records for top 10 products to show ALL their classification mappings
-            mapping_df = fdf[fdf[classification].isin(top10_codes)].copy()
-            
-            # Get unique combinations across all classification levels
-            mapping_cols = [
-                'HS2', 'HS2_Description',
-                'HS4', 'HS4_Description',
-                'HS6', 'HS6_Description',
-                'HS8', 'HS8_Description',
-                'SITC', 'SITC_Description'
-            ]
-            
-            # Ensure all columns exist
-            available_cols = [col for col in mapping_cols if col in mapping_df.columns]
-            
-            # Group to get unique classification combinations for the top 10
-            # Keep all unique combinations without limiting
-            mapping_agg = mapping_df[available_cols].drop_duplicates()
-            
-            # Sort by the selected classification to group related products together
-            mapping_agg = mapping_agg.sort_values(by=[classification] + [available_cols[0]])
-            
-            # Add rank/grouping indicator to show which products from top 10
-            # Create a mapping of selected classification to see all its related codes
-            mapping_agg['Rank'] = mapping_agg[classification].apply(
-                lambda x: top10_codes.index(x) + 1 if x in top10_codes else 999
-            )
-            mapping_agg = mapping_agg.sort_values('Rank').drop('Rank', axis=1)
+            # TABLE 2: Classification Mapping
+            # Every code combination across the levels for the top 10, from the product index's
+            # parent/child table, ranked in top-10 order. Only the first page is sent; the table
+            # asks update_mapping_page for other pages, sorts and filters with the query stored next to it
+            mapping_query = {'trade_type': trade_type, 'flow': flow, 'level': classification, 'codes': top10_codes}
+            first_page, page_count = mapping_page(products, mapping_query, 0, MAPPING_PAGE_SIZE, [], '')
+            available_cols = products.mapping_cols
             
             table2_cols = []
             for i in range(0, len(available_cols), 2):
@@ -312,8 +374,9 @@ def register_callbacks(app, df):
                     'fontWeight': 'bold' if idx < 3 else 'normal'
                 })
             
-            table2 = dash_table.DataTable(
-                data=mapping_agg.to_dict('records'),
+            table2 = [dcc.Store(id='p3-mapping-query', data=mapping_query), dash_table.DataTable(
+                id='p3-mapping-table',
+                data=first_page,
                 columns=table2_cols,
                 style_table={'overflowX': 'auto'},
                 style_cell={
@@ -337,12 +400,17 @@ def register_callbacks(app, df):
                     'fontSize': '13px'
                 },
                 style_data_conditional=style_conditions,
-                page_size=50,  # Increased to show more mappings
-                export_format='xlsx',
-                export_headers='display',
-                filter_action='native',
-                sort_action='native'
-            )
+                page_action='custom',
+                page_current=0,
+                page_size=MAPPING_PAGE_SIZE,
+                page_count=page_count,
+                filter_action='custom',
+                filter_query='',
+                sort_action='custom',
+                sort_mode='multi',
+                sort_by=[]
+            )]
+            lap('mapping table')
             
             # Create title
             flow_names = {'E': 'Exports', 'I': 'Imports', 'R': 'Re-exports'}
@@ -357,4 +425,128 @@ def register_callbacks(app, df):
         
         except Exception as e:
             error_msg = f"Error: {str(e)}"
-            return "Error", dbc.Alert(error_msg, color="danger"), html.Div()
\ No newline at end of file
+            return "Error", dbc.Alert(error_msg, color="danger"), html.Div()
+    
+    # Mapping table pages, sorts and filters; the first page comes with the table from update_page3
+    @callback(
+        Output('p3-mapping-table', 'data'),
+        Output('p3-mapping-table', 'page_count'),
+        Input('p3-mapping-table', 'page_current'),
+        Input('p3-mapping-table', 'page_size'),
+        Input('p3-mapping-table', 'sort_by'),
+        Input('p3-mapping-table', 'filter_query'),
+        State('p3-mapping-query', 'data'),
+        prevent_initial_call=True
+    )
+    @memoize('page3-mapping')
+    def update_mapping_page(page_current, page_size, sort_by, filter_query, query):
+        return mapping_page(data.products, query, page_current, page_size, sort_by, filter_query)
+    
+    # Full extract behind the tables: every code of the level by partner and month
+    @callback(
+        Output('p3-export', 'children'),
+        Input('selected-trade-type', 'children'),
+        Input('p3-year', 'value'),
+        Input('p3-quarter', 'value'),
+        Input('p3-flow', 'value'),
+        Input('p3-classification', 'value')
+    )
+    def update_export_links(trade_type, year, quarter, flow, classification):
+        return download_links(f"All {classification} codes by partner and month", 'summary',
+                              trade_type=trade_type, year=year, quarter=quarter, flow=flow,
+                              by=['Period', classification, description_col(classification), 'Partner_Country'])
+    
+    # Drill-down choices: chapters for the trade type, then the codes under each selection
+    @callback(
+        Output('p3-drill-HS2', 'options'),
+        Input('selected-trade-type', 'children')
+    )
+    def update_drill_chapters(trade_type):
+        return drill_options(data.products, 'HS2', trade_type)
+    
+    def register_drill_level(level):
+        @callback(
+            Output(f'p3-drill-{level}', 'options'),
+            Output(f'p3-drill-{level}', 'value'),
+            Input('selected-trade-type', 'children'),
+            Input(f'p3-drill-{PARENT[level]}', 'value')
+        )
+        def update_drill_level(trade_type, parent_code):
+            # A new selection above starts this level over
+            if parent_code is None:
+                return [], None
+            return drill_options(data.products, level, trade_type, parent_code), None
+    
+    register_drill_level('HS4')
+    register_drill_level('HS6')
+    
+    @callback(
+        Output('p3-drill', 'children'),
+        Input('selected-trade-type', 'children'),
+        Input('p3-year', 'value'),
+        Input('p3-quarter', 'value'),
+        Input('p3-flow', 'value'),
+        Input('p3-drill-HS2', 'value'),
+        Input('p3-drill-HS4', 'value'),
+        Input('p3-drill-HS6', 'value')
+    )
+    @memoize('page3-drill')
+    def update_drilldown(trade_type, year, quarter, flow, hs2, hs4, hs6):
+        # The deepest code picked, and the level its children are on
+        parent, code = None, None
+        for level, value in zip(HS_LEVELS, [hs2, hs4, hs6]):
+            if value is None:
+                break
+            parent, code = level, value
+        level = CHILD[parent] if parent else HS_LEVELS[0]
+        
+        products = data.products
+        if level not in products.levels:
+            return dbc.Alert(f"Classification {level} not found in data", color="danger")
+        
+        rows = products.select(level, trade_type, year, flow)
+        if quarter != 'All':
+            rows = rows[rows['Quarter'] == quarter]
+        if parent:
+            rows = rows[rows[parent] == code]
+        lap('filter')
+        
+        desc_col = description_col(level)
+        drill = rows.groupby([level, desc_col], observed=True)['CValue'].sum().reset_index()
+        drill = drill[drill['CValue'] != 0].sort_values('CValue', ascending=False)
+        if len(drill) == 0:
+            return dbc.Alert("No trade under this selection for the selected filters", color="warning")
+        
+        total = drill['CValue'].sum()
+        drill['Value'] = drill['CValue'].apply(format_value)
+        drill['Share'] = (drill['CValue'] / total * 100).map(lambda x: f"{x:.1f}%")
+        
+        if parent:
+            heading = f"{parent} {code} - {products.descriptions[parent].get(code, '')}"
+        else:
+            heading = "All HS chapters"
+        heading = f"{heading}: {len(drill)} {level} codes, {format_value(total)}"
+        
+        table = dash_table.DataTable(
+            data=drill[[level, desc_col, 'Value', 'Share']].to_dict('records'),
+            columns=[
+                {'name': level, 'id': level},
+                {'name': 'Product Description', 'id': desc_col},
+                {'name': 'Value', 'id': 'Value'},
+                {'name': 'Share', 'id': 'Share'}
+            ],
+            style_table={'overflowX': 'auto'},
+            style_cell={'textAlign': 'left', 'padding': '10px', 'fontFamily': 'Arial', 'fontSize': '12px'},
+            style_cell_conditional=[
+                {'if': {'column_id': level}, 'width': '100px', 'textAlign': 'center', 'fontWeight': 'bold'},
+                {'if': {'column_id': 'Value'}, 'textAlign': 'right'},
+                {'if': {'column_id': 'Share'}, 'textAlign': 'right'}
+            ],
+            style_header={'backgroundColor': '#2c3e50', 'color': 'white', 'fontWeight': 'bold', 'textAlign': 'center'},
+            style_data_conditional=[{'if': {'row_index': 'odd'}, 'backgroundColor': '#f8f9fa'}],
+            export_format='xlsx',
+            export_headers='display',
+            page_size=20
+        )
+        lap('drill-down table')
+        return html.Div([html.H6(heading, className="mb-3"), table])
\ No newline at end of file
@@ -1,17 +1,20 @@
 from dash import html, dcc, callback, Input, Output, dash_table
 import dash_bootstrap_components as dbc
 import pandas as pd
+from pages import background
+from pages.export import download_links
+from pages.callback_cache import memoize
+from pages.instrumentation import lap
+from pages.periods import previous_month
+from pages.query import backend
+
+# Raw columns this page reads from the trade data store
+COLUMNS = ['TradeType', 'Year', 'Period', 'Flow', 'SITC', 'SITC_Description', 'Partner_Country', 'CValue']
 
 def format_value(value):
     if pd.isna(value) or value == 0: return "$0.0M"
     return f"${value/1_000_000:.1f}M"
 
-def clean_code(x):
-    try:
-        return str(int(float(x)))
-    except (ValueError, TypeError):
-        return str(x).replace('.0', '').strip() if pd.notna(x) else ''
-
 def layout(df):
     return html.Div([
         html.H4("📅 Monthly Trade Statistics", className="mb-4"),
@@ -57,6 +60,12 @@ def layout(df):
         
         html.Hr(),
         
+        # Background job progress (shown only when background callbacks are enabled)
+        background.controls('p4'),
+        
+        # Full, untruncated extract for the selected filters, exported on the server
+        html.Div(id='p4-export'),
+        
         # Table 1: Summary Statistics
         dbc.Row([
             dbc.Col([
@@ -94,7 +103,19 @@ def layout(df):
         ])
     ])
 
-def register_callbacks(app, df):
+def register_callbacks(app, data):
+    
+    # Full extract behind the top-10 tables: every SITC group by partner for the month
+    @callback(
+        Output('p4-export', 'children'),
+        Input('selected-trade-type', 'children'),
+        Input('p4-year', 'value'),
+        Input('p4-period', 'value'),
+        Input('p4-flow', 'value')
+    )
+    def update_export_links(trade_type, year, period, flow):
+        return download_links("All SITC groups by partner", 'summary', trade_type=trade_type, year=year,
+                              period=period, flow=flow, by=['SITC', 'SITC_Description', 'Partner_Country'])
     
     @callback(
         Output('p4-summary-table', 'children'),
@@ -105,64 +126,48 @@ def register_callbacks(app, df):
         Input('selected-trade-type', 'children'),
         Input('p4-year', 'value'),
         Input('p4-period', 'value'),
-        Input('p4-flow', 'value')
+        Input('p4-flow', 'value'),
+        **background.options('p4')
     )
+    @background.with_progress(stages=4)
+    @memoize('page4')
     def update_page4(trade_type, year, period, flow):
         
         try:
             # Filter by trade type
-            fdf = df[df['TradeType'] == trade_type].copy()
-            
-            # Clean SITC codes
-            fdf['SITC'] = fdf['SITC'].apply(clean_code)
-            fdf['SITC_Description'] = fdf['SITC_Description'].astype(str).str.strip()
+            cube = data.cube
+            query = backend()
             
             # Determine periods
             selected_year = int(year)
             selected_period = str(period)
-            
-            # Previous month in same year
-            if selected_period == '01':
-                prev_month_year = selected_year - 1
-                prev_month_period = '12'
-            else:
-                prev_month_year = selected_year
-                prev_month_period = f'{int(selected_period) - 1:02d}'
-            
-            # Same period previous year
-            same_period_prev_year = selected_year - 1
-            same_period_prev_period = selected_period
+            prev_month_year, prev_month_period = previous_month(selected_year, selected_period)
+            same_period_prev_year, same_period_prev_period = selected_year - 1, selected_period
             
             # Period labels
             selected_label = f"{selected_year}-{selected_period}"
             prev_month_label = f"{prev_month_year}-{prev_month_period}"
             prev_year_label = f"{same_period_prev_year}-{same_period_prev_period}"
             
-            # ========== TABLE 1: SUMMARY - ALL FLOWS ==========
-            summary_data = []
+            # The three compared periods, in table column order
+            periods = {
+                prev_year_label: (same_period_prev_year, same_period_prev_period),
+                prev_month_label: (prev_month_year, prev_month_period),
+                selected_label: (selected_year, selected_period),
+            }
             
-            for flow_code, flow_name in [('E', 'Total Exports'), ('I', 'Total Imports'), ('R', 'Total Re-exports')]:
-                # Selected period
-                selected_val = fdf[(fdf['Year'] == selected_year) & 
-                                  (fdf['Period'] == selected_period) & 
-                                  (fdf['Flow'] == flow_code)]['CValue'].sum()
-                
-                # Previous month same year
-                prev_month_val = fdf[(fdf['Year'] == prev_month_year) & 
-                                    (fdf['Period'] == prev_month_period) & 
-                                    (fdf['Flow'] == flow_code)]['CValue'].sum()
-                
-                # Same period previous year
-                prev_year_val = fdf[(fdf['Year'] == same_period_prev_year) & 
-                                   (fdf['Period'] == same_period_prev_period) & 
-                                   (fdf['Flow'] == flow_code)]['CValue'].sum()
-                
-                summary_data.append({
-                    'Metric': flow_name,
-                    prev_year_label: format_value(prev_year_val),
-                    prev_month_label: format_value(prev_month_val),
-                    selected_label: format_value(selected_val)
-                })
+            def format_periods(table):
+                for label in periods:
+                    table[label] = table[label].map(format_value)
+                return table
+            lap('filter')
+            
+            # ========== TABLE 1: SUMMARY - ALL FLOWS ==========
+            flow_rows = [('E', 'Total Exports'), ('I', 'Total Imports'), ('R', 'Total Re-exports')]
+            flow_totals = query.compare_periods(cube, trade_type, 'Flow', periods).astype({'Flow': object}).set_index('Flow')
+            flow_totals = flow_totals.reindex([code for code, _ in flow_rows], fill_value=0)
+            flow_totals.insert(0, 'Metric', [name for _, name in flow_rows])
+            summary_data = format_periods(flow_totals.reset_index(drop=True)).to_dict('records')
             
             summary_table = dash_table.DataTable(
                 data=summary_data,
@@ -193,53 +198,24 @@ def register_callbacks(app, df):
                     {'if': {'row_index': 2}, 'backgroundColor': '#d1ecf1'}
                 ]
             )
+            lap('summary table')
             
             # ========== TABLE 2: TOP 10 PRODUCTS BY SITC ==========
             flow_names = {'E': 'Exports', 'I': 'Imports', 'R': 'Re-exports'}
             flow_name = flow_names[flow]
             
-            # Filter by selected flow
-            flow_df = fdf[fdf['Flow'] == flow].copy()
-            
             # Get top 10 by selected period
-            selected_products = flow_df[(flow_df['Year'] == selected_year) & 
-                                       (flow_df['Period'] == selected_period)]
-            
-            top10_sitc = selected_products.groupby(['SITC', 'SITC_Description'])['CValue'].sum().reset_index()
+            top10_sitc = query.totals(cube, trade_type, ['SITC', 'SITC_Description'],
+                                      Flow=flow, Year=selected_year, Period=selected_period)
             top10_sitc = top10_sitc.sort_values('CValue', ascending=False).head(10)
             
             if len(top10_sitc) == 0:
                 products_table = dbc.Alert("No data available for selected period", color="warning")
             else:
-                top10_codes = top10_sitc['SITC'].tolist()
-                
-                products_data = []
-                for _, row in top10_sitc.iterrows():
-                    sitc_code = row['SITC']
-                    sitc_desc = row['SITC_Description']
-                    
-                    # Selected period
-                    sel_val = flow_df[(flow_df['Year'] == selected_year) & 
-                                     (flow_df['Period'] == selected_period) & 
-                                     (flow_df['SITC'] == sitc_code)]['CValue'].sum()
-                    
-                    # Previous month
-                    prev_m_val = flow_df[(flow_df['Year'] == prev_month_year) & 
-                                        (flow_df['Period'] == prev_month_period) & 
-                                        (flow_df['SITC'] == sitc_code)]['CValue'].sum()
-                    
-                    # Previous year same period
-                    prev_y_val = flow_df[(flow_df['Year'] == same_period_prev_year) & 
-                                        (flow_df['Period'] == same_period_prev_period) & 
-                                        (flow_df['SITC'] == sitc_code)]['CValue'].sum()
-                    
-                    products_data.append({
-                        'SITC': sitc_code,
-                        'SITC_Description': sitc_desc,
-                        prev_year_label: format_value(prev_y_val),
-                        prev_month_label: format_value(prev_m_val),
-                        selected_label: format_value(sel_val)
-                    })
+                # All three periods for every SITC code in one pass, joined onto the top 10
+                sitc_totals = query.compare_periods(cube, trade_type, 'SITC', periods, Flow=flow)
+                products = top10_sitc[['SITC', 'SITC_Description']].merge(sitc_totals, on='SITC', how='left')
+                products_data = format_periods(products.fillna({label: 0 for label in periods})).to_dict('records')
                 
                 products_table = dash_table.DataTable(
                     data=products_data,
@@ -273,43 +249,20 @@ def register_callbacks(app, df):
                     export_format='xlsx',
                     export_headers='display'
                 )
+            lap('products table')
             
             # ========== TABLE 3: TOP 10 PARTNERS ==========
             # Get top 10 partners by selected period
-            selected_partners = flow_df[(flow_df['Year'] == selected_year) & 
-                                       (flow_df['Period'] == selected_period)]
-            
-            top10_partners = selected_partners.groupby('Partner_Country')['CValue'].sum().reset_index()
+            top10_partners = query.totals(cube, trade_type, 'Partner_Country',
+                                          Flow=flow, Year=selected_year, Period=selected_period)
             top10_partners = top10_partners.sort_values('CValue', ascending=False).head(10)
             
             if len(top10_partners) == 0:
                 partners_table = dbc.Alert("No data available for selected period", color="warning")
             else:
-                partners_data = []
-                for _, row in top10_partners.iterrows():
-                    country = row['Partner_Country']
-                    
-                    # Selected period
-                    sel_val = flow_df[(flow_df['Year'] == selected_year) & 
-                                     (flow_df['Period'] == selected_period) & 
-                                     (flow_df['Partner_Country'] == country)]['CValue'].sum()
-                    
-                    # Previous month
-                    prev_m_val = flow_df[(flow_df['Year'] == prev_month_year) & 
-                                        (flow_df['Period'] == prev_month_period) & 
-                                        (flow_df['Partner_Country'] == country)]['CValue'].sum()
-                    
-                    # Previous year same period
-                    prev_y_val = flow_df[(flow_df['Year'] == same_period_prev_year) & 
-                                        (flow_df['Period'] == same_period_prev_period) & 
-                                        (flow_df['Partner_Country'] == country)]['CValue'].sum()
-                    
-                    partners_data.append({
-                        'Partner_Country': country,
-                        prev_year_label: format_value(prev_y_val),
-                        prev_month_label: format_value(prev_m_val),
-                        selected_label: format_value(sel_val)
-                    })
+                partner_totals = query.compare_periods(cube, trade_type, 'Partner_Country', periods, Flow=flow)
+                partners = top10_partners[['Partner_Country']].merge(partner_totals, on='Partner_Country', how='left')
+                partners_data = format_periods(partners.fillna({label: 0 for label in periods})).to_dict('records')
                 
                 partners_table = dash_table.DataTable(
                     data=partners_data,
@@ -341,6 +294,7 @@ def register_callbacks(app, df):
                     export_format='xlsx',
                     export_headers='display'
                 )
+            lap('partners table')
             
             products_title = f"Top 10 {flow_name} Products by SITC - Sorted by {selected_label}"
             partners_title = f"Top 10 {flow_name} Partners - Sorted by {selected_label}"
@@ -1,9 +1,20 @@
+import functools
+
 from dash import html, dcc, callback, Input, Output, dash_table
 import dash_bootstrap_components as dbc
-import plotly.express as px
 import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 import pandas as pd
+from pages.callback_cache import memoize
+from pages.export import download_links
+from pages.figures import patch_traces
+from pages.instrumentation import lap
+from pages.query import backend
+
+# Raw columns this page reads from the trade data store
+COLUMNS = ['TradeType', 'Year', 'Quarter', 'Flow', 'Via', 'Borders', 'CValue']
+
+# Flow trace name -> colour, in the border chart's trace order
+FLOW_COLORS = {'Exports': '#28a745', 'Imports': '#dc3545', 'Re-exports': '#17a2b8'}
 
 
 def format_value(value):
@@ -12,12 +23,69 @@ def format_value(value):
     return f"${value/1_000_000:.1f}M"
 
 
+def transport_modes(df):
+    """Transport modes (Via) in the data, sorted; the trend chart has one bar trace per mode"""
+    if df.empty or 'Via' not in df.columns:
+        return ()
+    via = df['Via']
+    modes = via.cat.categories if isinstance(via.dtype, pd.CategoricalDtype) else via.dropna().unique()
+    return tuple(sorted(str(v) for v in modes))
+
+
+@functools.lru_cache(maxsize=4)
+def trend_base(modes):
+    """Trends over time: a bar trace per transport mode plus the total line (secondary axis)"""
+    colors_trend = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b']
+    fig = go.Figure([go.Bar(name=v, x=[], y=[], marker_color=colors_trend[i % len(colors_trend)])
+                     for i, v in enumerate(modes)])
+    fig.add_trace(go.Scatter(name='Total Trade', x=[], y=[], mode='lines+markers',
+                             line=dict(color='#ffc107', width=3), marker=dict(size=7), yaxis='y2'))
+    fig.update_layout(
+        barmode='group',
+        height=450,
+        xaxis=dict(title="Year-Quarter", categoryorder='array'),
+        yaxis=dict(title="Trade Value (US$ Million)"),
+        yaxis2=dict(title="Total Trade (US$ Million)", overlaying='y', side='right'),
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+        hovermode='x unified'
+    )
+    return fig
+
+
+@functools.lru_cache(maxsize=1)
+def donut_base():
+    """Share of each transport mode"""
+    import plotly.express as px
+    fig = go.Figure(go.Pie(
+        labels=[], values=[], hole=0.45, textposition='inside', textinfo='percent+label',
+        hovertemplate='<b>%{label}</b><br>Value: $%{value:.1f}M<br>Share: %{percent}<extra></extra>'
+    ))
+    fig.update_layout(height=420, showlegend=True, piecolorway=px.colors.qualitative.Set2,
+                      legend=dict(orientation="h", yanchor="bottom", y=-0.2))
+    return fig
+
+
+@functools.lru_cache(maxsize=1)
+def border_base():
+    """Trade by border post: a bar trace per flow"""
+    fig = go.Figure([go.Bar(name=name, x=[], y=[], marker_color=color, textposition='outside')
+                     for name, color in FLOW_COLORS.items()])
+    fig.update_layout(
+        barmode='group',
+        height=420,
+        xaxis=dict(title="Border / Customs Office", categoryorder='array'),
+        yaxis=dict(title="Trade Value (US$ Million)"),
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+        hovermode='x unified'
+    )
+    return fig
+
+
 def layout(df):
     # Build transport mode options from Via column
     via_options = [{'label': 'All Modes', 'value': 'All'}]
-    if not df.empty and 'Via' in df.columns:
-        for v in sorted(df['Via'].dropna().unique()):
-            via_options.append({'label': str(v), 'value': str(v)})
+    for v in transport_modes(df):
+        via_options.append({'label': v, 'value': v})
 
     return html.Div([
 
@@ -91,7 +159,7 @@ def layout(df):
                 dbc.Card([
                     dbc.CardHeader(html.H5("📈 Transport Mode Trends Over Time (US$ Million)", className="mb-0")),
                     dbc.CardBody([
-                        dcc.Graph(id='p5-trend-chart', style={'height': '450px'})
+                        dcc.Graph(id='p5-trend-chart', figure=trend_base(transport_modes(df)), style={'height': '450px'})
                     ])
                 ], className="shadow-sm")
             ], width=12)
@@ -103,7 +171,7 @@ def layout(df):
                 dbc.Card([
                     dbc.CardHeader(html.H5("🍩 Distribution of Trade Value by Transport Mode", className="mb-0")),
                     dbc.CardBody([
-                        dcc.Graph(id='p5-donut-chart', style={'height': '420px'})
+                        dcc.Graph(id='p5-donut-chart', figure=donut_base(), style={'height': '420px'})
                     ])
                 ], className="shadow-sm")
             ], width=5),
@@ -111,7 +179,7 @@ def layout(df):
                 dbc.Card([
                     dbc.CardHeader(html.H5("🏢 Trade by Customs Office / Border Post", className="mb-0")),
                     dbc.CardBody([
-                        dcc.Graph(id='p5-border-chart', style={'height': '420px'})
+                        dcc.Graph(id='p5-border-chart', figure=border_base(), style={'height': '420px'})
                     ])
                 ], className="shadow-sm")
             ], width=7),
@@ -143,13 +211,61 @@ def layout(df):
     ])
 
 
-def register_callbacks(app, df):
+def register_callbacks(app, data):
+
+    # ── Empty figure helper ───────────────────────────────────────────────────
+    def empty_fig(n_traces, msg="No data available"):
+        return patch_traces([None] * n_traces, message=msg)
+
+    # Trends over time use every year-quarter, so they have their own callback without the
+    # year and quarter filters: changing those leaves the trend chart alone
+    @callback(
+        Output('p5-trend-chart', 'figure'),
+        Input('selected-trade-type', 'children'),
+        Input('p5-flow', 'value'),
+        Input('p5-mode', 'value'),
+    )
+    @memoize('page5-trend')
+    def update_trend(trade_type, flow, mode):
+        # One trend bar trace per mode, as in the base figure
+        modes = transport_modes(data.cube.data)
+
+        try:
+            # ── CHART 1: Trends Over Time ─────────────────────────────────────
+            cube = data.cube
+            trend_df = cube.filter(trade_type, Flow=flow, Via=mode)
+            if len(trend_df) == 0:
+                return empty_fig(len(modes) + 1)
+            lap('filter')
+
+            trend_agg = trend_df.groupby(['Year', 'Quarter', 'Via'], observed=True)['CValue'].sum().reset_index()
+            trend_agg['CValue_M'] = trend_agg['CValue'] / 1_000_000
+            trend_agg['YQ'] = trend_agg['Year'].astype(str) + '-Q' + trend_agg['Quarter'].astype(str)
+            trend_agg = trend_agg.sort_values(['Year', 'Quarter'])
+
+            all_yq = trend_agg['YQ'].unique()
+
+            trend_bars = []
+            for v in modes:
+                vd = trend_agg[trend_agg['Via'].astype(str) == v]
+                trend_bars.append({'x': vd['YQ'], 'y': vd['CValue_M']} if len(vd) > 0 else None)
+
+            # Total line on the secondary axis
+            total_trend = trend_agg.groupby('YQ')['CValue_M'].sum().reset_index()
+            fig_trend = patch_traces(
+                trend_bars + [{'x': total_trend['YQ'], 'y': total_trend['CValue_M']}],
+                layout={'xaxis.categoryarray': all_yq})
+            lap('trend figure')
+
+            return fig_trend
+
+        except Exception:
+            return empty_fig(len(modes) + 1, "Error loading chart")
 
     @callback(
         Output('p5-kpi-total', 'children'),
         Output('p5-kpi-dominant', 'children'),
         Output('p5-kpi-busiest', 'children'),
-        Output('p5-trend-chart', 'figure'),
         Output('p5-donut-chart', 'figure'),
         Output('p5-border-chart', 'figure'),
         Output('p5-pivot-table', 'children'),
@@ -160,16 +276,9 @@ def register_callbacks(app, df):
         Input('p5-flow', 'value'),
         Input('p5-mode', 'value'),
     )
+    @memoize('page5')
     def update_page5(trade_type, year, quarter, flow, mode):
-
-        # ── Empty figure helper ───────────────────────────────────────────────
-        def empty_fig(msg="No data available"):
-            fig = go.Figure()
-            fig.add_annotation(text=msg, xref="paper", yref="paper",
-                               x=0.5, y=0.5, showarrow=False, font=dict(size=14))
-            fig.update_layout(paper_bgcolor='white', plot_bgcolor='white')
-            return fig
-
+        # Figures are patches of the base figures in the layout
         def kpi_card(title, value, subtitle, color="primary", icon=""):
             return dbc.Card(dbc.CardBody([
                 html.H6(f"{icon} {title}", className="text-muted mb-2", style={'fontSize': '0.85rem'}),
@@ -179,25 +288,17 @@ def register_callbacks(app, df):
 
         try:
             # ── Base filter ───────────────────────────────────────────────────
-            fdf = df[df['TradeType'] == trade_type].copy()
-
-            if year != 'All':
-                fdf = fdf[fdf['Year'] == year]
-            if quarter != 'All':
-                fdf = fdf[fdf['Quarter'] == quarter]
-            if flow != 'All':
-                fdf = fdf[fdf['Flow'] == flow]
-            if mode != 'All':
-                fdf = fdf[fdf['Via'] == mode]
+            cube = data.cube
+            fdf = cube.filter(trade_type, Year=year, Quarter=quarter, Flow=flow, Via=mode)
 
             if len(fdf) == 0:
                 no_data = dbc.Alert("No data available for the selected filters.", color="warning")
-                empty = empty_fig()
                 return (no_data, no_data, no_data,
-                        empty, empty, empty,
+                        empty_fig(1), empty_fig(len(FLOW_COLORS)),
                         no_data, no_data)
 
             flow_names = {'E': 'Exports', 'I': 'Imports', 'R': 'Re-exports'}
+            lap('filter')
 
             # ── KPI 1: Total Trade Value ──────────────────────────────────────
             total_trade = fdf['CValue'].sum()
@@ -209,7 +310,7 @@ def register_callbacks(app, df):
             )
 
             # ── KPI 2: Dominant Transport Mode ────────────────────────────────
-            mode_agg = fdf.groupby('Via')['CValue'].sum()
+            mode_agg = fdf.groupby('Via', observed=True)['CValue'].sum()
             if len(mode_agg) > 0:
                 dominant_mode = mode_agg.idxmax()
                 dominant_val = mode_agg.max()
@@ -224,7 +325,7 @@ def register_callbacks(app, df):
                 kpi_dominant = kpi_card("Dominant Transport Mode", "N/A", "No data", "secondary", "🚚")
 
             # ── KPI 3: Busiest Customs Office ─────────────────────────────────
-            border_agg = fdf.groupby('Borders')['CValue'].sum()
+            border_agg = fdf.groupby('Borders', observed=True)['CValue'].sum()
             if len(border_agg) > 0:
                 busiest_border = border_agg.idxmax()
                 busiest_val = border_agg.max()
@@ -237,120 +338,47 @@ def register_callbacks(app, df):
                 )
             else:
                 kpi_busiest = kpi_card("Busiest Customs Office", "N/A", "No data", "secondary", "🏢")
-
-            # ── CHART 1: Trends Over Time ─────────────────────────────────────
-            # Use full df filtered only by trade type + flow + mode (not year/quarter)
-            # so the trend shows all available year-quarters
-            trend_base = df[df['TradeType'] == trade_type].copy()
-            if flow != 'All':
-                trend_base = trend_base[trend_base['Flow'] == flow]
-            if mode != 'All':
-                trend_base = trend_base[trend_base['Via'] == mode]
-
-            trend_agg = trend_base.groupby(['Year', 'Quarter', 'Via'])['CValue'].sum().reset_index()
-            trend_agg['CValue_M'] = trend_agg['CValue'] / 1_000_000
-            trend_agg['YQ'] = trend_agg['Year'].astype(str) + '-Q' + trend_agg['Quarter'].astype(str)
-            trend_agg = trend_agg.sort_values(['Year', 'Quarter'])
-
-            all_yq = trend_agg['YQ'].unique()
-
-            fig_trend = go.Figure()
-            via_values = trend_agg['Via'].unique()
-            colors_trend = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b']
-
-            for i, v in enumerate(via_values):
-                vd = trend_agg[trend_agg['Via'] == v]
-                fig_trend.add_trace(go.Bar(
-                    name=str(v),
-                    x=vd['YQ'],
-                    y=vd['CValue_M'],
-                    marker_color=colors_trend[i % len(colors_trend)]
-                ))
-
-            # Add total line on secondary axis
-            total_trend = trend_agg.groupby('YQ')['CValue_M'].sum().reset_index()
-            fig_trend.add_trace(go.Scatter(
-                name='Total Trade',
-                x=total_trend['YQ'],
-                y=total_trend['CValue_M'],
-                mode='lines+markers',
-                line=dict(color='#ffc107', width=3),
-                marker=dict(size=7),
-                yaxis='y2'
-            ))
-
-            fig_trend.update_layout(
-                barmode='group',
-                height=450,
-                xaxis=dict(title="Year-Quarter", categoryorder='array', categoryarray=list(all_yq)),
-                yaxis=dict(title="Trade Value (US$ Million)"),
-                yaxis2=dict(title="Total Trade (US$ Million)", overlaying='y', side='right'),
-                legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
-                hovermode='x unified'
-            )
+            lap('kpis')
 
             # ── CHART 2: Donut ────────────────────────────────────────────────
-            donut_agg = fdf.groupby('Via')['CValue'].sum().reset_index()
+            donut_agg = fdf.groupby('Via', observed=True)['CValue'].sum().reset_index()
             donut_agg['CValue_M'] = donut_agg['CValue'] / 1_000_000
 
-            fig_donut = px.pie(
-                donut_agg,
-                values='CValue_M',
-                names='Via',
-                hole=0.45,
-                color_discrete_sequence=px.colors.qualitative.Set2
-            )
-            fig_donut.update_traces(
-                textposition='inside',
-                textinfo='percent+label',
-                hovertemplate='<b>%{label}</b><br>Value: $%{value:.1f}M<br>Share: %{percent}<extra></extra>'
-            )
-            fig_donut.update_layout(height=420, showlegend=True,
-                                    legend=dict(orientation="h", yanchor="bottom", y=-0.2))
+            fig_donut = patch_traces([{'labels': donut_agg['Via'].astype(str), 'values': donut_agg['CValue_M']}])
+            lap('donut figure')
 
             # ── CHART 3: Clustered Bar — Trade by Border/Customs Office ────────
-            border_flow_agg = fdf.groupby(['Borders', 'Flow'])['CValue'].sum().reset_index()
+            border_flow_agg = fdf.groupby(['Borders', 'Flow'], observed=True)['CValue'].sum().reset_index()
             border_flow_agg['CValue_M'] = border_flow_agg['CValue'] / 1_000_000
             border_flow_agg['Flow_Name'] = border_flow_agg['Flow'].map(flow_names)
 
             # Sort borders by total value
-            border_order = border_flow_agg.groupby('Borders')['CValue_M'].sum().sort_values(ascending=False).index.tolist()
-
-            fig_border = go.Figure()
-            color_map = {'Exports': '#28a745', 'Imports': '#dc3545', 'Re-exports': '#17a2b8'}
+            border_order = border_flow_agg.groupby('Borders', observed=True)['CValue_M'].sum().sort_values(ascending=False).index.tolist()
 
-            for fn, clr in color_map.items():
+            border_bars = []
+            for fn in FLOW_COLORS:
                 fd = border_flow_agg[border_flow_agg['Flow_Name'] == fn]
-                if len(fd) > 0:
-                    fig_border.add_trace(go.Bar(
-                        name=fn,
-                        x=fd['Borders'],
-                        y=fd['CValue_M'],
-                        marker_color=clr,
-                        text=fd['CValue_M'].apply(lambda x: f"${x:.1f}M"),
-                        textposition='outside'
-                    ))
-
-            fig_border.update_layout(
-                barmode='group',
-                height=420,
-                xaxis=dict(title="Border / Customs Office", categoryorder='array', categoryarray=border_order),
-                yaxis=dict(title="Trade Value (US$ Million)"),
-                legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
-                hovermode='x unified'
-            )
+                border_bars.append({
+                    'x': fd['Borders'].astype(str),
+                    'y': fd['CValue_M'],
+                    'text': fd['CValue_M'].apply(lambda x: f"${x:.1f}M"),
+                } if len(fd) > 0 else None)
+
+            fig_border = patch_traces(border_bars, layout={'xaxis.categoryarray': [str(b) for b in border_order]})
+            lap('border figure')
 
             # ── PIVOT TABLE ───────────────────────────────────────────────────
-            pivot_base = fdf.copy()
-            pivot_base['YQ'] = pivot_base['Year'].astype(str) + '-Q' + pivot_base['Quarter'].astype(str)
-            pivot_agg = pivot_base.groupby(['Via', 'YQ'])['CValue'].sum().reset_index()
+            pivot_agg = backend().totals(cube, trade_type, ['Via', 'Year', 'Quarter'],
+                                         Year=year, Quarter=quarter, Flow=flow, Via=mode)
+            pivot_agg['YQ'] = pivot_agg['Year'].astype(str) + '-Q' + pivot_agg['Quarter'].astype(str)
             pivot_agg['CValue_M'] = pivot_agg['CValue'] / 1_000_000
 
             pivot_table = pivot_agg.pivot_table(
                 index='Via',
                 columns='YQ',
                 values='CValue_M',
-                fill_value=0
+                fill_value=0,
+                observed=True
             ).reset_index()
             pivot_table.columns.name = None
 
@@ -410,6 +438,13 @@ def register_callbacks(app, df):
                 export_format='xlsx',
                 export_headers='display'
             )
+            # Full extract behind the pivot, exported on the server
+            pivot_dt = html.Div([
+                download_links("Transport modes by quarter and border", 'summary', trade_type=trade_type, year=year,
+                               quarter=quarter, flow=flow, via=mode, by=['Via', 'Quarter', 'Borders']),
+                pivot_dt
+            ])
+            lap('pivot table')
 
             # ── KEY INSIGHTS ──────────────────────────────────────────────────
             # Transport Infrastructure
@@ -479,14 +514,14 @@ def register_callbacks(app, df):
                     ], className="shadow-sm h-100", style={'border-left': '4px solid #007bff'})
                 ], width=4),
             ])
+            lap('insights')
 
             return (kpi_total, kpi_dominant, kpi_busiest,
-                    fig_trend, fig_donut, fig_border,
+                    fig_donut, fig_border,
                     pivot_dt, insights)
 
         except Exception as e:
             error = dbc.Alert(f"Error loading page: {str(e)}", color="danger")
-            empty = empty_fig("Error loading chart")
             return (error, error, error,
-                    empty, empty, empty,
+                    empty_fig(1, "Error loading chart"), empty_fig(len(FLOW_COLORS), "Error loading chart"),
                     error, error)
\ No newline at end of file
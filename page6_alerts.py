@@ -1,8 +1,19 @@
 from dash import html, dcc, callback, Input, Output, dash_table
 import dash_bootstrap_components as dbc
-import plotly.express as px
 import plotly.graph_objects as go
 import pandas as pd
+from pages.alerts import (ALERT_DECREASE, ALERT_INCREASE, ALERT_MIXED, ALERT_NORMAL, ALERT_ORDER,
+                          THRESHOLDS, movement_alerts, thresholds_for)
+from pages import background
+from pages.callback_cache import memoize
+from pages.instrumentation import lap
+from pages.periods import previous_quarter
+
+# Raw columns this page reads from the trade data store
+COLUMNS = ['TradeType', 'Year', 'Quarter', 'Flow', 'SITC_Description', 'Partner_Country', 'CValue']
+
+# Analysis dimension -> cleaned key column added to the cube for grouping
+ALERT_KEYS = {'SITC_Description': 'Alert_SITC', 'Partner_Country': 'Alert_Country'}
 
 
 def format_value(value):
@@ -85,6 +96,9 @@ def layout(df):
 
         html.Hr(),
 
+        # Background job progress (shown only when background callbacks are enabled)
+        background.controls('p6'),
+
         # ── KPI Cards: Alert Summary ──────────────────────────────────────────
         dbc.Row([
             dbc.Col(html.Div(id='p6-kpi-total'), width=3),
@@ -104,7 +118,9 @@ def layout(df):
                         html.P([
                             "Alert Logic: Flags items where ",
                             html.Strong("BOTH"),
-                            " QoQ change AND YoY change are extreme (> +40% or < -40%)."
+                            " QoQ change AND YoY change are extreme (by default > "
+                            f"{THRESHOLDS['default']['increase']:+g}% or < {THRESHOLDS['default']['decrease']:+g}%; "
+                            "thresholds can be set per flow and analysis level)."
                         ], className="text-muted small mb-3"),
                         html.Div(id='p6-movements-table')
                     ])
@@ -159,7 +175,15 @@ def layout(df):
     ])
 
 
-def register_callbacks(app, df):
+def add_alert_keys(data):
+    """Alert keys as cube columns, cleaned once: missing -> 'Unknown', whitespace stripped"""
+    for col, key in ALERT_KEYS.items():
+        labels = data.cube.data[col].dropna().unique()
+        data.cube.map_column(key, col, {label: str(label).strip() for label in labels}, default='Unknown')
+
+
+def register_callbacks(app, data):
+    data.on_load(add_alert_keys)
 
     @callback(
         Output('p6-kpi-total', 'children'),
@@ -174,8 +198,12 @@ def register_callbacks(app, df):
         Input('p6-quarter', 'value'),
         Input('p6-flow', 'value'),
         Input('p6-analysis', 'value'),
+        **background.options('p6')
     )
+    @background.with_progress(stages=5)
+    @memoize('page6')
     def update_page6(trade_type, year, quarter, flow, analysis):
+        import plotly.express as px
 
         def empty_fig(msg="No data available"):
             fig = go.Figure()
@@ -193,13 +221,13 @@ def register_callbacks(app, df):
 
         try:
             # ── Base Filter ───────────────────────────────────────────────────
-            fdf = df[df['TradeType'] == trade_type].copy()
-            fdf = fdf[fdf['Flow'] == flow].copy()
+            fdf = data.cube.filter(trade_type, Flow=flow)
 
             if len(fdf) == 0:
                 no_data = dbc.Alert("No data available for selected filters.", color="warning")
                 empty = empty_fig()
                 return (no_data, no_data, no_data, no_data, no_data, empty, empty)
+            lap('filter')
 
             # ── Determine Dimension ───────────────────────────────────────────
             if analysis == 'sitc':
@@ -209,85 +237,27 @@ def register_callbacks(app, df):
                 dim_col = 'Partner_Country'
                 dim_label = 'Country'
 
-            # Clean dimension
-            fdf[dim_col] = fdf[dim_col].fillna('Unknown').astype(str).str.strip()
-
             # ── Calculate periods ─────────────────────────────────────────────
             current_year = int(year)
             current_quarter = str(quarter)
-
-            # Previous quarter (wrap around)
-            if current_quarter == '1':
-                prev_quarter = '4'
-                prev_quarter_year = current_year - 1
-            else:
-                prev_quarter = str(int(current_quarter) - 1)
-                prev_quarter_year = current_year
-
-            # Same quarter previous year
-            prev_year_quarter = current_quarter
-            prev_year_year = current_year - 1
-
-            # ── Aggregate data ────────────────────────────────────────────────
-            # Current period
-            current_df = fdf[(fdf['Year'] == current_year) & (fdf['Quarter'] == current_quarter)]
-            current_agg = current_df.groupby(dim_col)['CValue'].sum().reset_index()
-            current_agg.rename(columns={'CValue': 'Current_Value'}, inplace=True)
-
-            # Previous quarter
-            prev_q_df = fdf[(fdf['Year'] == prev_quarter_year) & (fdf['Quarter'] == prev_quarter)]
-            prev_q_agg = prev_q_df.groupby(dim_col)['CValue'].sum().reset_index()
-            prev_q_agg.rename(columns={'CValue': 'PrevQ_Value'}, inplace=True)
-
-            # Previous year same quarter
-            prev_y_df = fdf[(fdf['Year'] == prev_year_year) & (fdf['Quarter'] == prev_year_quarter)]
-            prev_y_agg = prev_y_df.groupby(dim_col)['CValue'].sum().reset_index()
-            prev_y_agg.rename(columns={'CValue': 'PrevY_Value'}, inplace=True)
-
-            # ── Merge all periods ─────────────────────────────────────────────
-            merged = current_agg.merge(prev_q_agg, on=dim_col, how='left')
-            merged = merged.merge(prev_y_agg, on=dim_col, how='left')
-
-            # Fill missing with 0
-            merged['PrevQ_Value'] = merged['PrevQ_Value'].fillna(0)
-            merged['PrevY_Value'] = merged['PrevY_Value'].fillna(0)
-
-            # ── Calculate changes ─────────────────────────────────────────────
-            merged['QoQ_Change'] = ((merged['Current_Value'] - merged['PrevQ_Value']) / 
-                                    merged['PrevQ_Value'] * 100).replace([float('inf'), -float('inf')], 0)
-            merged['YoY_Change'] = ((merged['Current_Value'] - merged['PrevY_Value']) / 
-                                    merged['PrevY_Value'] * 100).replace([float('inf'), -float('inf')], 0)
-
-            # Handle division by zero
-            merged.loc[merged['PrevQ_Value'] == 0, 'QoQ_Change'] = 0
-            merged.loc[merged['PrevY_Value'] == 0, 'YoY_Change'] = 0
-
-            # ── Alert Logic (BOTH must be extreme) ───────────────────────────
-            def determine_alert(row):
-                qoq = row['QoQ_Change']
-                yoy = row['YoY_Change']
-
-                # Both must be extreme
-                qoq_extreme = (qoq > 40) or (qoq < -40)
-                yoy_extreme = (yoy > 40) or (yoy < -40)
-
-                if qoq_extreme and yoy_extreme:
-                    if qoq > 40 and yoy > 40:
-                        return '🔴 Extreme Increase'
-                    elif qoq < -40 and yoy < -40:
-                        return '🟠 Extreme Decrease'
-                    else:
-                        return '🟡 Mixed Signal'
-                else:
-                    return '🟢 Normal Movement'
-
-            merged['Alert'] = merged.apply(determine_alert, axis=1)
+            prev_quarter_year, prev_quarter = previous_quarter(current_year, current_quarter)
+            prev_year_year, prev_year_quarter = current_year - 1, current_quarter
+
+            # ── Compare periods and classify (one grouped pass) ──────────────
+            merged = movement_alerts(
+                fdf, ALERT_KEYS[dim_col],
+                current=(current_year, current_quarter),
+                prev_quarter=(prev_quarter_year, prev_quarter),
+                prev_year=(prev_year_year, prev_year_quarter),
+                thresholds=thresholds_for(flow, analysis),
+            ).rename(columns={ALERT_KEYS[dim_col]: dim_col})
+            lap('compare and classify')
 
             # ── Alert Counts ──────────────────────────────────────────────────
             total_alerts = len(merged)
-            increases = len(merged[merged['Alert'] == '🔴 Extreme Increase'])
-            decreases = len(merged[merged['Alert'] == '🟠 Extreme Decrease'])
-            normal = len(merged[merged['Alert'] == '🟢 Normal Movement'])
+            increases = int((merged['Alert'] == ALERT_INCREASE).sum())
+            decreases = int((merged['Alert'] == ALERT_DECREASE).sum())
+            normal = int((merged['Alert'] == ALERT_NORMAL).sum())
 
             # KPIs
             kpi_total = kpi_card("Total Items Analyzed", total_alerts, 
@@ -300,12 +270,7 @@ def register_callbacks(app, df):
                                  "Within expected range", "success", "✅")
 
             # ── Table: Sort by Alert Severity ────────────────────────────────
-            alert_order = {
-                '🔴 Extreme Increase': 1,
-                '🟠 Extreme Decrease': 2,
-                '🟡 Mixed Signal': 3,
-                '🟢 Normal Movement': 4
-            }
+            alert_order = {alert: rank for rank, alert in enumerate(ALERT_ORDER, 1)}
             merged['Alert_Order'] = merged['Alert'].map(alert_order)
             merged = merged.sort_values('Alert_Order')
 
@@ -350,11 +315,11 @@ def register_callbacks(app, df):
                 },
                 style_data_conditional=[
                     {'if': {'row_index': 'odd'}, 'backgroundColor': '#f8f9fa'},
-                    {'if': {'filter_query': '{Alert} = "🔴 Extreme Increase"'}, 
+                    {'if': {'filter_query': f'{{Alert}} = "{ALERT_INCREASE}"'}, 
                      'backgroundColor': '#f8d7da', 'color': '#721c24'},
-                    {'if': {'filter_query': '{Alert} = "🟠 Extreme Decrease"'}, 
+                    {'if': {'filter_query': f'{{Alert}} = "{ALERT_DECREASE}"'}, 
                      'backgroundColor': '#fff3cd', 'color': '#856404'},
-                    {'if': {'filter_query': '{Alert} = "🟢 Normal Movement"'}, 
+                    {'if': {'filter_query': f'{{Alert}} = "{ALERT_NORMAL}"'}, 
                      'backgroundColor': '#d4edda', 'color': '#155724'},
                 ],
                 page_size=20,
@@ -363,16 +328,17 @@ def register_callbacks(app, df):
                 filter_action='native',
                 sort_action='native'
             )
+            lap('kpis and table')
 
             # ── Pie Chart: Alert Distribution ─────────────────────────────────
             alert_counts = merged['Alert'].value_counts().reset_index()
             alert_counts.columns = ['Alert', 'Count']
 
             color_map_pie = {
-                '🔴 Extreme Increase': '#dc3545',
-                '🟠 Extreme Decrease': '#ffc107',
-                '🟡 Mixed Signal': '#6c757d',
-                '🟢 Normal Movement': '#28a745'
+                ALERT_INCREASE: '#dc3545',
+                ALERT_DECREASE: '#ffc107',
+                ALERT_MIXED: '#6c757d',
+                ALERT_NORMAL: '#28a745'
             }
 
             fig_pie = px.pie(
@@ -386,10 +352,11 @@ def register_callbacks(app, df):
             fig_pie.update_traces(textposition='inside', textinfo='percent+label')
             fig_pie.update_layout(height=380, showlegend=True,
                                  legend=dict(orientation="h", yanchor="bottom", y=-0.2))
+            lap('pie figure')
 
             # ── Bar Chart: Top 5 Increases vs Top 5 Decreases ────────────────
-            increases_df = merged[merged['Alert'] == '🔴 Extreme Increase'].nlargest(5, 'QoQ_Change')
-            decreases_df = merged[merged['Alert'] == '🟠 Extreme Decrease'].nsmallest(5, 'QoQ_Change')
+            increases_df = merged[merged['Alert'] == ALERT_INCREASE].nlargest(5, 'QoQ_Change')
+            decreases_df = merged[merged['Alert'] == ALERT_DECREASE].nsmallest(5, 'QoQ_Change')
 
             fig_bar = go.Figure()
 
@@ -423,6 +390,7 @@ def register_callbacks(app, df):
                 legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
                 hovermode='y unified'
             )
+            lap('bar figure')
 
             return (kpi_total, kpi_increases, kpi_decreases, kpi_normal,
                     movements_table, fig_pie, fig_bar)
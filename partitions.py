@@ -0,0 +1,57 @@
+"""Trade rows left on disk, read from the Parquet store one partition at a time.
+
+With DATA_MODE=disk (see pages.dataset) the rows are never held in memory as one frame: the
+cube and the product index are aggregated a (TradeType, Year, Flow) partition at a time, and
+what needs the rows themselves (the export endpoint) reads only the partitions its filters
+select, with the other filters pushed down to the Parquet reader. Memory then follows the
+partitions a query touches rather than the size of the dataset.
+"""
+from pages.data_store import STORE_PATH, live_store, read_partition, store_partitions
+from pages.views import INDEX_KEYS, selected, selection
+
+# Raw columns the load-time cleaning reads, whatever the query asks for
+CLEANING_COLUMNS = ['Year', 'Quarter', 'Period', 'Flow', 'Via']
+
+
+class PartitionIndex:
+    """The rows of the store, selected like a TradeIndex but read from disk on each frames() call"""
+
+    def __init__(self, columns, read_columns, prepare, store_path=STORE_PATH, version_path=None):
+        """`columns` are those of the prepared rows; `read_columns` the raw ones read from the store,
+        which `prepare(rows)` cleans like the rows loaded into memory. Reads go to one version of
+        the store (`version_path`, by default the live one), even after newer ones are ingested.
+        """
+        self.keys = list(INDEX_KEYS)
+        self.columns = list(columns)
+        self.read_columns = list(read_columns)
+        self.prepare = prepare
+        self.store_path = store_path
+        self.version_path = version_path or live_store(store_path)
+        self.partitions = store_partitions(self.version_path)
+
+    def rescan(self):
+        """The same index over the partitions in the store now (after new data was ingested)"""
+        return PartitionIndex(self.columns, self.read_columns, self.prepare, self.store_path)
+
+    def frames(self, trade_type, year=None, flow=None, columns=None, filters=None):
+        """(key, rows) of each partition matching the selection, in key order, narrowed to the
+        accepted values of `filters` ({column: values, None = any}) and to `columns`
+        """
+        read = self.read_columns
+        if columns:
+            wanted = set(columns) | set(CLEANING_COLUMNS) | set(filters or {})
+            read = [c for c in read if c in wanted]
+
+        selecting = selection(trade_type, year, flow)
+        for key in self.partitions:
+            if not selected(key, selecting):
+                continue
+            rows = read_partition(key, read, filters, self.version_path)
+            if rows.empty:
+                continue
+            rows = self.prepare(rows)
+            # Pushed-down filters matched the raw values; match the cleaned ones exactly
+            for col, values in (filters or {}).items():
+                if values is not None:
+                    rows = rows[rows[col].isin(values)]
+            yield key, rows[columns] if columns else rows
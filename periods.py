@@ -0,0 +1,60 @@
+"""Period-over-period comparison: totals for several periods per key in one grouped pass"""
+import numpy as np
+import pandas as pd
+
+
+def previous_month(year, period):
+    """(year, 'MM') of the month before a (year, 'MM') period"""
+    if period == '01':
+        return year - 1, '12'
+    return year, f'{int(period) - 1:02d}'
+
+
+def previous_quarter(year, quarter):
+    """(year, 'Q') of the quarter before a (year, 'Q') period"""
+    if quarter == '1':
+        return year - 1, '4'
+    return year, str(int(quarter) - 1)
+
+
+def label_periods(frame, periods, period_cols=('Year', 'Period')):
+    """Categorical naming the period each row falls in (NaN for rows in none of them).
+
+    `periods` maps a label to the values of `period_cols` for that period; the periods
+    are expected not to overlap (a row is only ever counted for the first match).
+    """
+    labels = list(periods)
+    conditions = [
+        np.logical_and.reduce([(frame[col] == value).to_numpy() for col, value in zip(period_cols, key)])
+        for key in periods.values()
+    ]
+    codes = np.select(conditions, np.arange(len(labels)), default=-1) if len(frame) else np.empty(0, dtype=int)
+    return pd.Categorical.from_codes(codes, categories=labels)
+
+
+def compare_periods(frame, by, periods, period_cols=('Year', 'Period'), value='CValue', require=None):
+    """Total of `value` per `by` key for each period in `periods`, as one tidy frame.
+
+    e.g. compare_periods(fdf, 'SITC', {'2024-03': (2024, '03'), '2024-02': (2024, '02')})
+    returns one row per SITC code with a '2024-03' and a '2024-02' column (0 when the key
+    had no trade in that period). Keys with no trade in any of the periods are left out,
+    and with `require` set to a label, so are keys without trade in that period.
+    """
+    by = [by] if isinstance(by, str) else list(by)
+    labels = list(periods)
+
+    period = label_periods(frame, periods, period_cols)
+    in_period = period.codes >= 0
+    rows = frame.loc[in_period, by + [value]]
+    period = pd.Series(period[in_period], index=rows.index, name='_period')
+
+    totals = (rows.groupby(by + [period], observed=True)[value].sum()
+                  .unstack('_period', fill_value=0)
+                  .reindex(columns=labels, fill_value=0)
+                  .rename_axis(columns=None)
+                  .reset_index())
+
+    if require is not None:
+        present = rows.loc[(period == require).to_numpy(), by].drop_duplicates()
+        totals = totals.merge(present, on=by)
+    return totals
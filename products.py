@@ -0,0 +1,109 @@
+"""Product hierarchy index (HS2 -> HS4 -> HS6 -> HS8, plus SITC) built once when the data loads.
+
+Holds the parent/child code table (every distinct combination of codes and descriptions),
+a code -> description dictionary per level, and CValue pre-rolled at each level per trade
+type, year, quarter and flow, so page 3 switches level or drills down without rescanning rows.
+"""
+import pandas as pd
+
+from pages.schema import concat_frames
+from pages.views import TradeIndex
+
+HS_LEVELS = ['HS2', 'HS4', 'HS6', 'HS8']
+LEVELS = HS_LEVELS + ['SITC']
+
+# Each HS level's parent and child
+PARENT = {'HS4': 'HS2', 'HS6': 'HS4', 'HS8': 'HS6'}
+CHILD = {parent: child for child, parent in PARENT.items()}
+
+# Dimensions every roll-up keeps
+ROLLUP_DIMS = ['TradeType', 'Year', 'Quarter', 'Flow']
+
+
+def description_col(level):
+    return f'{level}_Description'
+
+
+def product_tables(df):
+    """The parent/child code table and per-level CValue roll-ups of the rows of `df`"""
+    levels = [level for level in LEVELS if level in df.columns and description_col(level) in df.columns]
+    mapping_cols = [col for level in levels for col in (level, description_col(level))]
+    if df.empty or not levels:
+        return {'codes': pd.DataFrame(columns=['TradeType', 'Year', 'Flow'] + mapping_cols),
+                **{level: pd.DataFrame() for level in levels}}
+
+    tables = {'codes': df[['TradeType', 'Year', 'Flow'] + mapping_cols].drop_duplicates()}
+    for level in levels:
+        parent = [PARENT[level]] if PARENT.get(level) in levels else []
+        keys = ROLLUP_DIMS + parent + [level, description_col(level)]
+        tables[level] = df.groupby(keys, observed=True, sort=False)['CValue'].sum().reset_index()
+    return tables
+
+
+def _in_years(df, pairs):
+    """Rows of any of the (TradeType, Year) pairs"""
+    mask = pd.Series(False, index=df.index)
+    if df.empty:
+        return mask.to_numpy()
+    for trade_type, year in pairs:
+        mask |= (df['TradeType'] == trade_type) & (df['Year'] == year)
+    return mask.to_numpy()
+
+
+class ProductIndex:
+    """Codes, descriptions and per-level CValue roll-ups of the trade rows"""
+
+    def __init__(self, df, tables=None):
+        """Build from the rows of `df`, or index `tables` already built from rows like them"""
+        self.levels = [level for level in LEVELS if level in df.columns and description_col(level) in df.columns]
+        self.mapping_cols = [col for level in self.levels for col in (level, description_col(level))]
+
+        if tables is None:
+            tables = product_tables(df)
+            print(f"🗂️ Product index built: {len(tables['codes']):,} code combinations, "
+                  f"{', '.join(f'{level} {len(tables[level]):,}' for level in self.levels)} roll-up rows")
+        # Both indexed like the cube: contiguous row ranges per (TradeType, Year, Flow)
+        self.codes = TradeIndex(tables['codes'])
+        self.rollups = {level: TradeIndex(tables[level]) for level in self.levels}
+        self.tables = {'codes': self.codes.df, **{level: index.df for level, index in self.rollups.items()}}
+
+        codes = self.codes.df
+        self.descriptions = {
+            level: dict(codes[[level, description_col(level)]].drop_duplicates(level).itertuples(index=False))
+            for level in self.levels}
+
+    def with_partitions(self, index, months):
+        """A new product index with the (TradeType, Year) partitions of `months` rebuilt from the
+        rows of `index` (the already refreshed TradeIndex); every other year is kept
+        """
+        pairs = sorted({(trade_type, int(year)) for trade_type, year, _ in months})
+        rows = concat_frames([index.select(trade_type, year) for trade_type, year in pairs])
+        fresh = product_tables(rows)
+
+        tables = {name: concat_frames([table[~_in_years(table, pairs)], fresh[name]])
+                  for name, table in self.tables.items()}
+        print(f"🗂️ Product index updated: {len(pairs)} year(s) rebuilt from {len(rows):,} rows")
+        return ProductIndex(rows, tables=tables)
+
+    def select(self, level, trade_type, year=None, flow=None):
+        """Roll-up rows of one level (code, description, CValue per quarter) for a trade type"""
+        return self.rollups[level].select(trade_type, year, flow)
+
+    def mapping(self, level, trade_type, flow, codes):
+        """Distinct code combinations across all levels for some codes of `level`, in the order of `codes`"""
+        table = self.codes.select(trade_type, flow=flow)
+        table = table.loc[table[level].isin(codes), self.mapping_cols].drop_duplicates()
+
+        rank = {code: i for i, code in enumerate(codes)}
+        order = table[level].astype(object).map(rank)
+        return (table.assign(_rank=order.to_numpy())
+                .sort_values(['_rank'] + self.mapping_cols, kind='stable')
+                .drop(columns='_rank'))
+
+    def children(self, level, trade_type, code=None):
+        """(code, description) of every code of `level` under `code` of the parent level, sorted by code"""
+        table = self.codes.select(trade_type)
+        if code is not None:
+            table = table[table[PARENT[level]] == code]
+        pairs = table[[level, description_col(level)]].drop_duplicates(level)
+        return sorted(pairs.itertuples(index=False, name=None))
@@ -0,0 +1,183 @@
+"""Query backends for the page aggregations: pandas (default) or an embedded DuckDB engine.
+
+The pages' heaviest aggregations (page 1's quarterly totals by flow and top partners, page 4's
+three-period comparisons and page 5's transport mode by quarter pivot) are group-by sums over
+the trade cube. They go through backend(), which answers them with pandas, or with
+QUERY_BACKEND=duckdb as SQL in an in-process DuckDB database. DuckDB holds a copy of the
+published cube, runs each query on several cores and releases the GIL while it does, so
+concurrent callbacks in a gthread worker overlap. Both backends return the same frames;
+benchmarks/bench_query.py checks that and times them.
+Needs duckdb: pip install duckdb. Unset, or without duckdb, pandas answers everything.
+"""
+import importlib.util
+import os
+import threading
+import time
+import weakref
+
+from pages.periods import compare_periods
+from pages.views import is_all
+
+# duckdb itself is imported only when the backend is used
+HAS_DUCKDB = importlib.util.find_spec('duckdb') is not None
+
+QUERY_BACKEND = os.environ.get('QUERY_BACKEND', 'pandas')
+
+# Threads per DuckDB query (default: every core) and the memory it may use before spilling
+# intermediate results to DUCKDB_TEMP_DIRECTORY
+DUCKDB_THREADS = int(os.environ.get('DUCKDB_THREADS', os.cpu_count() or 1))
+DUCKDB_MEMORY_LIMIT = os.environ.get('DUCKDB_MEMORY_LIMIT', '1GB')
+DUCKDB_TEMP_DIRECTORY = os.environ.get('DUCKDB_TEMP_DIRECTORY', '')
+
+_backend = None
+_backend_pid = None
+_lock = threading.Lock()
+
+
+class PandasBackend:
+    """The aggregations as pandas group-bys over cube.filter() selections"""
+
+    name = 'pandas'
+
+    def totals(self, cube, trade_type, by, value='CValue', **filters):
+        """Sum of `value` per `by` key over the cube cells matching the filters (as for
+        TradeCube.filter), one row per key in key order; keys with a missing value are left out
+        """
+        rows = cube.filter(trade_type, **filters)
+        return rows.groupby(by, observed=True)[value].sum().reset_index()
+
+    def compare_periods(self, cube, trade_type, by, periods, period_cols=('Year', 'Period'),
+                        value='CValue', **filters):
+        """periods.compare_periods() over the cube cells matching the filters"""
+        return compare_periods(cube.filter(trade_type, **filters), by, periods, period_cols, value=value)
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _plain(value):
+    """Python scalars for query parameters (numpy integers are not bound as numbers)"""
+    return value.item() if hasattr(value, 'item') else value
+
+
+def _where(trade_type, filters):
+    """WHERE conditions and their parameters for TradeCube.filter()-style filters"""
+    conditions, params = ['TradeType = ?'], [trade_type]
+    for col, value in filters.items():
+        if is_all(value):
+            continue
+        if isinstance(value, (list, tuple, set)):
+            values = [_plain(v) for v in value]
+            if not values:
+                conditions.append('FALSE')
+                continue
+            conditions.append(f"{_quote(col)} IN ({', '.join('?' * len(values))})")
+            params += values
+        else:
+            conditions.append(f"{_quote(col)} = ?")
+            params.append(_plain(value))
+    return conditions, params
+
+
+class DuckDBBackend(PandasBackend):
+    """The same aggregations as SQL in an in-process DuckDB database.
+
+    Each published cube is copied once into a DuckDB table (in the cube's (TradeType, Year,
+    Flow) order, so DuckDB skips the row groups a filter rules out); the previous cube's table
+    is kept for callbacks still running on it. The table is a second copy of the cube per
+    process, which DuckDB may page out to DUCKDB_TEMP_DIRECTORY beyond DUCKDB_MEMORY_LIMIT.
+    Each thread queries through its own cursor.
+    """
+
+    name = 'duckdb'
+
+    def __init__(self):
+        import duckdb
+
+        config = {'threads': DUCKDB_THREADS, 'memory_limit': DUCKDB_MEMORY_LIMIT}
+        if DUCKDB_TEMP_DIRECTORY:
+            config['temp_directory'] = DUCKDB_TEMP_DIRECTORY
+        self.connection = duckdb.connect(config=config)
+        self._tables = {}
+        self._loaded = 0
+        self._loading = threading.Lock()
+        self._local = threading.local()
+        print(f"🦆 DuckDB query backend ({DUCKDB_THREADS} threads, memory limit {DUCKDB_MEMORY_LIMIT})")
+
+    def _table(self, cube):
+        """Name of the table holding `cube`'s cells (copied in on first use)"""
+        name, ref = self._tables.get(id(cube), (None, None))
+        if ref is not None and ref() is cube:
+            return name
+        with self._loading:
+            name, ref = self._tables.get(id(cube), (None, None))
+            if ref is not None and ref() is cube:
+                return name
+
+            start = time.perf_counter()
+            self._loaded += 1
+            name = f'cube_{self._loaded}'
+            cursor = self.connection.cursor()
+            try:
+                cursor.register('cells', cube.data)
+                cursor.execute(f"CREATE TABLE {name} AS SELECT * FROM cells")
+                while len(self._tables) > 1:
+                    cursor.execute(f"DROP TABLE {self._tables.pop(next(iter(self._tables)))[0]}")
+            finally:
+                cursor.close()
+            self._tables[id(cube)] = (name, weakref.ref(cube))
+            print(f"🦆 Cube copied into DuckDB table {name}: {len(cube.data):,} cells "
+                  f"in {time.perf_counter() - start:.1f}s")
+            return name
+
+    def _query(self, sql, params):
+        if getattr(self._local, 'cursor', None) is None:
+            self._local.cursor = self.connection.cursor()
+        return self._local.cursor.execute(sql, params).df()
+
+    def totals(self, cube, trade_type, by, value='CValue', **filters):
+        table = self._table(cube)
+        by = [by] if isinstance(by, str) else list(by)
+        keys = ', '.join(_quote(col) for col in by)
+        conditions, params = _where(trade_type, filters)
+        conditions += [f"{_quote(col)} IS NOT NULL" for col in by]
+        sql = (f"SELECT {keys}, SUM({_quote(value)}) AS {_quote(value)} FROM {table} "
+               f"WHERE {' AND '.join(conditions)} GROUP BY {keys} ORDER BY {keys}")
+        return self._query(sql, params)
+
+    def compare_periods(self, cube, trade_type, by, periods, period_cols=('Year', 'Period'),
+                        value='CValue', **filters):
+        table = self._table(cube)
+        by = [by] if isinstance(by, str) else list(by)
+        keys = ', '.join(_quote(col) for col in by)
+        conditions, params = _where(trade_type, filters)
+        conditions += [f"{_quote(col)} IS NOT NULL" for col in by]
+
+        # One conditional sum per period; rows in none of the periods are filtered out first
+        in_period = ' AND '.join(f"{_quote(col)} = ?" for col in period_cols)
+        columns, column_params, any_period = [], [], []
+        for label, key in periods.items():
+            columns.append(f"SUM(CASE WHEN {in_period} THEN {_quote(value)} ELSE 0 END) AS {_quote(label)}")
+            column_params += [_plain(v) for v in key]
+            any_period.append(f"({in_period})")
+        conditions.append(f"({' OR '.join(any_period)})")
+        params += [_plain(v) for key in periods.values() for v in key]
+
+        sql = (f"SELECT {keys}, {', '.join(columns)} FROM {table} "
+               f"WHERE {' AND '.join(conditions)} GROUP BY {keys} ORDER BY {keys}")
+        return self._query(sql, column_params + params)
+
+
+def backend():
+    """The query backend chosen by QUERY_BACKEND (created on first use in each process, so a
+    forked gunicorn worker opens its own DuckDB database)
+    """
+    global _backend, _backend_pid
+    with _lock:
+        if _backend is None or _backend_pid != os.getpid():
+            if QUERY_BACKEND == 'duckdb' and not HAS_DUCKDB:
+                print("⚠️ QUERY_BACKEND=duckdb but duckdb is not installed (pip install duckdb); using pandas")
+            _backend = DuckDBBackend() if QUERY_BACKEND == 'duckdb' and HAS_DUCKDB else PandasBackend()
+            _backend_pid = os.getpid()
+        return _backend
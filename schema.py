@@ -0,0 +1,74 @@
+"""Compact in-memory dtypes for the trade DataFrame"""
+import pandas as pd
+
+# Column -> dtype applied once at load time.
+# Text columns with few distinct values become categoricals (int8/int16 codes plus one
+# copy of each string); product codes are fixed-width text, so they are categoricals too.
+# CValue stays float64: headline totals are summed over millions of rows.
+TRADE_SCHEMA = {
+    'TradeType': 'category',
+    'Year': 'int16',
+    'Quarter': 'category',
+    'Period': 'category',
+    'Flow': 'category',
+    'Flow_Name': 'category',
+    'Via': 'category',
+    'Transport_Mode': 'category',
+    'Borders': 'category',
+    'Partner_Country': 'category',
+    'Region': 'category',
+    'Continent': 'category',
+    'HS2': 'category',
+    'HS4': 'category',
+    'HS6': 'category',
+    'HS8': 'category',
+    'SITC': 'category',
+    'HS2_Description': 'category',
+    'HS4_Description': 'category',
+    'HS6_Description': 'category',
+    'HS8_Description': 'category',
+    'SITC_Description': 'category',
+    'CValue': 'float64',
+    'CDuty': 'float32',
+    'NetWeight': 'float32',
+}
+
+
+def memory_mb(df):
+    """Deep memory usage of a DataFrame in megabytes"""
+    return df.memory_usage(deep=True).sum() / 1_000_000
+
+
+def apply_schema(df, schema=TRADE_SCHEMA, report=True):
+    """Cast the columns present in `df` to the compact schema and report the memory saved"""
+    if df.empty:
+        return df
+    if not report:
+        return df.astype({col: dtype for col, dtype in schema.items() if col in df.columns})
+
+    before = memory_mb(df)
+    df = df.astype({col: dtype for col, dtype in schema.items() if col in df.columns})
+    after = memory_mb(df)
+
+    ratio = before / after if after else 0
+    print(f"💾 Memory: {before:,.1f} MB -> {after:,.1f} MB ({ratio:.1f}x smaller)")
+    return df
+
+
+def concat_frames(frames):
+    """Stack frames with the compact schema; categorical columns stay categorical (categories merged)"""
+    frames = [f for f in frames if len(f)] or frames[:1]
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+
+    categories = {}
+    for col in frames[0].columns:
+        if all(isinstance(f[col].dtype, pd.CategoricalDtype) for f in frames):
+            merged = frames[0][col].cat.categories
+            for f in frames[1:]:
+                merged = merged.union(f[col].cat.categories)
+            categories[col] = merged
+
+    aligned = [pd.DataFrame({col: f[col].cat.set_categories(categories[col]) if col in categories else f[col]
+                             for col in f.columns}) for f in frames]
+    return pd.concat(aligned, ignore_index=True)
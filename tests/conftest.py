@@ -0,0 +1,9 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from synthetic import use_repo_as_pages  # noqa: E402
+
+# The modules import each other as `pages.<module>`
+use_repo_as_pages()
@@ -0,0 +1,111 @@
+import json
+
+import numpy as np
+import pytest
+
+from pages.alerts import (ALERT_DECREASE, ALERT_INCREASE, ALERT_MIXED, ALERT_NORMAL, DEFAULT_THRESHOLDS,
+                          classify_alerts, load_thresholds, pct_change, thresholds_for)
+
+
+def baseline_alert(qoq, yoy):
+    """The rule page 6 applied row by row before the alert engine, with its hard-coded ±40%"""
+    qoq_extreme = (qoq > 40) or (qoq < -40)
+    yoy_extreme = (yoy > 40) or (yoy < -40)
+    if qoq_extreme and yoy_extreme:
+        if qoq > 40 and yoy > 40:
+            return ALERT_INCREASE
+        elif qoq < -40 and yoy < -40:
+            return ALERT_DECREASE
+        return ALERT_MIXED
+    return ALERT_NORMAL
+
+
+CHANGES = [-100.0, -60.0, -40.0001, -40.0, -39.9, 0.0, 39.9, 40.0, 40.0001, 60.0, 500.0]
+
+
+@pytest.mark.parametrize('qoq', CHANGES)
+def test_classify_alerts_matches_baseline(qoq):
+    yoy = np.array(CHANGES)
+    expected = [baseline_alert(qoq, y) for y in yoy]
+    assert classify_alerts(np.full(len(yoy), qoq), yoy).tolist() == expected
+
+
+@pytest.mark.parametrize('qoq, yoy, expected', [
+    (50, 45, ALERT_INCREASE),
+    (-50, -45, ALERT_DECREASE),
+    (50, -45, ALERT_MIXED),
+    (-50, 45, ALERT_MIXED),
+    (50, 10, ALERT_NORMAL),
+    (10, -45, ALERT_NORMAL),
+    (40, 40, ALERT_NORMAL),
+    (-40, -40, ALERT_NORMAL),
+    (np.nan, 50, ALERT_NORMAL),
+])
+def test_classify_alerts_tiers(qoq, yoy, expected):
+    assert classify_alerts([qoq], [yoy]).tolist() == [expected]
+
+
+def test_classify_alerts_custom_thresholds():
+    alerts = classify_alerts([50, 50, -30], [70, 50, -30], increase=60, decrease=-25)
+    assert alerts.tolist() == [ALERT_NORMAL, ALERT_NORMAL, ALERT_DECREASE]
+
+
+@pytest.mark.parametrize('current, previous, expected', [
+    (150, 100, 50.0),
+    (50, 100, -50.0),
+    (100, 100, 0.0),
+    (0, 100, -100.0),
+    (100, 0, 0.0),
+    (0, 0, 0.0),
+    (100, np.nan, 0.0),
+    (-50, -100, -50.0),
+])
+def test_pct_change(current, previous, expected):
+    assert pct_change([current], [previous]).tolist() == [pytest.approx(expected)]
+
+
+def test_pct_change_zero_baseline_is_normal_movement():
+    change = pct_change([1e9, 0], [0, 0])
+    assert classify_alerts(change, change).tolist() == [ALERT_NORMAL, ALERT_NORMAL]
+
+
+@pytest.fixture
+def config(tmp_path):
+    path = tmp_path / 'thresholds.json'
+    path.write_text(json.dumps({
+        'default': {'increase': 30},
+        'flows': {'R': {'increase': 60, 'decrease': -60}},
+        'levels': {'country': {'decrease': -50}},
+    }))
+    return load_thresholds(str(path))
+
+
+def test_load_thresholds_defaults(monkeypatch):
+    monkeypatch.delenv('ALERT_THRESHOLDS_FILE', raising=False)
+    config = load_thresholds()
+    assert thresholds_for('E', 'sitc', config) == DEFAULT_THRESHOLDS
+    assert DEFAULT_THRESHOLDS == {'increase': 40.0, 'decrease': -40.0}
+
+
+def test_load_thresholds_from_environment(monkeypatch, tmp_path):
+    path = tmp_path / 'thresholds.json'
+    path.write_text(json.dumps({'flows': {'I': {'decrease': -20}}}))
+    monkeypatch.setenv('ALERT_THRESHOLDS_FILE', str(path))
+    assert thresholds_for('I', 'sitc', load_thresholds()) == {'increase': 40.0, 'decrease': -20}
+
+
+@pytest.mark.parametrize('flow, level, expected', [
+    ('E', 'sitc', {'increase': 30, 'decrease': -40.0}),
+    ('R', 'sitc', {'increase': 60, 'decrease': -60}),
+    ('E', 'country', {'increase': 30, 'decrease': -50}),
+    ('R', 'country', {'increase': 60, 'decrease': -50}),
+])
+def test_thresholds_for_overrides(config, flow, level, expected):
+    assert thresholds_for(flow, level, config) == expected
+
+
+def test_overridden_thresholds_change_the_tier(config):
+    qoq, yoy = [45, -55], [45, -55]
+    assert classify_alerts(qoq, yoy, **thresholds_for('E', 'sitc', config)).tolist() == [ALERT_INCREASE, ALERT_DECREASE]
+    assert classify_alerts(qoq, yoy, **thresholds_for('R', 'sitc', config)).tolist() == [ALERT_NORMAL, ALERT_NORMAL]
+    assert classify_alerts(qoq, yoy, **thresholds_for('R', 'country', config)).tolist() == [ALERT_NORMAL, ALERT_DECREASE]
@@ -0,0 +1,98 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pages.country_mapping import (COUNTRIES, COUNTRY_PATTERNS, MAP_LOCATIONS, REGIONAL_BLOCKS, block_totals,
+                                   iso3_of, resolve_iso3, unmapped_partners)
+
+TRADE_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'trade_data.csv')
+
+
+@pytest.fixture
+def trade():
+    # Kenya is in EAC, COMESA and COMMONWEALTH; Rwanda in COMESA, CEPGL and COMMONWEALTH;
+    # Chile in no block. Several rows per partner, as per-month declarations are.
+    return pd.DataFrame({
+        'Flow': ['E', 'E', 'E', 'E', 'I', 'E'],
+        'Partner_Country': pd.Categorical(['Kenya', 'Kenya', 'Rwanda', 'Chile', 'Kenya', 'Tanzania']),
+        'CValue': [10.0, 5.0, 7.0, 100.0, 3.0, 20.0],
+    })
+
+
+def totals(frame, **kwargs):
+    result = block_totals(frame, ['Flow'], **kwargs)
+    return {(row.Flow, row.Block): row.CValue for row in result.itertuples()}
+
+
+def test_partner_in_two_blocks_counts_once_toward_each(trade):
+    result = totals(trade, blocks=['EAC', 'COMESA'])
+    assert result == {('E', 'EAC'): 15.0 + 20.0, ('E', 'COMESA'): 15.0 + 7.0,
+                      ('I', 'EAC'): 3.0, ('I', 'COMESA'): 3.0}
+
+
+def test_all_blocks(trade):
+    result = totals(trade)
+    assert result[('E', 'COMMONWEALTH')] == 15.0 + 7.0 + 20.0
+    assert result[('E', 'CEPGL')] == 7.0
+    assert result[('E', 'SADC')] == 20.0
+    assert result[('E', 'EAC_PARTNERS')] == 35.0
+    assert ('E', 'EU') not in result
+    # A partner in no block adds to none of them
+    assert sum(result.values()) == 15 * 4 + 7 * 3 + 20 * 4 + 3 * 4
+
+
+def test_block_totals_match_summing_each_block_separately(trade):
+    result = totals(trade)
+    for block, members in REGIONAL_BLOCKS.items():
+        expected = trade[trade['Partner_Country'].isin(members)].groupby('Flow')['CValue'].sum()
+        assert {flow: result[(flow, block)] for flow in expected.index} == expected.to_dict()
+
+
+def test_plotly_country_patterns_are_read():
+    assert len(COUNTRY_PATTERNS) > 200
+    assert set(COUNTRY_PATTERNS) <= set(MAP_LOCATIONS)
+
+
+def test_every_listed_country_is_on_the_map():
+    assert [country for country in COUNTRIES if resolve_iso3(country) is None] == []
+
+
+@pytest.mark.parametrize('country, iso3', [
+    ('Kenya', 'KEN'),
+    ('Congo', 'COG'),
+    ('Congo, The Democratic Republic Of', 'COD'),
+    ('Niger', 'NER'),
+    ('Sudan', 'SDN'),
+    ('Eswatini', 'SWZ'),
+    # Not in ISO3_MAP: matched as locationmode='country names' matched them in the browser
+    ('Viet Nam', 'VNM'),
+    ('Hong Kong', 'HKG'),
+    ('Korea, Republic Of', 'KOR'),
+    ("Korea, Democratic People's Republic Of", 'PRK'),
+    ('Tanzania, United Republic Of', 'TZA'),
+    ('  Taiwan ', 'TWN'),
+    ('Nowhere', None),
+])
+def test_resolve_iso3(country, iso3):
+    assert resolve_iso3(country) == iso3
+
+
+def test_iso3_of():
+    iso3 = iso3_of(['Kenya', 'Viet Nam', None, 'Nowhere', 'Kenya'])
+    assert list(iso3.categories) == list(MAP_LOCATIONS)
+    assert list(iso3.astype(object)) == ['KEN', 'VNM', np.nan, np.nan, 'KEN']
+
+
+def test_unmapped_partners():
+    countries = pd.Categorical(['Kenya', 'Nowhere', 'Atlantis', 'Nowhere', None])
+    unmapped = unmapped_partners(countries, iso3_of(countries), [1.0, 2.0, 10.0, 3.0, 4.0])
+    assert unmapped.to_dict() == {'Atlantis': 10.0, 'Nowhere': 5.0}
+    assert list(unmapped.index) == ['Atlantis', 'Nowhere']
+
+
+@pytest.mark.skipif(not os.path.exists(TRADE_CSV), reason="data/trade_data.csv is not in this checkout")
+def test_every_partner_in_the_trade_data_is_on_the_map():
+    partners = pd.read_csv(TRADE_CSV, usecols=['Partner_Country'], dtype=str)['Partner_Country'].dropna().unique()
+    assert sorted(partner for partner in partners if resolve_iso3(partner) is None) == []
@@ -0,0 +1,261 @@
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pages.data_store import normalize_code, normalize_codes
+
+
+@pytest.mark.parametrize('value, width, expected', [
+    ('01', 2, '01'),
+    ('1', 2, '01'),
+    ('1.0', 2, '01'),
+    (' 01 ', 2, '01'),
+    ('0101', 4, '0101'),
+    ('101', 4, '0101'),
+    ('101.0', 4, '0101'),
+    ('10121', 6, '010121'),
+    ('1012100', 8, '01012100'),
+    ('1012100.00', 8, '01012100'),
+    ('01012100', 8, '01012100'),
+    ('123456789', 8, '123456789'),
+    ('0', 2, '00'),
+    ('', 2, ''),
+    ('UNKNOWN', 4, 'UNKNOWN'),
+    ('0101', None, '0101'),
+    ('001.1', None, '001.1'),
+    ('1.0', None, '1'),
+    (None, 2, ''),
+    (np.nan, 8, ''),
+])
+def test_normalize_code(value, width, expected):
+    assert normalize_code(pd.Series([value], dtype=object), width).tolist() == [expected]
+
+
+def test_normalize_code_keeps_index_and_name():
+    values = pd.Series(['1', None, '1.0', '02'], index=[10, 11, 12, 13], name='HS2', dtype=object)
+    normalized = normalize_code(values, 2)
+    assert normalized.tolist() == ['01', '', '01', '02']
+    assert normalized.index.tolist() == [10, 11, 12, 13]
+    assert normalized.name == 'HS2'
+
+
+def test_normalize_codes_pads_each_hs_level_and_keeps_sitc_width():
+    df = pd.DataFrame({
+        'HS2': ['1', '84'], 'HS4': ['101.0', '8471'], 'HS6': ['10121', '847130'],
+        'HS8': ['1012100', '84713000'], 'SITC': ['001.1', '752.0'],
+        'HS2_Description': ['  Live animals ', None],
+    }, dtype=object)
+    normalize_codes(df)
+    assert df['HS2'].tolist() == ['01', '84']
+    assert df['HS4'].tolist() == ['0101', '8471']
+    assert df['HS6'].tolist() == ['010121', '847130']
+    assert df['HS8'].tolist() == ['01012100', '84713000']
+    assert df['SITC'].tolist() == ['001.1', '752']
+    assert df['HS2_Description'].tolist() == ['Live animals', 'Unknown']
+
+
+# The store: conversion, ingestion, replay and what running workers are told changed
+
+from pages.data_store import (HAS_PYARROW, changes_since, dataset_version, ensure_store, file_hash,  # noqa: E402
+                              ingest_extract, live_store, load_partitions, read_manifest)
+
+needs_pyarrow = pytest.mark.skipif(not HAS_PYARROW, reason="the Parquet store needs pyarrow")
+
+GT, ST = 'GeneralTrade', 'SpecialTrade'
+
+
+@pytest.fixture
+def trade(tmp_path):
+    """Synthetic rows, the CSV of those before 2024 and a store path"""
+    from synthetic import generate
+
+    rows = generate(3000, seed=1)
+    csv_path = str(tmp_path / 'trade_data.csv')
+    rows[rows['Year'] < 2024].to_csv(csv_path, index=False)
+    return rows, csv_path, str(tmp_path / 'trade_data.parquet')
+
+
+def month(rows, trade_type, year, period):
+    return rows[(rows['TradeType'] == trade_type) & (rows['Year'] == year) & (rows['Period'] == period)]
+
+
+def write_extract(tmp_path, name, rows):
+    path = str(tmp_path / name)
+    rows.to_csv(path, index=False)
+    return path
+
+
+def stored(store_path, *months):
+    return load_partitions(list(months), store_path=store_path)
+
+
+@needs_pyarrow
+def test_ingest_adds_months_and_reports_exactly_them(tmp_path, trade):
+    rows, csv_path, store_path = trade
+    converted = ensure_store(csv_path, store_path)
+    before = dataset_version(csv_path, store_path)
+
+    january = month(rows, GT, 2024, 1)._append(month(rows, ST, 2024, 1))
+    entry = ingest_extract(write_extract(tmp_path, 'jan.csv', january), csv_path, store_path)
+
+    months = [(GT, 2024, '01'), (ST, 2024, '01')]
+    assert entry['partitions'] == [list(key) for key in months]
+    assert entry['replaced_rows'] == 0
+    assert len(stored(store_path, *months)) == len(january)
+    assert stored(store_path, *months)['CValue'].sum() == pytest.approx(january['CValue'].sum())
+
+    after = dataset_version(csv_path, store_path)
+    assert after != before
+    assert changes_since(before, csv_path, store_path) == (after, months)
+    assert changes_since(after, csv_path, store_path) == (after, [])
+    assert read_manifest(store_path)['rows'] == converted['rows'] + len(january)
+
+
+@needs_pyarrow
+def test_reingesting_a_revised_month_replaces_it(tmp_path, trade):
+    rows, csv_path, store_path = trade
+    ensure_store(csv_path, store_path)
+    january = month(rows, GT, 2024, 1)._append(month(rows, ST, 2024, 1))
+    ingest_extract(write_extract(tmp_path, 'jan.csv', january), csv_path, store_path)
+    before = dataset_version(csv_path, store_path)
+
+    revised = month(rows, GT, 2024, 1).head(5).assign(CValue=1.0)
+    entry = ingest_extract(write_extract(tmp_path, 'jan-revised.csv', revised), csv_path, store_path)
+
+    assert entry['replaced_rows'] == len(month(rows, GT, 2024, 1))
+    assert stored(store_path, (GT, 2024, '01'))['CValue'].tolist() == [1.0] * 5
+    # The month the revision does not hold is left as it was
+    assert len(stored(store_path, (ST, 2024, '01'))) == len(month(rows, ST, 2024, 1))
+    assert changes_since(before, csv_path, store_path) == (dataset_version(csv_path, store_path),
+                                                           [(GT, 2024, '01')])
+    assert len(read_manifest(store_path)['extracts']) == 2
+
+
+@needs_pyarrow
+def test_a_replaced_csv_keeps_the_ingested_months_it_lacks(tmp_path, trade):
+    rows, csv_path, store_path = trade
+    ensure_store(csv_path, store_path)
+    ingest_extract(write_extract(tmp_path, 'jan.csv', month(rows, GT, 2024, 1)), csv_path, store_path)
+    before = dataset_version(csv_path, store_path)
+
+    # The new CSV has other 2024 months, but not the ingested one
+    replacement = rows[(rows['Year'] < 2024) | (rows['Period'] == 2)]
+    replacement.to_csv(csv_path, index=False)
+    assert changes_since(before, csv_path, store_path) == (None, None)
+
+    manifest = ensure_store(csv_path, store_path)
+    assert manifest['sha256'] == file_hash(csv_path)
+    assert [entry['partitions'] for entry in manifest['extracts']] == [[[GT, 2024, '01']]]
+    assert manifest['rows'] == len(replacement) + len(month(rows, GT, 2024, 1))
+    assert len(stored(store_path, (GT, 2024, '01'))) == len(month(rows, GT, 2024, 1))
+    assert len(stored(store_path, (GT, 2024, '02'))) == len(month(rows, GT, 2024, 2))
+
+
+@needs_pyarrow
+def test_a_replaced_csv_holding_an_ingested_month_takes_it_from_the_csv(tmp_path, trade):
+    rows, csv_path, store_path = trade
+    ensure_store(csv_path, store_path)
+    january = month(rows, GT, 2024, 1)._append(month(rows, ST, 2024, 1))
+    ingest_extract(write_extract(tmp_path, 'jan.csv', january), csv_path, store_path)
+
+    # The published CSV now holds the special trade January, revised; general trade is not in it yet
+    revised = month(rows, ST, 2024, 1).head(3)
+    rows[rows['Year'] < 2024]._append(revised).to_csv(csv_path, index=False)
+    manifest = ensure_store(csv_path, store_path)
+
+    assert [entry['partitions'] for entry in manifest['extracts']] == [[[GT, 2024, '01']]]
+    assert len(stored(store_path, (ST, 2024, '01'))) == 3
+    assert len(stored(store_path, (GT, 2024, '01'))) == len(month(rows, GT, 2024, 1))
+
+
+@needs_pyarrow
+def test_a_replaced_csv_is_refused_when_an_extract_is_gone(tmp_path, trade, capsys):
+    rows, csv_path, store_path = trade
+    ensure_store(csv_path, store_path)
+    extract_path = write_extract(tmp_path, 'jan.csv', month(rows, GT, 2024, 1))
+    ingest_extract(extract_path, csv_path, store_path)
+    version, live = dataset_version(csv_path, store_path), live_store(store_path)
+
+    os.remove(extract_path)
+    rows[rows['Year'] < 2023].to_csv(csv_path, index=False)
+    manifest = ensure_store(csv_path, store_path)
+
+    assert "NOT converted" in capsys.readouterr().out
+    assert live_store(store_path) == live
+    assert manifest['refused']['sha256'] == file_hash(csv_path)
+    assert len(stored(store_path, (GT, 2024, '01'))) == len(month(rows, GT, 2024, 1))
+    # Running workers keep the data they have; nothing to re-read
+    assert changes_since(version, csv_path, store_path) == (version, [])
+    assert ensure_store(csv_path, store_path)['refused'] == manifest['refused']
+
+    # --rebuild converts it anyway, without the month it can no longer replay
+    rebuilt = ensure_store(csv_path, store_path, force=True)
+    assert live_store(store_path) != live
+    assert rebuilt['sha256'] == file_hash(csv_path) and 'extracts' not in rebuilt
+    assert stored(store_path, (GT, 2024, '01')).empty
+    assert changes_since(version, csv_path, store_path) == (dataset_version(csv_path, store_path), None)
+
+
+# Each call runs in its own interpreter, all released at once, as gunicorn workers and the
+# ingest CLI would hit the store
+WRITER = """
+import os, sys, time
+sys.path.insert(0, {benchmarks!r})
+from synthetic import use_repo_as_pages
+use_repo_as_pages()
+from pages.data_store import ensure_store, ingest_extract
+while not os.path.exists({go!r}):
+    time.sleep(0.01)
+{call}
+"""
+
+
+def run_together(tmp_path, calls):
+    go = str(tmp_path / 'go')
+    benchmarks = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks')
+    writers = [subprocess.Popen([sys.executable, '-c', WRITER.format(benchmarks=benchmarks, go=go, call=call)],
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+               for call in calls]
+    time.sleep(3)
+    open(go, 'w').close()
+    outputs = [writer.communicate(timeout=120)[0] for writer in writers]
+    assert [writer.returncode for writer in writers] == [0] * len(writers), outputs
+    return outputs
+
+
+def versions(store_path):
+    return [entry for entry in os.listdir(store_path) if entry.startswith('v-')]
+
+
+@needs_pyarrow
+def test_processes_noticing_a_new_csv_convert_it_once(tmp_path, trade):
+    _, csv_path, store_path = trade
+    outputs = run_together(tmp_path, [f"ensure_store({csv_path!r}, {store_path!r})"] * 4)
+
+    assert sum('Converted' in output for output in outputs) == 1
+    assert len(versions(store_path)) == 1
+    assert read_manifest(store_path)['sha256'] == file_hash(csv_path)
+
+
+@needs_pyarrow
+def test_ingests_overlapping_a_conversion_and_each_other_are_all_kept(tmp_path, trade):
+    rows, csv_path, store_path = trade
+    ensure_store(csv_path, store_path)
+    january = write_extract(tmp_path, 'jan.csv', month(rows, GT, 2024, 1))
+    february = write_extract(tmp_path, 'feb.csv', month(rows, ST, 2024, 2))
+    rows[rows['Year'] < 2023].to_csv(csv_path, index=False)
+
+    run_together(tmp_path, [f"ensure_store({csv_path!r}, {store_path!r})",
+                            f"ingest_extract({january!r}, {csv_path!r}, {store_path!r})",
+                            f"ingest_extract({february!r}, {csv_path!r}, {store_path!r})"])
+
+    manifest = read_manifest(store_path)
+    assert manifest['sha256'] == file_hash(csv_path)
+    assert sorted(entry['source'] for entry in manifest['extracts']) == sorted([february, january])
+    assert len(stored(store_path, (GT, 2024, '01'))) == len(month(rows, GT, 2024, 1))
+    assert len(stored(store_path, (ST, 2024, '02'))) == len(month(rows, ST, 2024, 2))
@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from pages.callback_cache import cache
+from pages.dataset import TradeData
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="needs os.fork")
+def test_locks_held_at_fork_are_free_in_the_child(tmp_path):
+    data = TradeData(str(tmp_path / 'trade_data.csv'))
+    # As if the master's watcher were mid-refresh when a worker is forked
+    held = [data._refreshing, data._lock, cache._lock]
+    for lock in held:
+        lock.acquire()
+    try:
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if data._refreshing.acquire(blocking=False) and data._lock.acquire(blocking=False)
+                     and cache._lock.acquire(blocking=False) else 1)
+        _, status = os.waitpid(pid, 0)
+    finally:
+        for lock in held:
+            lock.release()
+    assert os.waitstatus_to_exitcode(status) == 0
+
+
+def test_failed_read_publishes_an_empty_dataset(tmp_path):
+    data = TradeData(str(tmp_path / 'missing.csv'))
+    data.start()
+    assert data.wait(30)
+    assert data.ready
+    assert data.load_error.startswith("Error loading data")
+    assert data.cube.data.empty
+
+
+def test_failed_preparation_publishes_an_empty_dataset(tmp_path):
+    data = TradeData(str(tmp_path / 'missing.csv'))
+    calls = []
+
+    def prepare(data):
+        calls.append(data.cube)
+        if len(calls) == 1:
+            raise KeyError('Partner_Country')
+
+    data.on_load(prepare)
+    data.start()
+    assert data.wait(30)
+    assert data.ready
+    assert data.load_error == "Error preparing data: 'Partner_Country'"
+    assert len(calls) == 2
+    assert data.cube is calls[1]
+
+
+def test_standing_by_never_loads_or_blocks(tmp_path):
+    data = TradeData(str(tmp_path / 'missing.csv'))
+    data.stand_by()
+    data.start()
+    assert not data.wait()
+    assert not data.ready and data._loader is None
+    with pytest.raises(RuntimeError, match="still loading"):
+        data.cube
@@ -0,0 +1,43 @@
+import dash
+from dash import Input, Output, html
+
+from pages import instrumentation
+
+
+def register_level(app, level):
+    # One function name for several callbacks, as page 3 registers its drill-down levels
+    @app.callback(Output(f'{level}-out', 'children'), Input(f'{level}-in', 'value'))
+    def update_level(value):
+        instrumentation.lap('options')
+        return f'{level}: {value}' * (10 if level == 'HS6' else 1)
+
+
+def update(client, level, value):
+    response = client.post('/_dash-update-component', json={
+        'output': f'{level}-out.children',
+        'outputs': {'id': f'{level}-out', 'property': 'children'},
+        'inputs': [{'id': f'{level}-in', 'property': 'value', 'value': value}],
+        'changedPropIds': [f'{level}-in.value'],
+    })
+    assert response.status_code == 200
+
+
+def test_callbacks_sharing_a_function_name_are_reported_apart():
+    app = dash.Dash(__name__)
+    app.layout = html.Div([html.Div(id=f'{level}-{part}') for level in ('HS4', 'HS6') for part in ('in', 'out')])
+    register_level(app, 'HS4')
+    register_level(app, 'HS6')
+    instrumentation.instrument(app)
+
+    client = app.server.test_client()
+    update(client, 'HS4', '0101')
+    update(client, 'HS4', '0102')
+    update(client, 'HS6', '010121')
+
+    report = client.get('/metrics').get_json()['callbacks']
+    hs4, hs6 = report['HS4-out.children'], report['HS6-out.children']
+    assert hs4['function'] == hs6['function'] == 'update_level'
+    assert (hs4['calls'], hs6['calls']) == (2, 1)
+    assert set(hs4['stages_ms']) == {'options', 'serialize'}
+    assert list(hs4['payload_bytes']) == ['HS4-out.children']
+    assert list(hs6['payload_bytes']) == ['HS6-out.children']
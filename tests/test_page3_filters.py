@@ -0,0 +1,52 @@
+import pandas as pd
+import pytest
+
+from pages.page3_products import filter_rows, split_filter_part
+
+
+@pytest.mark.parametrize('clause, expected', [
+    ('{HS2_Description} contains Edible fruit', ('HS2_Description', 'contains', 'Edible fruit')),
+    ('{HS2_Description} contains "Vegetable products"', ('HS2_Description', 'contains', 'Vegetable products')),
+    ('{HS2_Description} contains "Cable ne wire"', ('HS2_Description', 'contains', 'Cable ne wire')),
+    ('{HS2_Description} contains Large goods', ('HS2_Description', 'contains', 'Large goods')),
+    ('{HS4} = 0101', ('HS4', 'eq', '0101')),
+    ('{HS4} eq "0101"', ('HS4', 'eq', '0101')),
+    ('{HS4} >= 0500', ('HS4', 'ge', '0500')),
+    ('{HS4} ge 0500', ('HS4', 'ge', '0500')),
+    ('{HS4} <= 0500', ('HS4', 'le', '0500')),
+    ('{HS4} != 0101', ('HS4', 'ne', '0101')),
+    ('{HS4} < 0200', ('HS4', 'lt', '0200')),
+    ('{HS4} > 0200', ('HS4', 'gt', '0200')),
+    ('{SITC_Description} datestartswith Live', ('SITC_Description', 'datestartswith', 'Live')),
+    ("{HS2_Description} contains 'Men\\'s wear'", ('HS2_Description', 'contains', "Men's wear")),
+])
+def test_split_filter_part(clause, expected):
+    assert split_filter_part(clause) == expected
+
+
+@pytest.mark.parametrize('clause', ['', 'Edible fruit', '{HS4}', '{HS4} between 1 and 2'])
+def test_split_filter_part_without_operator(clause):
+    assert split_filter_part(clause) == (None, None, None)
+
+
+@pytest.fixture
+def rows():
+    return pd.DataFrame({
+        'HS2': ['08', '07', '85', '61'],
+        'HS2_Description': ['Edible fruit and nuts', 'Vegetable products', 'Cable ne wire', 'Large goods'],
+    })
+
+
+@pytest.mark.parametrize('query, codes', [
+    ('{HS2_Description} contains Edible fruit', ['08']),
+    ('{HS2_Description} contains "table pro"', ['07']),
+    ('{HS2_Description} contains ne wire', ['85']),
+    ('{HS2_Description} contains ge goods', ['61']),
+    ('{HS2} ge 61 && {HS2_Description} contains le', ['85']),
+    ('{HS2} != 08', ['07', '85', '61']),
+    ('{HS2} < 61', ['08', '07']),
+    ('', ['08', '07', '85', '61']),
+    ('{Missing} contains x', ['08', '07', '85', '61']),
+])
+def test_filter_rows(rows, query, codes):
+    assert filter_rows(rows, query)['HS2'].tolist() == codes
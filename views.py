@@ -0,0 +1,112 @@
+"""Row selection over trade frames without copying the whole dataset"""
+import numpy as np
+import pandas as pd
+
+# Sort order of indexed frames; selections on a prefix of these keys are contiguous
+INDEX_KEYS = ['TradeType', 'Year', 'Flow']
+
+# Unit in which new data is ingested: one month of one trade type
+PARTITION_KEYS = ['TradeType', 'Year', 'Period']
+
+
+def _as_list(value):
+    if isinstance(value, (list, tuple, set, np.ndarray, pd.Index)):
+        return list(value)
+    return [value]
+
+
+def is_all(value):
+    """True for a filter value meaning 'no filter' (None or the dropdowns' 'All')"""
+    return value is None or (isinstance(value, str) and value == 'All')
+
+
+def selection(trade_type, year=None, flow=None):
+    """Accepted values at each INDEX_KEYS position (None = any) for a trade type, year(s) and flow(s)"""
+    return [_as_list(trade_type), None if is_all(year) else _as_list(year),
+            None if is_all(flow) else _as_list(flow)]
+
+
+def selected(key, wanted):
+    """True if a (TradeType, Year, Flow) key, or its prefix, is in a selection()"""
+    return all(w is None or k in w for k, w in zip(key, wanted))
+
+
+def partition_mask(df, partitions):
+    """Boolean mask of the rows in any of `partitions`, given as (TradeType, Year, Period) keys"""
+    periods = {}
+    for trade_type, year, period in partitions:
+        periods.setdefault((trade_type, int(year)), set()).add(period)
+
+    mask = np.zeros(len(df), dtype=bool)
+    for (trade_type, year), wanted in periods.items():
+        mask |= ((df['TradeType'] == trade_type) & (df['Year'] == year) & df['Period'].isin(wanted)).to_numpy()
+    return mask
+
+
+class TradeIndex:
+    """A frame sorted by INDEX_KEYS with the row range of every (TradeType, Year, Flow) precomputed.
+
+    select() returns an iloc slice (a view sharing memory with the frame) whenever the
+    requested rows are contiguous, and a take() of just those rows otherwise.
+    """
+
+    def __init__(self, df, keys=INDEX_KEYS):
+        self.keys = [k for k in keys if k in df.columns]
+        if df.empty or not self.keys:
+            self.df = df
+            self._ranges = {}
+            return
+
+        self.df = df.sort_values(self.keys, kind='stable').reset_index(drop=True)
+
+        # Sorted, so each group is one run of rows: sizes in order give start offsets
+        sizes = self.df.groupby(self.keys, observed=True, dropna=False, sort=False).size()
+        stops = sizes.cumsum().to_numpy()
+        starts = stops - sizes.to_numpy()
+        self._ranges = {key: (int(a), int(b)) for key, a, b in zip(sizes.index, starts, stops)}
+
+    def groups(self, trade_type, year=None, flow=None):
+        """(key, start, stop) of each (TradeType, Year, Flow) group matching the selection, in row order"""
+        wanted = selection(trade_type, year, flow)[:len(self.keys)]
+        found = [(key, start, stop) for key, (start, stop) in self._ranges.items() if selected(key, wanted)]
+        return sorted(found, key=lambda group: group[1])
+
+    @property
+    def columns(self):
+        return list(self.df.columns)
+
+    def frames(self, trade_type, year=None, flow=None, columns=None, filters=None):
+        """(key, rows) of each (TradeType, Year, Flow) group matching the selection, in row order,
+        narrowed to the accepted values of `filters` ({column: values, None = any}) and to `columns`
+        """
+        for key, start, stop in self.groups(trade_type, year, flow):
+            rows = self.df.iloc[start:stop]
+            for col, values in (filters or {}).items():
+                if values is not None:
+                    rows = rows[rows[col].isin(values)]
+            yield key, rows[columns] if columns else rows
+
+    def ranges(self, trade_type, year=None, flow=None):
+        """Sorted, merged (start, stop) row ranges matching the selection"""
+        merged = []
+        for _, start, stop in self.groups(trade_type, year, flow):
+            if merged and merged[-1][1] == start:
+                merged[-1] = (merged[-1][0], stop)
+            else:
+                merged.append((start, stop))
+        return merged
+
+    def select(self, trade_type, year=None, flow=None):
+        """Rows for a trade type, optionally narrowed to year(s) and flow(s) ('All'/None = any)"""
+        if not self._ranges:
+            return self.df.iloc[0:0]
+
+        merged = self.ranges(trade_type, year, flow)
+        if not merged:
+            return self.df.iloc[0:0]
+        if len(merged) == 1:
+            start, stop = merged[0]
+            return self.df.iloc[start:stop]
+
+        positions = np.concatenate([np.arange(start, stop) for start, stop in merged])
+        return self.df.take(positions)